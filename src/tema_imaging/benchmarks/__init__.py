@@ -0,0 +1,140 @@
+# This file is part of the TEMAimaging project.
+# Copyright (c) 2020, ETH Zurich
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import datetime
+import json
+import logging
+import statistics
+import subprocess
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+
+class Results:
+    """
+    Collects benchmark metrics and writes them as JSON, so results of
+    different commits can be compared with ``compare``.
+    """
+
+    def __init__(self, suite: str, target: str) -> None:
+        self.suite = suite
+        self.target = target
+        self.metrics: dict[str, dict[str, Any]] = {}
+
+    def add(
+        self, name: str, value: float, unit: str, higher_is_better: bool = False
+    ) -> None:
+        self.metrics[name] = {
+            "value": value,
+            "unit": unit,
+            "higher_is_better": higher_is_better,
+        }
+        logger.info("{}: {:.4g} {}".format(name, value, unit))
+
+    def add_latencies(self, name: str, samples: list[float]) -> None:
+        """Add mean, median, p95 and max of latency samples in seconds as ms."""
+        if not samples:
+            return
+        ordered = sorted(samples)
+        p95 = ordered[min(len(ordered) - 1, round(0.95 * (len(ordered) - 1)))]
+        self.add(name + ".mean", statistics.fmean(samples) * 1000, "ms")
+        self.add(name + ".median", statistics.median(samples) * 1000, "ms")
+        self.add(name + ".p95", p95 * 1000, "ms")
+        self.add(name + ".max", ordered[-1] * 1000, "ms")
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "suite": self.suite,
+            "target": self.target,
+            "commit": _git_commit(),
+            "timestamp": datetime.datetime.now().isoformat(),
+            "metrics": self.metrics,
+        }
+
+    def write(self, path: Path) -> None:
+        with path.open("w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(
+    current: dict[str, Any], baseline: dict[str, Any], threshold: float
+) -> list[str]:
+    """
+    Return a description of every metric that got worse than the baseline by
+    more than ``threshold`` (relative, e.g. 0.2 for 20 %).
+    """
+    regressions = []
+    for name, metric in current["metrics"].items():
+        base = baseline["metrics"].get(name)
+        if base is None or not base["value"]:
+            continue
+
+        change = (metric["value"] - base["value"]) / abs(base["value"])
+        if metric["higher_is_better"]:
+            change = -change
+        if change > threshold:
+            regressions.append(
+                "{}: {:.4g} -> {:.4g} {} ({:+.1%})".format(
+                    name, base["value"], metric["value"], metric["unit"], change
+                )
+            )
+    return regressions
+
+
+def argument_parser(description: str) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("-o", "--output", type=Path, help="write results as JSON")
+    parser.add_argument(
+        "-b", "--baseline", type=Path, help="compare against a results JSON"
+    )
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="relative change counted as regression (default: 0.2)",
+    )
+    return parser
+
+
+def finish(results: Results, args: argparse.Namespace) -> int:
+    """Write and compare the results; returns the process exit code."""
+    if args.output:
+        results.write(args.output)
+
+    if args.baseline:
+        with args.baseline.open() as f:
+            baseline = json.load(f)
+        regressions = compare(results.to_dict(), baseline, args.threshold)
+        for r in regressions:
+            logger.error("Regression: {}".format(r))
+        return 1 if regressions else 0
+    return 0
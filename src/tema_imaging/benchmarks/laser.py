@@ -0,0 +1,108 @@
+# This file is part of the TEMAimaging project.
+# Copyright (c) 2020, ETH Zurich
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Laser protocol benchmarks: query round trip and telemetry throughput per
+pipeline depth. Run from the project root (settings.yml is read from the
+working directory):
+
+    python -m tema_imaging.benchmarks.laser -o laser.json [-b baseline.json]
+
+``--port`` selects the laser: ``simlaser://`` (default, options such as
+``simlaser://?latency=0.02&drop=0.01`` are described in
+``hardware.urlhandler.protocol_simlaser``) or the serial port of a real
+laser, which only gets queries.
+"""
+
+import logging
+import sys
+import time
+
+import serial
+import serial.threaded
+
+from tema_imaging.benchmarks import Results, argument_parser, finish
+from tema_imaging.hardware.laser_compex import CompexLaserProtocol
+from tema_imaging.hardware.urlhandler import register as register_url_handlers
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_DEPTHS = (1, 2, 3, 5)
+
+
+def bench_round_trip(
+    laser: CompexLaserProtocol, results: Results, repeats: int
+) -> None:
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        laser.command_with_response("HV?")
+        samples.append(time.perf_counter() - start)
+    results.add_latencies("query.round_trip", samples)
+
+
+def bench_telemetry(laser: CompexLaserProtocol, results: Results, repeats: int) -> None:
+    """Telemetry polls with gas values (5 queries) per pipeline depth."""
+    depth = laser.pipeline_depth
+    try:
+        for laser.pipeline_depth in PIPELINE_DEPTHS:
+            samples = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                laser.poll_telemetry(gas=True)
+                samples.append(time.perf_counter() - start)
+            name = "telemetry.depth{}".format(laser.pipeline_depth)
+            results.add_latencies(name, samples)
+            results.add(
+                name + ".throughput",
+                5 * len(samples) / sum(samples),
+                "1/s",
+                higher_is_better=True,
+            )
+    finally:
+        laser.pipeline_depth = depth
+
+
+def main() -> int:
+    parser = argument_parser(__doc__)
+    parser.add_argument("--port", default="simlaser://", help="laser port")
+    parser.add_argument("--rate", type=int, default=9600, help="baud rate")
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    register_url_handlers()
+    thread = serial.threaded.ReaderThread(
+        serial.serial_for_url(args.port, timeout=1, baudrate=args.rate),
+        CompexLaserProtocol,
+    )
+    thread.start()
+    laser = thread.connect()[1]
+
+    results = Results("laser", args.port)
+    try:
+        bench_round_trip(laser, results, args.repeats)
+        bench_telemetry(laser, results, args.repeats)
+        results.add("timeouts", laser.timeouts, "")
+    finally:
+        thread.close()
+
+    return finish(results, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+# This file is part of the TEMAimaging project.
+# Copyright (c) 2020, ETH Zurich
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Stage layer benchmarks. Run from the project root (settings.yml is read from
+the working directory):
+
+    python -m tema_imaging.benchmarks.stage -o stage.json [-b baseline.json]
+
+``--stage`` selects the stage: ``sim`` (default) or an MCS locator such as
+``usb:ix:0``. On a real stage the X axis is moved around its current
+position by at most the largest pitch.
+"""
+
+import logging
+import sys
+import threading
+import time
+
+import numpy as np
+
+from tema_imaging.benchmarks import Results, argument_parser, finish
+from tema_imaging.hardware.stage import AxisMovementMode, AxisType, MovementQueue, Stage
+
+logger = logging.getLogger(__name__)
+
+PITCHES = (1000, 5000, 10000, 50000, 100000)  # nm
+
+
+class _Completion:
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.at = 0.0
+
+    def __call__(self) -> None:
+        self.at = time.monotonic()
+        self.event.set()
+
+    def wait(self) -> None:
+        if not self.event.wait(10):
+            raise TimeoutError("Stage did not report completion.")
+        self.event.clear()
+
+
+def bench_moves(stage: Stage, results: Results, repeats: int) -> None:
+    """Spot-to-spot move latency per pitch and completion detection latency."""
+    axis = stage.axes[AxisType.X]
+    axis.movement_mode = AxisMovementMode.CL_ABSOLUTE
+    origin = axis.position
+
+    completion = _Completion()
+    stage.on_movement_completed += completion
+    detection = []
+    try:
+        for pitch in PITCHES:
+            samples = []
+            for i in range(repeats):
+                start = time.perf_counter()
+                axis.move(origin + pitch * ((i + 1) % 2))
+                completion.wait()
+                samples.append(time.perf_counter() - start)
+                # only the simulated stage knows when the axis really stopped
+                stopped_at = getattr(axis, "stopped_at", None)
+                if stopped_at is not None:
+                    detection.append(completion.at - stopped_at)
+            results.add_latencies("move.{}nm".format(pitch), samples)
+    finally:
+        stage.on_movement_completed -= completion
+
+    results.add_latencies("poll.detection", detection)
+
+
+def bench_trigger_frame(stage: Stage, results: Results, repeats: int) -> None:
+    axis = stage.axes[AxisType.X]
+    axis.movement_mode = AxisMovementMode.CL_ABSOLUTE
+    stage.axes[AxisType.Y].movement_mode = AxisMovementMode.CL_ABSOLUTE
+    origin_x = axis.position
+    origin_y = stage.axes[AxisType.Y].position
+
+    frames = np.zeros((repeats, 2), dtype=np.int32)
+    frames[:, 0] = origin_x + PITCHES[0] * (np.arange(repeats) % 2)
+    frames[:, 1] = origin_y
+    stage.movement_queue.clear()
+    stage.movement_queue.extend(frames, MovementQueue.AXES_XY)
+
+    completion = _Completion()
+    stage.on_frame_completed += completion
+    samples = []
+    try:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            stage.trigger_frame()
+            samples.append(time.perf_counter() - start)
+            completion.wait()
+    finally:
+        stage.on_frame_completed -= completion
+
+    results.add_latencies("trigger_frame", samples)
+
+
+def bench_position_reads(stage: Stage, results: Results, duration: float) -> None:
+    axis = stage.axes[AxisType.X]
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        _ = axis.position
+        count += 1
+    rate = count / (time.perf_counter() - start)
+    results.add("position.read_rate", rate, "1/s", higher_is_better=True)
+
+
+def bench_queue(results: Results, count: int) -> None:
+    queue = MovementQueue(count)
+    frame: dict[AxisType, float] = {AxisType.X: 1e3, AxisType.Y: 2e3, AxisType.Z: 3e3}
+
+    start = time.perf_counter()
+    for _ in range(count):
+        queue.put(frame)
+    results.add(
+        "queue.put_rate",
+        count / (time.perf_counter() - start),
+        "1/s",
+        higher_is_better=True,
+    )
+
+    start = time.perf_counter()
+    for _ in range(count):
+        queue.pop()
+    results.add(
+        "queue.pop_rate",
+        count / (time.perf_counter() - start),
+        "1/s",
+        higher_is_better=True,
+    )
+
+    frames = np.zeros((count, 3), dtype=np.int32)
+    start = time.perf_counter()
+    queue.extend(frames)
+    results.add(
+        "queue.extend_rate",
+        count / (time.perf_counter() - start),
+        "1/s",
+        higher_is_better=True,
+    )
+
+
+def main() -> int:
+    parser = argument_parser(__doc__)
+    parser.add_argument("--stage", default="sim", help="sim or an MCS locator")
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.stage.startswith("sim"):
+        from tema_imaging.hardware.stage.sim_stage import SimStage
+
+        stage: Stage = SimStage(args.stage)
+    else:
+        from tema_imaging.hardware.stage.mcs_stage import MCSStage
+
+        stage = MCSStage(args.stage)
+
+    results = Results("stage", args.stage)
+    stage.connect()
+    try:
+        bench_moves(stage, results, args.repeats)
+        bench_trigger_frame(stage, results, args.repeats)
+        bench_position_reads(stage, results, 1.0)
+    finally:
+        stage.disconnect()
+    bench_queue(results, 100_000)
+
+    return finish(results, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
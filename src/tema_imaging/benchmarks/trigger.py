@@ -0,0 +1,208 @@
+# This file is part of the TEMAimaging project.
+# Copyright (c) 2020, ETH Zurich
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Trigger benchmarks, from the trigger commands up to complete scans on the
+simulated stage. Run from the project root (settings.yml is read from the
+working directory):
+
+    python -m tema_imaging.benchmarks.trigger -o trigger.json [-b baseline.json]
+
+``--port`` selects the trigger: ``simtrigger://`` (default) or the serial
+port of a real trigger. Overheads are the measured times minus the time the
+shots take at the configured frequency.
+"""
+
+import logging
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image
+
+import tema_imaging.core.scanner_registry
+from tema_imaging.benchmarks import Results, argument_parser, finish
+from tema_imaging.core.conn_mgr import conn_mgr
+from tema_imaging.core.measurement import Measurement
+from tema_imaging.hardware.arduino_trigger import (
+    PROTOCOL_BATCHED_CONFIG,
+    PROTOCOL_SPOT_PROGRAM,
+    ArduTrigger,
+)
+from tema_imaging.hardware.stage.sim_stage import SimStage
+from tema_imaging.hardware.trigger_program import spot_program
+from tema_imaging.scans import Scan
+from tema_imaging.scans.engraver import Engraver
+from tema_imaging.scans.line import LineScan
+from tema_imaging.scans.rectangle import RectangleScan
+
+logger = logging.getLogger(__name__)
+
+FREQUENCY = 1000  # Hz
+SHOT_COUNTS = (1, 10)
+SPOT_SIZE = 10000  # nm
+
+
+def bench_commands(trigger: ArduTrigger, results: Results, repeats: int) -> None:
+    samples = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        trigger.configure(1 + i % 2, FREQUENCY, True)
+        samples.append(time.perf_counter() - start)
+    results.add_latencies("configure", samples)
+
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        trigger.single_tof()
+        samples.append(time.perf_counter() - start)
+    results.add_latencies("single_tof", samples)
+
+
+def bench_spots(trigger: ArduTrigger, results: Results, repeats: int) -> None:
+    """go_and_wait and program steps per shot count."""
+    for count in SHOT_COUNTS:
+        trigger.configure(count, FREQUENCY, True)
+        shot_time = count / FREQUENCY
+
+        samples = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            trigger.go_and_wait()
+            samples.append(time.perf_counter() - start - shot_time)
+        results.add_latencies("go_and_wait.{}shots.overhead".format(count), samples)
+
+        if not trigger.upload_program(spot_program(repeats, count)):
+            continue
+        samples = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            trigger.step_and_wait()
+            samples.append(time.perf_counter() - start - shot_time)
+        results.add_latencies("step.{}shots.overhead".format(count), samples)
+        trigger.clear_program()
+
+
+def run_scan(scan: Scan) -> tuple[float, float]:
+    """Returns the duration of the scan initialization and of the spots."""
+    start = time.perf_counter()
+    scan.init_scan(Measurement())
+    init_done = time.perf_counter()
+    while scan.next_move():
+        scan.next_shot()
+    scan.done()
+    return init_done - start, time.perf_counter() - init_done
+
+
+def bench_scans(trigger: ArduTrigger, results: Results, spots: int) -> None:
+    """Complete scans, with programs and with a go per spot."""
+    side = max(1, round(spots**0.5))
+    scans = {
+        "rectangle": lambda: RectangleScan(
+            SPOT_SIZE,
+            1,
+            FREQUENCY,
+            x_size=side * SPOT_SIZE,
+            y_size=side * SPOT_SIZE,
+            x_start=0,
+            y_start=0,
+            z_start=0,
+        ),
+        "line": lambda: LineScan(
+            SPOT_SIZE,
+            1,
+            FREQUENCY,
+            spot_count=spots,
+            x_start=0,
+            y_start=0,
+            z_start=0,
+            z_end=0,
+        ),
+        "engraver": lambda: Engraver(
+            SPOT_SIZE,
+            1,
+            FREQUENCY,
+            Image.new("1", (side, side), 0),
+            x_start=0,
+            y_start=0,
+            z_start=0,
+        ),
+    }
+
+    protocol_version = trigger.protocol_version
+    modes = {"go": min(protocol_version, PROTOCOL_BATCHED_CONFIG)}
+    if protocol_version >= PROTOCOL_SPOT_PROGRAM:
+        modes["step"] = protocol_version
+    # keep the measurement logs of the scans out of the project logs
+    log_dir = tempfile.TemporaryDirectory()
+    meas_log_dir = Scan._meas_log_dir
+    Scan._meas_log_dir = Path(log_dir.name)
+    try:
+        for mode, version in modes.items():
+            trigger.protocol_version = version
+            for name, create in scans.items():
+                scan = create()
+                count = len(scan.coord_list)
+                init, duration = run_scan(scan)
+                results.add("scan.{}.{}.init".format(name, mode), init * 1000, "ms")
+                results.add(
+                    "scan.{}.{}.per_spot".format(name, mode),
+                    duration / count * 1000,
+                    "ms",
+                )
+    finally:
+        trigger.protocol_version = protocol_version
+        Scan._meas_log_dir = meas_log_dir
+        log_dir.cleanup()
+
+
+def main() -> int:
+    parser = argument_parser(__doc__)
+    parser.add_argument("--port", default="simtrigger://", help="trigger port")
+    parser.add_argument("--rate", type=int, default=19200, help="baud rate")
+    parser.add_argument("--repeats", type=int, default=100)
+    parser.add_argument("--spots", type=int, default=100, help="spots per scan")
+    args = parser.parse_args()
+
+    # connecting on startup may already have configured logging
+    logging.basicConfig(level=logging.INFO, force=True)
+
+    conn_mgr.trigger_connect(args.port, args.rate)
+    trigger = conn_mgr.trigger
+    conn_mgr.stage = SimStage()
+    conn_mgr.stage.connect()
+
+    results = Results("trigger", args.port)
+    try:
+        bench_commands(trigger, results, args.repeats)
+        bench_spots(trigger, results, args.repeats)
+        trigger.reset_statistics()
+        bench_scans(trigger, results, args.spots)
+        for name in ("wakeup_latency", "done_latency"):
+            summary = getattr(trigger, name).summary()
+            if summary is not None:
+                results.add("{}.mean".format(name), summary[0], "ms")
+                results.add("{}.p95".format(name), summary[1], "ms")
+    finally:
+        conn_mgr.stage.disconnect()
+        conn_mgr.trigger_disconnect()
+
+    return finish(results, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+# This file is part of the TEMAimaging project.
+# Copyright (c) 2020, ETH Zurich
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import math
+import threading
+import time
+from typing import NamedTuple
+
+import numpy as np
+
+from tema_imaging.core.settings import Settings
+from tema_imaging.hardware.camera import FrameMailbox
+from tema_imaging.hardware.stage import AxisMovementMode, AxisType, Stage, StageError
+
+logger = logging.getLogger(__name__)
+
+INV_PHI = (math.sqrt(5) - 1) / 2
+
+
+class AutofocusError(StageError):
+    pass
+
+
+class AutofocusResult(NamedTuple):
+    z: int  # nm
+    sharpness: float
+    moves: int
+    frames: int
+    duration: float  # s
+
+
+def sharpness(frame: np.ndarray, roi: float = 1.0) -> float:
+    """
+    Variance of the Laplacian of the central ``roi`` fraction (per side) of
+    a grayscale or RGB(A) frame, higher is sharper.
+    """
+    h, w = frame.shape[:2]
+    dy = int(h * (1 - roi) / 2)
+    dx = int(w * (1 - roi) / 2)
+    frame = frame[dy : h - dy, dx : w - dx]
+
+    if frame.ndim == 3:
+        gray = frame[..., :3].mean(axis=2, dtype=np.float32)
+    else:
+        gray = frame.astype(np.float32)
+
+    laplacian = (
+        gray[1:-1, :-2]
+        + gray[1:-1, 2:]
+        + gray[:-2, 1:-1]
+        + gray[2:, 1:-1]
+        - 4 * gray[1:-1, 1:-1]
+    )
+    return float(laplacian.var())
+
+
+class Autofocus:
+    """
+    Moves Z to the sharpest camera image. A coarse scan over ``span`` (nm)
+    on both sides of the start brackets the sharpness maximum, a
+    golden-section search narrows the bracket down to ``tolerance`` (nm).
+    Every Z is imaged once, the golden section needs one new Z per step.
+    """
+
+    def __init__(
+        self,
+        stage: Stage,
+        frames: FrameMailbox,
+        span: int | None = None,
+        tolerance: int | None = None,
+        coarse_steps: int | None = None,
+        settle_frames: int | None = None,
+        roi: float | None = None,
+    ) -> None:
+        self.stage = stage
+        self.frames = frames
+        self.span = Settings.get("camera.autofocus.span") if span is None else span
+        self.tolerance = (
+            Settings.get("camera.autofocus.tolerance")
+            if tolerance is None
+            else tolerance
+        )
+        self.coarse_steps = max(
+            3,
+            (
+                Settings.get("camera.autofocus.coarse_steps")
+                if coarse_steps is None
+                else coarse_steps
+            ),
+        )
+        # frames exposed (partly) during the move are skipped
+        self.settle_frames = (
+            Settings.get("camera.autofocus.settle_frames")
+            if settle_frames is None
+            else settle_frames
+        )
+        self.roi = Settings.get("camera.autofocus.roi") if roi is None else roi
+        self.frame_timeout = 1.0
+        self.move_timeout = 10.0
+
+        self._axis = stage.axes[AxisType.Z]
+        self._moved = threading.Event()
+        self._scores: dict[int, float] = {}
+        self._moves = 0
+        self._frames = 0
+
+    def run(self, z: int | None = None) -> AutofocusResult:
+        """Focus around ``z`` (default: the current position)."""
+        start = time.perf_counter()
+        self._scores.clear()
+        self._moves = 0
+        self._frames = 0
+
+        self._axis.movement_mode = AxisMovementMode.CL_ABSOLUTE
+        self.stage.on_movement_completed += self._on_movement_completed
+        try:
+            z = self._axis.position if z is None else z
+            a, b = self._coarse(z)
+            self._golden_section(a, b)
+            best = max(self._scores, key=self._scores.__getitem__)
+            self._move(best)
+        finally:
+            self.stage.on_movement_completed -= self._on_movement_completed
+
+        result = AutofocusResult(
+            best,
+            self._scores[best],
+            self._moves,
+            self._frames,
+            time.perf_counter() - start,
+        )
+        logger.info(
+            "autofocus: Z {} nm in {:.2f} s ({} moves, {} frames)".format(
+                result.z, result.duration, result.moves, result.frames
+            )
+        )
+        return result
+
+    def _coarse(self, z: int) -> tuple[int, int]:
+        """Sharpness on an even grid around z, returns the bracket of the best."""
+        low, high = self._axis.position_limit
+        grid = np.linspace(z - self.span, z + self.span, self.coarse_steps)
+        grid = np.unique(np.clip(np.rint(grid), low, high).astype(np.int64))
+        # start at the end nearer to the current position
+        if abs(grid[-1] - self._axis.position) < abs(grid[0] - self._axis.position):
+            grid = grid[::-1]
+        scores = [self._measure(int(g)) for g in grid]
+
+        i = int(np.argmax(scores))
+        return int(grid[max(i - 1, 0)]), int(grid[min(i + 1, len(grid) - 1)])
+
+    def _golden_section(self, a: int, b: int) -> None:
+        if a > b:
+            a, b = b, a
+        c = round(b - (b - a) * INV_PHI)
+        d = round(a + (b - a) * INV_PHI)
+        fc = self._measure(c)
+        fd = self._measure(d)
+        while b - a > self.tolerance and c < d:
+            if fc >= fd:
+                b, d, fd = d, c, fc
+                c = round(b - (b - a) * INV_PHI)
+                fc = self._measure(c)
+            else:
+                a, c, fc = c, d, fd
+                d = round(a + (b - a) * INV_PHI)
+                fd = self._measure(d)
+
+    def _measure(self, z: int) -> float:
+        if z not in self._scores:
+            self._move(z)
+            self._scores[z] = sharpness(self._next_frame(), self.roi)
+        return self._scores[z]
+
+    def _move(self, z: int) -> None:
+        if self._axis.position == z:
+            return
+        self._moved.clear()
+        self._axis.move(z)
+        self._moves += 1
+        if not self._moved.wait(self.move_timeout):
+            raise AutofocusError("Z axis did not reach {} nm.".format(z))
+
+    def _next_frame(self) -> np.ndarray:
+        latest = self.frames.next(self.settle_frames, self.frame_timeout)
+        if latest is None:
+            raise AutofocusError("No camera frame for autofocus.")
+        self._frames += self.settle_frames + 1
+        return latest[1]
+
+    def _on_movement_completed(self) -> None:
+        self._moved.set()
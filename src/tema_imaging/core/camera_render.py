@@ -0,0 +1,126 @@
+# This file is part of the TEMAimaging project.
+# Copyright (c) 2020, ETH Zurich
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from tema_imaging.hardware.camera import FrameMailbox
+
+
+class CameraView:
+    """
+    RGB image of one view size, triple buffered: the renderer fills the
+    back buffer and publishes it, the reader takes the latest published
+    buffer. Neither side waits for the other's copy.
+    """
+
+    def __init__(self, width: int, height: int) -> None:
+        self.width = width
+        self.height = height
+        self.active = True  # rendered only while shown
+        self._lock = threading.Lock()
+        self._back = np.zeros((height, width, 3), dtype=np.uint8)
+        self._ready = np.zeros_like(self._back)
+        self._front = np.zeros_like(self._back)
+        self._ready_number = 0
+
+    def render(self, image: Image.Image, number: int) -> None:
+        """
+        Scale ``image`` (RGB) into the back buffer, keeping its aspect ratio
+        as frames of other profiles may have, and publish it.
+        """
+        scale = min(self.width / image.width, self.height / image.height)
+        width = min(max(round(image.width * scale), 1), self.width)
+        height = min(max(round(image.height * scale), 1), self.height)
+        x = (self.width - width) // 2
+        y = (self.height - height) // 2
+        if (width, height) != (self.width, self.height):
+            self._back[...] = 0
+        self._back[y : y + height, x : x + width] = image.resize(
+            (width, height), Image.BILINEAR, reducing_gap=2.0
+        )
+        with self._lock:
+            self._back, self._ready = self._ready, self._back
+            self._ready_number = number
+
+    def take(self, after: int = 0) -> tuple[int, np.ndarray] | None:
+        """
+        Number and pixels of the latest rendered frame if it is newer than
+        ``after``. The pixels stay unchanged until the next ``take``.
+        """
+        with self._lock:
+            if self._ready_number <= after:
+                return None
+            self._front, self._ready = self._ready, self._front
+            number = self._ready_number
+            self._ready_number = 0
+        return number, self._front
+
+
+class CameraRenderer:
+    """
+    Scales the latest camera frame once for each active view, on its own
+    thread and at most at ``max_fps``, so that the UI thread only copies
+    the finished pixels.
+    """
+
+    def __init__(self, frames: FrameMailbox, max_fps: float) -> None:
+        self.frames = frames
+        self.interval = 1 / max_fps
+        self._views: tuple[CameraView, ...] = ()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def add_view(self, width: int, height: int) -> CameraView:
+        view = CameraView(width, height)
+        with self._lock:
+            self._views = self._views + (view,)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="camera-render")
+                self._thread.daemon = True
+                self._thread.start()
+        return view
+
+    def remove_view(self, view: CameraView) -> None:
+        with self._lock:
+            self._views = tuple(v for v in self._views if v is not view)
+
+    def _run(self) -> None:
+        number = 0
+        deadline = time.monotonic()
+        while True:
+            latest = self.frames.wait(number, 1.0)
+            if latest is None:
+                continue
+            # skip the frame without a view to render it for, waiting for
+            # the next one instead of taking this one again
+            number, frame = latest
+            views = [v for v in self._views if v.active]
+            if not views:
+                continue
+
+            # shared by all views
+            image = Image.fromarray(frame)
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            for view in views:
+                view.render(image, number)
+
+            deadline = max(deadline + self.interval, time.monotonic())
+            time.sleep(max(deadline - time.monotonic(), 0))
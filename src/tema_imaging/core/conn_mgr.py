@@ -14,31 +14,43 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+import datetime
 import logging
 
+import numpy as np
 import serial
 import serial.threaded
-from PIL import Image
 from pubsub import pub
 
+from tema_imaging.core.recorder import FrameRecorder
 from tema_imaging.core.settings import Settings
+from tema_imaging.core.telemetry import stage_positions
+from tema_imaging.core.utils import get_project_root
 from tema_imaging.hardware.arduino_trigger import ArduTrigger
 from tema_imaging.hardware.camera import (
+    AcquisitionProfile,
     Camera,
     CameraException,
     CameraThread,
+    FrameMailbox,
+    FrameStatistics,
     camera_resolutions,
 )
 from tema_imaging.hardware.laser_compex import CompexLaserProtocol
 from tema_imaging.hardware.shutter import AIODevice, Shutter, ShutterException
 from tema_imaging.hardware.stage import AxisType, Stage
 from tema_imaging.hardware.stage.mcs_stage import MCSStage
+from tema_imaging.hardware.stage.sim_stage import SimStage
+from tema_imaging.hardware.urlhandler import register as register_url_handlers
 from tema_imaging.hardware.utils import (
     LaserStatusPoller,
     ShutterStatusPoller,
     StagePositionPoller,
 )
 
+# simulated devices, simtrigger:// as trigger and simlaser:// as laser port
+register_url_handlers()
+
 
 class ConnectionManager:
     def __init__(self) -> None:
@@ -65,6 +77,9 @@ class ConnectionManager:
         self.camera: Camera | None = None
         self.camera_connected = False
         self._camera_thread = None
+        # latest frame for the GUI, which takes it at its own rate
+        self.camera_frames = FrameMailbox()
+        self.recorder: FrameRecorder | None = None
 
         if Settings.get("general.connect_on_startup"):
             # try:
@@ -139,6 +154,7 @@ class ConnectionManager:
             self._trigger_thread.start()
 
             transport, self.trigger = self._trigger_thread.connect()
+            self.trigger.detect_protocol()
 
             self.trigger_connected = True
             pub.sendMessage("trigger.connection_changed", connected=True)
@@ -177,7 +193,10 @@ class ConnectionManager:
 
     def stage_connect(self, port: str) -> None:
         if not self.stage_connected:
-            self.stage = MCSStage(port)
+            if port.startswith("sim"):
+                self.stage = SimStage(port)
+            else:
+                self.stage = MCSStage(port)
             self.stage.connect()
 
             if Settings.get("stage.find_ref_on_connect"):
@@ -206,6 +225,7 @@ class ConnectionManager:
         if self.stage_connected:
             self._stage_position_poller.stop()
             self.stage.disconnect()
+            stage_positions.clear()
 
             self.stage_connected = False
             pub.sendMessage("stage.connection_changed", connected=False)
@@ -232,21 +252,137 @@ class ConnectionManager:
                 except CameraException:
                     self.camera = None
                     return
+                # the AOI is centered within the frame size the driver uses,
+                # the camera thread applies it before the first frame
+                try:
+                    self.camera.set_profile(
+                        self.camera_profile(Settings.get("camera.profile"))
+                    )
+                except ValueError as e:
+                    logging.error(e)
+                # pacing depends on the driver, e.g. v4l2 delivers frames
+                # faster than the UI can take them
+                frame_rate = Settings.get("camera.frame_rate").get(driver, {})
                 self._camera_thread = CameraThread(
-                    self.camera, notify=ConnectionManager.camera_notify_image_acquired
+                    self.camera,
+                    notify=self.camera_notify_image_acquired,
+                    target_fps=frame_rate.get("target", 0),
+                    max_fps=frame_rate.get("max", 0),
+                    on_statistics=self.camera_notify_statistics,
                 )
                 self._camera_thread.start()
                 self.camera_connected = True
                 pub.sendMessage("camera.connection_changed", connected=True)
 
+    def camera_notify_image_acquired(
+        self, camera: Camera, frame: np.ndarray, captured_ns: int
+    ) -> None:
+        # the poller's latest reading, a stage query per frame would stall
+        # the camera thread
+        position = stage_positions.nearest(captured_ns)
+        self.camera_frames.put(frame)
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.submit(frame, captured_ns, position)
+        # on the camera thread, listeners must not keep the frame
+        pub.sendMessage(
+            "camera.image_acquired",
+            camera=camera,
+            frame=frame,
+            captured_ns=captured_ns,
+            position=position,
+        )
+
+    def camera_profile(self, name: str) -> AcquisitionProfile:
+        """
+        Profile ``name`` of ``camera.profiles``, its AOI (width, height) is
+        centered on ``camera.ablation_site`` as far as the frame allows.
+        Raises ValueError if the camera can't bin by the profile's factor.
+        """
+        config = Settings.get("camera.profiles.{}".format(name))
+        binning = int(config.get("binning", 1))
+        factors = self.camera.binning_factors
+        if binning < 1 or (factors is not None and binning not in factors):
+            raise ValueError(
+                "Binning {} of profile '{}' is not supported by the {} camera".format(
+                    binning, name, self.camera.driver_name
+                )
+            )
+        aoi = None
+        if config.get("aoi"):
+            full_width, full_height = self.camera.img_width, self.camera.img_height
+            width = min(config["aoi"][0], full_width)
+            height = min(config["aoi"][1], full_height)
+            center_x, center_y = Settings.get("camera.ablation_site")
+            aoi = (
+                min(max(center_x - width // 2, 0), full_width - width),
+                min(max(center_y - height // 2, 0), full_height - height),
+                width,
+                height,
+            )
+        return AcquisitionProfile(bool(config.get("mono", False)), aoi, binning)
+
+    def camera_set_profile(self, name: str) -> None:
+        """
+        Switch the camera to the acquisition profile ``name``. Raises
+        ValueError if the connected camera doesn't support it.
+        """
+        # used from the next connection on if not connected
+        if self.camera_connected:
+            self.camera.set_profile(self.camera_profile(name))
+        Settings.set("camera.profile", name)
+        pub.sendMessage("camera.profile_changed", name=name)
+
     @staticmethod
-    def camera_notify_image_acquired(camera: Camera, image: Image.Image) -> None:
-        pub.sendMessage("camera.image_acquired", camera=camera, image=image)
+    def camera_notify_statistics(statistics: FrameStatistics) -> None:
+        # on the camera thread
+        pub.sendMessage("camera.statistics_changed", statistics=statistics)
+
+    def camera_start_recording(self) -> FrameRecorder | None:
+        """Record the camera as configured in ``camera.record``."""
+        if not self.camera_connected or self.recorder is not None:
+            return self.recorder
+
+        around_shots = None
+        if Settings.get("camera.record.shots_only"):
+            around_shots = (
+                Settings.get("camera.record.before"),
+                Settings.get("camera.record.after"),
+            )
+        recorder = FrameRecorder(
+            get_project_root()
+            / "logs"
+            / "recording_{}".format(datetime.datetime.now().isoformat()),
+            Settings.get("camera.record.format"),
+            Settings.get("camera.record.every"),
+            around_shots,
+            Settings.get("camera.record.queue_size"),
+        )
+        if around_shots is not None and self.trigger_connected:
+            self.trigger.on_done += recorder.on_shot
+        self.recorder = recorder
+        pub.sendMessage("camera.recording_changed", recording=True)
+        return recorder
+
+    def camera_stop_recording(self) -> None:
+        recorder = self.recorder
+        if recorder is None:
+            return
+        self.recorder = None
+        if self.trigger is not None:
+            self.trigger.on_done -= recorder.on_shot
+        recorder.stop()
+        pub.sendMessage("camera.recording_changed", recording=False)
 
     def camera_disconnect(self) -> None:
         if self.camera_connected:
+            self.camera_stop_recording()
             self._camera_thread.stop()
             self._camera_thread = None
+            logging.info(
+                "camera: {} frames not displayed".format(self.camera_frames.skipped)
+            )
+            self.camera_frames.clear()
             try:
                 self.camera.close()
             except CameraException:
@@ -0,0 +1,175 @@
+# This file is part of the TEMAimaging project.
+# Copyright (c) 2020, ETH Zurich
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import enum
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class FocusMapMethod(enum.Enum):
+    PLANE = "plane"
+    BILINEAR = "bilinear"
+    THIN_PLATE = "thin_plate"
+
+
+_min_points = {
+    FocusMapMethod.PLANE: 3,
+    FocusMapMethod.BILINEAR: 4,
+    FocusMapMethod.THIN_PLATE: 3,
+}
+
+
+def _tps_kernel(r: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(r > 0, r * r * np.log(r), 0.0)
+
+
+class FocusMap:
+    """
+    Sample surface Z(X, Y) fitted through recorded focus points (all in nm).
+    """
+
+    def __init__(
+        self, method: FocusMapMethod = FocusMapMethod.PLANE, z_tolerance: int = 1000
+    ) -> None:
+        self.method = method
+        self.z_tolerance = z_tolerance
+        self.points = np.empty((0, 3), dtype=np.float64)
+
+        self._center = np.zeros(2)
+        self._scale = 1.0
+        self._coeffs: np.ndarray | None = None
+        self._ctrl: np.ndarray | None = None
+
+    def __getstate__(self):
+        return {
+            "method": self.method.value,
+            "z_tolerance": self.z_tolerance,
+            "points": self.points.tolist(),
+        }
+
+    def __setstate__(self, state):
+        self.__init__(FocusMapMethod(state["method"]), state["z_tolerance"])
+        if state["points"]:
+            self.points = np.array(state["points"], dtype=np.float64).reshape(-1, 3)
+            self.fit()
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    @property
+    def ready(self) -> bool:
+        return self._coeffs is not None
+
+    def add_point(self, x: float, y: float, z: float) -> None:
+        self.points = np.vstack((self.points, (x, y, z)))
+        self.fit()
+
+    def clear(self) -> None:
+        self.points = np.empty((0, 3), dtype=np.float64)
+        self._coeffs = None
+        self._ctrl = None
+
+    def set_method(self, method: FocusMapMethod) -> None:
+        self.method = method
+        self.fit()
+
+    def _normalize(
+        self,
+        x: np.ndarray,
+        y: np.ndarray,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        return (x - self._center[0]) / self._scale, (y - self._center[1]) / self._scale
+
+    def fit(self) -> None:
+        """
+        Fit the surface through the recorded points. The map stays unfitted
+        (not ready) while there are fewer points than the method needs.
+        """
+        self._coeffs = None
+        self._ctrl = None
+        if len(self.points) < _min_points[self.method]:
+            return
+
+        # work in normalized coordinates, stage positions are ~1e7 nm
+        self._center = self.points[:, :2].mean(axis=0)
+        self._scale = float(np.ptp(self.points[:, :2], axis=0).max()) or 1.0
+        x, y = self._normalize(self.points[:, 0], self.points[:, 1])
+        z = self.points[:, 2]
+
+        if self.method == FocusMapMethod.PLANE:
+            a = np.column_stack((np.ones_like(x), x, y))
+            self._coeffs = np.linalg.lstsq(a, z, rcond=None)[0]
+        elif self.method == FocusMapMethod.BILINEAR:
+            a = np.column_stack((np.ones_like(x), x, y, x * y))
+            self._coeffs = np.linalg.lstsq(a, z, rcond=None)[0]
+        else:
+            n = len(z)
+            r = np.hypot(x[:, None] - x[None, :], y[:, None] - y[None, :])
+            p = np.column_stack((np.ones(n), x, y))
+            a = np.zeros((n + 3, n + 3))
+            a[:n, :n] = _tps_kernel(r)
+            a[:n, n:] = p
+            a[n:, :n] = p.T
+            b = np.concatenate((z, np.zeros(3)))
+            self._coeffs = np.linalg.lstsq(a, b, rcond=None)[0]
+            self._ctrl = np.column_stack((x, y))
+
+        logger.info(
+            "Focus map fitted ({}, {} points)".format(self.method.value, len(z))
+        )
+
+    def evaluate(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        if self._coeffs is None:
+            raise ValueError("Focus map has not enough points to be evaluated.")
+
+        x, y = self._normalize(np.asarray(x, np.float64), np.asarray(y, np.float64))
+        c = self._coeffs
+
+        if self.method == FocusMapMethod.PLANE:
+            return c[0] + c[1] * x + c[2] * y
+        elif self.method == FocusMapMethod.BILINEAR:
+            return c[0] + c[1] * x + c[2] * y + c[3] * x * y
+
+        n = len(self._ctrl)
+        r = np.hypot(x[..., None] - self._ctrl[:, 0], y[..., None] - self._ctrl[:, 1])
+        return _tps_kernel(r) @ c[:n] + c[n] + c[n + 1] * x + c[n + 2] * y
+
+    def apply(self, xy: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Compute the Z of every spot of an (N, 2) plan. Returns the Z positions
+        and a bool array of the spots where a Z move has to be issued: the
+        first spot and every spot deviating more than ``z_tolerance`` from the
+        last Z moved to. Spots without a Z move carry that last Z.
+        """
+        z = np.rint(self.evaluate(xy[:, 0], xy[:, 1])).astype(np.int32)
+        moves = np.zeros(len(z), dtype=bool)
+        if not len(z):
+            return z, moves
+
+        # deadband: depends on the last emitted value, so it can't be a ufunc
+        last = int(z[0])
+        moves[0] = True
+        for i, v in enumerate(z.tolist()):
+            if abs(v - last) > self.z_tolerance:
+                last = v
+                moves[i] = True
+            else:
+                z[i] = last
+        return z, moves
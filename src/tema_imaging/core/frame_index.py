@@ -0,0 +1,157 @@
+# This file is part of the TEMAimaging project.
+# Copyright (c) 2020, ETH Zurich
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from tema_imaging.core.telemetry import StagePosition
+
+
+class FrameIndex:
+    """
+    Capture time and stage position of recorded frames, to find the frames
+    of a time range or of a stage region.
+
+    Frames are appended in capture order, so a time range is two binary
+    searches. Region queries binary search the frames sorted by X, which is
+    rebuilt after appends on the next query, and check the rest only within
+    the smaller of the X and the time range. Positions are in nm, frames
+    without a position are NaN and never match a region.
+    """
+
+    def __init__(self, capacity: int = 1024) -> None:
+        self._number = np.zeros(capacity, dtype=np.int64)
+        self._time = np.zeros(capacity, dtype=np.int64)  # time.monotonic_ns()
+        self._xyz = np.zeros((capacity, 3), dtype=np.float64)
+        self._size = 0
+        self._lock = threading.Lock()
+
+        # order of the frames by X and their X, None after appends
+        self._by_x: np.ndarray | None = None
+        self._sorted_x: np.ndarray | None = None
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(
+        self, number: int, captured_ns: int, position: StagePosition | None
+    ) -> None:
+        with self._lock:
+            if self._size == len(self._time):
+                self._grow()
+            i = self._size
+            self._number[i] = number
+            self._time[i] = captured_ns
+            self._xyz[i] = (
+                np.nan if position is None else (position.x, position.y, position.z)
+            )
+            self._size += 1
+            self._by_x = None
+
+    def _grow(self) -> None:
+        capacity = 2 * len(self._time)
+        self._number = np.resize(self._number, capacity)
+        self._time = np.resize(self._time, capacity)
+        self._xyz = np.resize(self._xyz, (capacity, 3))
+
+    def between(self, start_ns: int, end_ns: int) -> np.ndarray:
+        """Numbers of the frames captured from ``start_ns`` to ``end_ns``."""
+        with self._lock:
+            times = self._time[: self._size]
+            lo = np.searchsorted(times, start_ns, side="left")
+            hi = np.searchsorted(times, end_ns, side="right")
+            return self._number[lo:hi].copy()
+
+    def in_region(
+        self,
+        x0: float,
+        y0: float,
+        x1: float,
+        y1: float,
+        start_ns: int | None = None,
+        end_ns: int | None = None,
+    ) -> np.ndarray:
+        """
+        Numbers of the frames taken within the stage rectangle from
+        (``x0``, ``y0``) to (``x1``, ``y1``), optionally only those from a
+        time range, in capture order.
+        """
+        with self._lock:
+            if self._by_x is None:
+                x = self._xyz[: self._size, 0]
+                # NaN sorts last and is never in range
+                self._by_x = np.argsort(x, kind="stable")
+                self._sorted_x = x[self._by_x]
+            lo = np.searchsorted(self._sorted_x, min(x0, x1), side="left")
+            hi = np.searchsorted(self._sorted_x, max(x0, x1), side="right")
+            times = self._time[: self._size]
+            t_lo = 0 if start_ns is None else np.searchsorted(times, start_ns, "left")
+            t_hi = (
+                self._size
+                if end_ns is None
+                else np.searchsorted(times, end_ns, side="right")
+            )
+
+            # check the smaller of the X and the time range
+            if hi - lo <= t_hi - t_lo:
+                candidates = np.sort(self._by_x[lo:hi])
+                candidates = candidates[(candidates >= t_lo) & (candidates < t_hi)]
+            else:
+                candidates = np.arange(t_lo, t_hi)
+                x = self._xyz[candidates, 0]
+                candidates = candidates[(x >= min(x0, x1)) & (x <= max(x0, x1))]
+            y = self._xyz[candidates, 1]
+            return self._number[candidates[(y >= min(y0, y1)) & (y <= max(y0, y1))]]
+
+    def near(
+        self,
+        x: float,
+        y: float,
+        radius: float,
+        start_ns: int | None = None,
+        end_ns: int | None = None,
+    ) -> np.ndarray:
+        """Numbers of the frames within ``radius`` (per axis) of ``x``, ``y``."""
+        return self.in_region(
+            x - radius, y - radius, x + radius, y + radius, start_ns, end_ns
+        )
+
+    def position(self, number: int) -> tuple[int, float, float, float] | None:
+        """Capture time and position of frame ``number``."""
+        with self._lock:
+            numbers = self._number[: self._size]
+            i = np.searchsorted(numbers, number)
+            if i == self._size or numbers[i] != number:
+                return None
+            return int(self._time[i]), *self._xyz[i].tolist()
+
+    @classmethod
+    def load(cls, directory: Path) -> "FrameIndex":
+        """Index of a recording, from its ``frames.csv``."""
+        path = directory / "frames.csv"
+        # capture times in ns exceed the exact integers of float64
+        ids = np.loadtxt(
+            path, delimiter=",", skiprows=1, usecols=(0, 1), dtype=np.int64, ndmin=2
+        )
+        xyz = np.loadtxt(path, delimiter=",", skiprows=1, usecols=(6, 7, 8), ndmin=2)
+        index = cls(max(len(ids), 1))
+        index._size = len(ids)
+        index._number[: len(ids)] = ids[:, 0]
+        index._time[: len(ids)] = ids[:, 1]
+        index._xyz[: len(ids)] = xyz
+        return index
@@ -25,6 +25,10 @@ from ruamel.yaml import YAML
 
 import tema_imaging.core.scanner_registry
 from tema_imaging.core.conn_mgr import conn_mgr
+from tema_imaging.core.focus_map import FocusMap
+from tema_imaging.core.settings import Settings
+from tema_imaging.core.telemetry import laser_telemetry
+from tema_imaging.hardware.arduino_trigger import TriggerEvent
 from tema_imaging.hardware.stage import AxisType, StageError
 
 logger = logging.getLogger(__name__)
@@ -35,11 +39,10 @@ class MeasurementController:
         self._sequence = []
         self._measurement = None
         self._step_trigger_event = threading.Event()
+        self._step_received_ns = 0
         self._stop_scan_event = threading.Event()
         self._idle = True
 
-        pub.subscribe(self.on_step_trigger_received, "trigger.step")
-
     def init_sequence(self, measurement: "Measurement") -> None:
         if not self._idle:
             return
@@ -69,12 +72,27 @@ class MeasurementController:
             @classmethod
             def run(cls):
                 self.idle = False
+                # step triggers directly from the trigger's event thread
+                conn_mgr.trigger.on_step += self.on_step_trigger_received
+                recorder = None
+                # a recording started by the user is left running
+                if (
+                    Settings.get("camera.record.measurements")
+                    and conn_mgr.recorder is None
+                ):
+                    recorder = conn_mgr.camera_start_recording()
                 try:
+                    # handlers of the scans are included after they unsubscribe
+                    conn_mgr.stage.reset_event_statistics()
                     start_time = time.time()
                     current_step = 0
                     for scan in self._sequence:
                         if self._stop_scan_event.is_set():
                             break
+                        conn_mgr.trigger.reset_statistics()
+                        scan.laser_samples = (
+                            laser_telemetry.latest if conn_mgr.laser_connected else None
+                        )
                         scan.init_scan(self._measurement)
                         wx.CallAfter(
                             pub.sendMessage,
@@ -86,7 +104,11 @@ class MeasurementController:
                             and not self._step_trigger_event.is_set()
                             and not self._stop_scan_event.is_set()
                         ):
-                            time.sleep(0.01)
+                            self._step_trigger_event.wait(0.01)
+                        if self._step_trigger_event.is_set():
+                            conn_mgr.trigger.step_latency.record(
+                                time.monotonic_ns() - self._step_received_ns
+                            )
                         while not self._stop_scan_event.is_set() and scan.next_move():
                             scan.next_shot()
                             time.sleep(self._measurement.shot_delay / 1000)
@@ -99,9 +121,12 @@ class MeasurementController:
                             scan.done()
                         except AttributeError:
                             pass
+                        scan.log_trigger_statistics(conn_mgr.trigger)
                         current_step += 1
                     end_time = time.time()
 
+                    conn_mgr.stage.log_event_statistics()
+                    conn_mgr.trigger.log_statistics()
                     logger.info(
                         "measurement done; duration (s): {}".format(
                             end_time - start_time
@@ -115,6 +140,9 @@ class MeasurementController:
                 except StageError as e:
                     logger.exception(e)
                 finally:
+                    conn_mgr.trigger.on_step -= self.on_step_trigger_received
+                    if recorder is not None and conn_mgr.recorder is recorder:
+                        conn_mgr.camera_stop_recording()
                     self.idle = True
 
         thread = MeasureThread()
@@ -125,7 +153,8 @@ class MeasurementController:
         conn_mgr.stage.stop_all()
         conn_mgr.trigger.stop_trigger()
 
-    def on_step_trigger_received(self) -> None:
+    def on_step_trigger_received(self, event: TriggerEvent) -> None:
+        self._step_received_ns = event.received_ns
         self._step_trigger_event.set()
 
 
@@ -178,6 +207,12 @@ class Step:
             else:
                 setattr(self, k, v)
 
+        # sequences saved before a parameter was added to a scan type
+        if self.scan_type is not None:
+            for k, v in self.scan_type.parameter_map.items():
+                if k not in self.params:
+                    self.params[k] = Param(None, k, v[1])
+
 
 class Measurement:
     def __init__(self) -> None:
@@ -186,8 +221,20 @@ class Measurement:
         self.step_delay = 0
         self.blank_delay = 0
         self.step_trigger = False
+        self.focus_map: FocusMap | None = None
         self.steps = []
 
+    def __setstate__(self, state):
+        # files saved before an attribute was added keep its default
+        self.__init__()
+        self.__dict__.update(state)
+
+    @property
+    def active_focus_map(self) -> FocusMap | None:
+        if self.focus_map is not None and self.focus_map.ready:
+            return self.focus_map
+        return None
+
 
 class MeasurementViewModel(wx.dataview.PyDataViewModel):
     def __init__(self) -> None:
@@ -345,6 +392,7 @@ class MeasurementViewModel(wx.dataview.PyDataViewModel):
         yaml.register_class(Step)
         yaml.register_class(Param)
         yaml.register_class(Measurement)
+        yaml.register_class(FocusMap)
 
         yaml.dump(self.measurement, stream)
 
@@ -353,6 +401,7 @@ class MeasurementViewModel(wx.dataview.PyDataViewModel):
         yaml.register_class(Step)
         yaml.register_class(Param)
         yaml.register_class(Measurement)
+        yaml.register_class(FocusMap)
 
         data = yaml.load(stream)
 
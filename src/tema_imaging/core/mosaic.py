@@ -0,0 +1,302 @@
+# This file is part of the TEMAimaging project.
+# Copyright (c) 2020, ETH Zurich
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+import math
+import threading
+import time
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+from tema_imaging.hardware.camera import FrameMailbox
+from tema_imaging.hardware.stage import AxisMovementMode, AxisType, Stage, StageError
+
+logger = logging.getLogger(__name__)
+
+# levels are halved until they fit into this size
+MIN_LEVEL_SIZE = 256
+
+
+class MosaicPyramid:
+    """
+    RGB image of a stage area in levels of halving resolution. Every level
+    is a memory-mapped ``.npy`` file in ``directory``, so only the regions
+    which are pasted or viewed are read into memory. Level 0 has
+    ``pixel_size`` nm per pixel and its pixel (0, 0) is at the stage
+    position ``origin`` (nm), columns along X and rows along Y.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        origin: tuple[int, int],
+        pixel_size: float,
+        levels: list[np.memmap],
+    ) -> None:
+        self.directory = directory
+        self.origin = origin
+        self.pixel_size = pixel_size
+        self.levels = levels
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(
+        cls,
+        directory: Path,
+        start: tuple[int, int],
+        end: tuple[int, int],
+        pixel_size: float,
+    ) -> "MosaicPyramid":
+        """New, black mosaic of the stage rectangle from ``start`` to ``end``."""
+        directory.mkdir(parents=True, exist_ok=True)
+        origin = (min(start[0], end[0]), min(start[1], end[1]))
+        width = math.ceil(abs(end[0] - start[0]) / pixel_size) + 1
+        height = math.ceil(abs(end[1] - start[1]) / pixel_size) + 1
+
+        levels = []
+        while True:
+            # the files are sparse until written
+            levels.append(
+                np.lib.format.open_memmap(
+                    directory / "level{}.npy".format(len(levels)),
+                    mode="w+",
+                    dtype=np.uint8,
+                    shape=(height, width, 3),
+                )
+            )
+            if max(width, height) <= MIN_LEVEL_SIZE:
+                break
+            width = max(width // 2, 1)
+            height = max(height // 2, 1)
+
+        with (directory / "mosaic.json").open("w") as f:
+            json.dump(
+                {"origin": origin, "pixel_size": pixel_size, "levels": len(levels)},
+                f,
+            )
+        return cls(directory, origin, pixel_size, levels)
+
+    @classmethod
+    def open(cls, directory: Path) -> "MosaicPyramid":
+        with (directory / "mosaic.json").open() as f:
+            meta = json.load(f)
+        levels = [
+            np.load(directory / "level{}.npy".format(i), mmap_mode="r+")
+            for i in range(meta["levels"])
+        ]
+        return cls(directory, tuple(meta["origin"]), meta["pixel_size"], levels)
+
+    @property
+    def size(self) -> tuple[int, int]:
+        """Width and height of level 0 in pixels."""
+        return self.levels[0].shape[1], self.levels[0].shape[0]
+
+    def to_pixel(self, x: float, y: float) -> tuple[float, float]:
+        """Level 0 pixel of a stage position."""
+        return (
+            (x - self.origin[0]) / self.pixel_size,
+            (y - self.origin[1]) / self.pixel_size,
+        )
+
+    def to_stage(self, px: float, py: float) -> tuple[float, float]:
+        return (
+            self.origin[0] + px * self.pixel_size,
+            self.origin[1] + py * self.pixel_size,
+        )
+
+    def level_for(self, scale: float) -> int:
+        """Coarsest level with at least 1 pixel per ``scale`` level 0 pixels."""
+        if scale <= 1:
+            return 0
+        return min(int(math.log2(scale)), len(self.levels) - 1)
+
+    def region(self, level: int, x0: int, y0: int, x1: int, y1: int) -> np.ndarray:
+        """Copy of a rectangle of a level, clipped to the level."""
+        image = self.levels[level]
+        with self._lock:
+            return np.array(image[max(y0, 0) : max(y1, 0), max(x0, 0) : max(x1, 0)])
+
+    def paste(self, frame: np.ndarray, x: float, y: float) -> tuple[int, int, int, int]:
+        """
+        Paste a frame (gray or RGB) centered at the stage position ``x``,
+        ``y`` and update the coarser levels below it. Returns the changed
+        level 0 rectangle (x0, y0, x1, y1).
+        """
+        if frame.ndim == 2:
+            frame = frame[..., None]
+        frame = frame[..., :3]
+
+        h, w = frame.shape[:2]
+        cx, cy = self.to_pixel(x, y)
+        x0, y0 = round(cx - w / 2), round(cy - h / 2)
+        width, height = self.size
+        # clip the frame to the mosaic
+        fx0, fy0 = max(-x0, 0), max(-y0, 0)
+        fx1, fy1 = min(width - x0, w), min(height - y0, h)
+        if fx0 >= fx1 or fy0 >= fy1:
+            return 0, 0, 0, 0
+        x0, y0, x1, y1 = x0 + fx0, y0 + fy0, x0 + fx1, y0 + fy1
+
+        with self._lock:
+            self.levels[0][y0:y1, x0:x1] = frame[fy0:fy1, fx0:fx1]
+            self._downsample(x0, y0, x1, y1)
+        return x0, y0, x1, y1
+
+    def _downsample(self, x0: int, y0: int, x1: int, y1: int) -> None:
+        """Recompute the rectangle (level 0 pixels) in all coarser levels."""
+        for level in range(1, len(self.levels)):
+            src = self.levels[level - 1]
+            dst = self.levels[level]
+            # whole 2x2 blocks covering the rectangle
+            x0, y0 = x0 // 2, y0 // 2
+            x1 = min((x1 + 1) // 2, dst.shape[1], src.shape[1] // 2)
+            y1 = min((y1 + 1) // 2, dst.shape[0], src.shape[0] // 2)
+            if x0 >= x1 or y0 >= y1:
+                return
+            block = src[2 * y0 : 2 * y1, 2 * x0 : 2 * x1].astype(np.uint16)
+            block = block.reshape(y1 - y0, 2, x1 - x0, 2, 3).sum(axis=(1, 3))
+            dst[y0:y1, x0:x1] = (block + 2) // 4
+
+    def flush(self) -> None:
+        with self._lock:
+            for level in self.levels:
+                level.flush()
+
+
+class MosaicBuilder:
+    """
+    Moves the stage over a grid covering the mosaic area and pastes one
+    frame per position at the stage position read after the move. Rows
+    are scanned alternately, so every move is a single tile pitch. Tiles
+    overlap by ``overlap`` (fraction of the frame size) and are listed
+    with their positions in ``tiles.csv``.
+    """
+
+    def __init__(
+        self,
+        stage: Stage,
+        frames: FrameMailbox,
+        mosaic: MosaicPyramid,
+        overlap: float = 0.1,
+        settle_frames: int = 1,
+        flip: tuple[bool, bool] = (False, False),
+    ) -> None:
+        self.stage = stage
+        self.frames = frames
+        self.mosaic = mosaic
+        self.overlap = overlap
+        self.settle_frames = settle_frames
+        # mirrors frames whose columns or rows run against X or Y
+        self.flip = flip
+        self.frame_timeout = 1.0
+        self.move_timeout = 10.0
+
+        self.tiles = 0
+        self._moved = threading.Event()
+        self._stop = threading.Event()
+
+    def plan(self, frame_size: tuple[int, int]) -> np.ndarray:
+        """(N, 2) stage positions of the tile centers for frames of (w, h)."""
+        width, height = self.mosaic.size
+        axes = []
+        for frame, size in zip(frame_size, (width, height)):
+            pitch = max(frame * (1 - self.overlap), 1)
+            count = max(math.ceil((size - frame) / pitch), 0) + 1
+            # spread the tiles evenly, centered if a single one
+            axes.append(
+                np.linspace(frame / 2, size - frame / 2, count)
+                if count > 1
+                else np.array([size / 2])
+            )
+
+        px, py = np.meshgrid(*axes)
+        px[1::2] = px[1::2, ::-1]
+        x, y = self.mosaic.to_stage(px.ravel(), py.ravel())
+        return np.rint(np.column_stack((x, y))).astype(np.int64)
+
+    def run(self, on_tile: Callable[[int, int, int, int], None] | None = None) -> int:
+        """
+        Build the mosaic, ``on_tile`` is called with the changed level 0
+        rectangle after each tile. Returns the number of tiles pasted.
+        """
+        latest = self.frames.next(0, self.frame_timeout)
+        if latest is None:
+            raise StageError("No camera frame for the mosaic.")
+        plan = self.plan((latest[1].shape[1], latest[1].shape[0]))
+
+        start = time.perf_counter()
+        self._stop.clear()
+        self.tiles = 0
+        x_axis = self.stage.axes[AxisType.X]
+        y_axis = self.stage.axes[AxisType.Y]
+        x_axis.movement_mode = AxisMovementMode.CL_ABSOLUTE
+        y_axis.movement_mode = AxisMovementMode.CL_ABSOLUTE
+        self.stage.on_movement_completed += self._on_movement_completed
+        try:
+            with (self.mosaic.directory / "tiles.csv").open("a") as tiles:
+                if not tiles.tell():
+                    tiles.write("# frame,x,y\n")
+                for x, y in plan.tolist():
+                    if self._stop.is_set():
+                        break
+                    self._move(x, y)
+                    latest = self.frames.next(self.settle_frames, self.frame_timeout)
+                    if latest is None:
+                        raise StageError("No camera frame for the mosaic.")
+                    x, y = x_axis.position, y_axis.position
+
+                    frame = latest[1]
+                    if self.flip[0]:
+                        frame = frame[:, ::-1]
+                    if self.flip[1]:
+                        frame = frame[::-1]
+                    rect = self.mosaic.paste(frame, x, y)
+                    tiles.write("{},{},{}\n".format(latest[0], x, y))
+                    self.tiles += 1
+                    if on_tile is not None:
+                        on_tile(*rect)
+        finally:
+            self.stage.on_movement_completed -= self._on_movement_completed
+            self.mosaic.flush()
+
+        logger.info(
+            "mosaic: {} of {} tiles in {:.1f} s".format(
+                self.tiles, len(plan), time.perf_counter() - start
+            )
+        )
+        return self.tiles
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _move(self, x: int, y: int) -> None:
+        x_axis = self.stage.axes[AxisType.X]
+        y_axis = self.stage.axes[AxisType.Y]
+        # no completion is reported without a move
+        if (x_axis.position, y_axis.position) == (x, y):
+            return
+        self._moved.clear()
+        x_axis.move(x, False)
+        y_axis.move(y, False)
+        self.stage.commit_move()
+        if not self._moved.wait(self.move_timeout):
+            raise StageError("Stage did not reach {}, {}.".format(x, y))
+
+    def _on_movement_completed(self) -> None:
+        self._moved.set()
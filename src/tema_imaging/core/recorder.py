@@ -0,0 +1,206 @@
+# This file is part of the TEMAimaging project.
+# Copyright (c) 2020, ETH Zurich
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import logging
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+from PIL import Image
+
+from tema_imaging.core.frame_index import FrameIndex
+from tema_imaging.core.telemetry import StagePosition
+from tema_imaging.hardware.arduino_trigger import TriggerEvent
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("png", "raw")
+
+
+class RecordedFrame(NamedTuple):
+    number: int  # frame number since the recording started
+    captured_ns: int  # time.monotonic_ns()
+    wall_time: float  # time.time() of the capture
+    frame: np.ndarray
+    position: StagePosition | None  # stage position nearest to the capture
+
+
+class FrameRecorder:
+    """
+    Writes camera frames with their capture times on a worker thread.
+
+    ``submit`` is called on the camera thread and never blocks: frames to
+    record are copied into a bounded queue and dropped if the writer cannot
+    keep up. Every ``every``-th frame is recorded; with ``around_shots``
+    (seconds before, seconds after) only those from before a laser shot
+    (``on_shot``) until after it.
+
+    ``png`` writes an image sequence, ``raw`` appends the frames to
+    ``frames.raw``. ``frames.csv`` lists every recorded frame with its
+    capture time, file, offset and stage position, ``index`` finds the
+    written frames by time or position (``FrameIndex.load`` after the run).
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        fmt: str = "png",
+        every: int = 1,
+        around_shots: tuple[float, float] | None = None,
+        queue_size: int = 64,
+    ) -> None:
+        if fmt not in FORMATS:
+            raise ValueError("Unknown recording format '{}'".format(fmt))
+        directory.mkdir(parents=True, exist_ok=True)
+        self.directory = directory
+        self.fmt = fmt
+        self.every = max(every, 1)
+        self.around_shots = around_shots
+        self._queue = queue.Queue[RecordedFrame | None](queue_size)
+
+        # frames before the next shot, only with around_shots; trimmed to
+        # the ``before`` window by capture time, not by count
+        self._pre_roll = collections.deque[RecordedFrame]()
+        self._last_shot_ns = 0
+        self._handled_shot_ns = 0
+        # time.time_ns() - time.monotonic_ns(), to date the captures
+        self._wall_offset_ns = time.time_ns() - time.monotonic_ns()
+
+        self.submitted = 0
+        self.recorded = 0
+        self.dropped = 0
+        self.index = FrameIndex()
+
+        self._thread = threading.Thread(target=self._run, name="frame-recorder")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(
+        self,
+        frame: np.ndarray,
+        captured_ns: int | None = None,
+        position: StagePosition | None = None,
+    ) -> None:
+        """Record the frame if selected, ``frame`` may be driver memory."""
+        if captured_ns is None:
+            captured_ns = time.monotonic_ns()
+        self.submitted += 1
+        if (self.submitted - 1) % self.every:
+            return
+
+        item = RecordedFrame(
+            self.submitted,
+            captured_ns,
+            (captured_ns + self._wall_offset_ns) / 1e9,
+            frame.copy(),
+            position,
+        )
+        if self.around_shots is None:
+            self._enqueue(item)
+            return
+
+        before = round(self.around_shots[0] * 1e9)
+        after = round(self.around_shots[1] * 1e9)
+        shot = self._last_shot_ns
+        if shot != self._handled_shot_ns:
+            self._handled_shot_ns = shot
+            dropped = self.dropped
+            for pending in self._pre_roll:
+                if pending.captured_ns >= shot - before:
+                    self._enqueue(pending)
+            self._pre_roll.clear()
+            if self.dropped > dropped:
+                logger.warning(
+                    "{} frames before the shot dropped, the queue is shorter "
+                    "than the window before shots".format(self.dropped - dropped)
+                )
+
+        if shot and captured_ns <= shot + after:
+            self._enqueue(item)
+        else:
+            self._pre_roll.append(item)
+            while self._pre_roll[0].captured_ns < captured_ns - before:
+                self._pre_roll.popleft()
+
+    def on_shot(self, event: TriggerEvent) -> None:
+        """Trigger done event, called on the trigger's event thread."""
+        self._last_shot_ns = event.received_ns
+
+    def _enqueue(self, item: RecordedFrame) -> None:
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        raw = None
+        if self.fmt == "raw":
+            raw = (self.directory / "frames.raw").open("wb")
+        with (self.directory / "frames.csv").open("w") as index:
+            index.write("number,monotonic_ns,time,file,offset,shape,x,y,z\n")
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                try:
+                    if raw is not None:
+                        name = "frames.raw"
+                        offset = raw.tell()
+                        raw.write(np.ascontiguousarray(item.frame).data)
+                    else:
+                        name = "frame_{:06d}.png".format(item.number)
+                        offset = 0
+                        Image.fromarray(item.frame).save(
+                            self.directory / name, compress_level=1
+                        )
+                except OSError as e:
+                    logger.error("Recording frame {} failed: {}".format(item.number, e))
+                    self.dropped += 1
+                    continue
+                position = item.position
+                index.write(
+                    "{},{},{:.6f},{},{},{},{}\n".format(
+                        item.number,
+                        item.captured_ns,
+                        item.wall_time,
+                        name,
+                        offset,
+                        "x".join(map(str, item.frame.shape)),
+                        (
+                            "nan,nan,nan"
+                            if position is None
+                            else "{},{},{}".format(position.x, position.y, position.z)
+                        ),
+                    )
+                )
+                self.index.append(item.number, item.captured_ns, position)
+                self.recorded += 1
+        if raw is not None:
+            raw.close()
+
+    def stop(self) -> None:
+        """Write the queued frames and stop."""
+        self._queue.put(None)
+        self._thread.join()
+        logger.info(
+            "recording {}: {} frames recorded, {} dropped".format(
+                self.directory, self.recorded, self.dropped
+            )
+        )
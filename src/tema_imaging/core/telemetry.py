@@ -0,0 +1,222 @@
+# This file is part of the TEMAimaging project.
+# Copyright (c) 2020, ETH Zurich
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import threading
+from typing import NamedTuple
+
+import numpy as np
+
+from tema_imaging.core.utils import LastValue
+from tema_imaging.hardware.laser_compex import LaserSample, OpMode
+
+FIELDS = ("opmode", "hv", "egy", "pressure", "tube_temp")
+_OPMODE = FIELDS.index("opmode")
+_opmodes = list(OpMode)
+
+# (seconds per sample, capacity): raw samples for an hour at the fastest
+# poll rate, 10 s means for a day and minute means for a week, ~1 MB
+DEFAULT_LEVELS = ((0.0, 18000), (10.0, 8640), (60.0, 10080))
+
+
+def opmode_code(mode: OpMode | None) -> float:
+    return np.nan if mode is None else float(_opmodes.index(mode))
+
+
+def opmode_from_code(code: float) -> OpMode | None:
+    return None if np.isnan(code) else _opmodes[int(code)]
+
+
+class TelemetryWindow(NamedTuple):
+    """Samples of a time window, ``time`` in seconds since the epoch."""
+
+    time: np.ndarray
+    opmode: np.ndarray  # opmode_code values
+    hv: np.ndarray
+    egy: np.ndarray
+    pressure: np.ndarray
+    tube_temp: np.ndarray
+    resolution: float  # seconds per sample, 0 for raw samples
+
+
+class _Level:
+    def __init__(self, resolution: float, capacity: int) -> None:
+        self.resolution = resolution
+        self.time = np.zeros(capacity, dtype=np.float64)
+        self.values = np.zeros((capacity, len(FIELDS)), dtype=np.float32)
+        self.head = 0
+        self.size = 0
+
+        # running mean of the current bucket
+        self._bucket = -1.0
+        self._sum = np.zeros(len(FIELDS), dtype=np.float64)
+        self._count = np.zeros(len(FIELDS), dtype=np.int64)
+        self._opmode = np.nan
+
+    @property
+    def capacity(self) -> int:
+        return len(self.time)
+
+    @property
+    def oldest(self) -> float:
+        if not self.size:
+            return np.inf
+        return float(self.time[(self.head - self.size) % self.capacity])
+
+    def _store(self, t: float, row: np.ndarray) -> None:
+        self.time[self.head] = t
+        self.values[self.head] = row
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def add(self, t: float, row: np.ndarray) -> None:
+        if not self.resolution:
+            self._store(t, row)
+            return
+
+        bucket = t // self.resolution * self.resolution
+        if bucket != self._bucket:
+            self.flush()
+            self._bucket = bucket
+        valid = ~np.isnan(row)
+        self._sum[valid] += row[valid]
+        self._count[valid] += 1
+        # opmode is a category, the bucket keeps the last one
+        self._opmode = row[_OPMODE]
+
+    def flush(self) -> None:
+        if self._bucket < 0 or not self._count.any():
+            return
+        with np.errstate(invalid="ignore", divide="ignore"):
+            row = self._sum / self._count
+        row[_OPMODE] = self._opmode
+        self._store(self._bucket, row)
+        self._sum[:] = 0
+        self._count[:] = 0
+
+    def window(self, start: float, end: float) -> tuple[np.ndarray, np.ndarray]:
+        order = (np.arange(self.size) + self.head - self.size) % self.capacity
+        times = self.time[order]
+        lo = np.searchsorted(times, start, side="left")
+        hi = np.searchsorted(times, end, side="right")
+        index = order[lo:hi]
+        return self.time[index], self.values[index]
+
+
+class TelemetryBuffer:
+    """
+    Fixed-memory history of the laser telemetry. Every sample is kept in
+    the raw level and averaged into coarser levels which reach further
+    back, so that recent data has full resolution and a week of history
+    still fits.
+    """
+
+    def __init__(self, levels: tuple[tuple[float, int], ...] = DEFAULT_LEVELS) -> None:
+        self._levels = [_Level(resolution, size) for resolution, size in levels]
+        self._lock = threading.Lock()
+        # for readers which need the current values often, e.g. every spot
+        self.latest = LastValue[LaserSample]()
+
+    def append(self, sample: LaserSample) -> None:
+        self.latest.set(sample)
+        row = np.array(
+            (
+                opmode_code(sample.status[0]),
+                sample.hv,
+                sample.egy,
+                np.nan if sample.pressure is None else sample.pressure,
+                np.nan if sample.tube_temp is None else sample.tube_temp,
+            ),
+            dtype=np.float64,
+        )
+        with self._lock:
+            for level in self._levels:
+                level.add(sample.wall_time, row)
+
+    def window(
+        self,
+        start: float,
+        end: float | None = None,
+        max_points: int | None = None,
+    ) -> TelemetryWindow:
+        """
+        Samples between ``start`` and ``end`` (seconds since the epoch, end
+        defaults to now) from the finest level that reaches back to
+        ``start`` (or furthest) and, if given and possible, has at most
+        ``max_points`` samples in the window.
+        """
+        end = np.inf if end is None else end
+        with self._lock:
+            # levels not reaching back to start are only used if none does
+            reach = min(max(level.oldest, start) for level in self._levels)
+            for level in self._levels:
+                if max(level.oldest, start) > reach:
+                    continue
+                chosen = level
+                times, values = level.window(start, end)
+                if max_points is None or len(times) <= max_points:
+                    break
+
+        return TelemetryWindow(times, *values.T.astype(np.float64), chosen.resolution)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(level.time.nbytes + level.values.nbytes for level in self._levels)
+
+
+class StagePosition(NamedTuple):
+    monotonic_ns: int
+    x: int  # nm
+    y: int
+    z: int
+
+
+class PositionHistory:
+    """
+    Recent positions read by the stage position poller, so that camera
+    frames can be tagged with the position nearest to their capture time
+    without reading the stage for every frame.
+    """
+
+    def __init__(self, capacity: int = 64) -> None:
+        self._samples = collections.deque[StagePosition](maxlen=capacity)
+        self._lock = threading.Lock()
+
+    def append(self, position: StagePosition) -> None:
+        with self._lock:
+            self._samples.append(position)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._samples.clear()
+
+    def nearest(self, monotonic_ns: int) -> StagePosition | None:
+        """Position read closest to ``monotonic_ns``, None if there is none."""
+        best = None
+        best_distance = 0
+        with self._lock:
+            # frames are tagged as they arrive, the match is one of the last
+            for sample in reversed(self._samples):
+                distance = abs(sample.monotonic_ns - monotonic_ns)
+                if best is None or distance < best_distance:
+                    best, best_distance = sample, distance
+                if sample.monotonic_ns <= monotonic_ns:
+                    break
+        return best
+
+
+laser_telemetry = TelemetryBuffer()
+stage_positions = PositionHistory()
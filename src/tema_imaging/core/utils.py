@@ -14,8 +14,68 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+import collections
+import threading
 from pathlib import Path
+from typing import Generic, TypeVar
+
+T = TypeVar("T")
 
 
 def get_project_root() -> Path:
     return Path(__file__).parents[3]
+
+
+class LatencyStatistics:
+    """Rolling window of latency samples in ns."""
+
+    def __init__(self, size: int = 1000) -> None:
+        self._samples = collections.deque[int](maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, latency_ns: int) -> None:
+        with self._lock:
+            self._samples.append(latency_ns)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._samples.clear()
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def summary(self) -> tuple[float, float, float] | None:
+        """Mean, 95th percentile and max in ms, None without samples."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        p95 = samples[min(len(samples) - 1, round(0.95 * (len(samples) - 1)))]
+        return sum(samples) / len(samples) / 1e6, p95 / 1e6, samples[-1] / 1e6
+
+    def __repr__(self) -> str:
+        summary = self.summary()
+        if summary is None:
+            return "n=0"
+        return "n={}, mean={:.3f} ms, p95={:.3f} ms, max={:.3f} ms".format(
+            len(self), *summary
+        )
+
+
+class LastValue(Generic[T]):
+    """
+    Most recent value of a producer for any number of readers. Values are
+    replaced, never modified, and replacing a reference is atomic, so
+    neither side takes a lock.
+    """
+
+    __slots__ = ("_value",)
+
+    def __init__(self) -> None:
+        self._value: T | None = None
+
+    def set(self, value: T) -> None:
+        self._value = value
+
+    def get(self) -> T | None:
+        return self._value
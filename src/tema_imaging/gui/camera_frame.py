@@ -15,11 +15,8 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import wx
-from PIL import Image
-from pubsub import pub
 
 from tema_imaging.gui.panels import CameraPanel
-from tema_imaging.hardware.camera import Camera
 
 
 class CameraFrame(wx.Frame):
@@ -34,8 +31,4 @@ class CameraFrame(wx.Frame):
         sizer = wx.BoxSizer()
         sizer.Add(self.camera_panel)
 
-        pub.subscribe(self.on_image_acquired, "camera.image_acquired")
         self.SetSizerAndFit(sizer)
-
-    def on_image_acquired(self, _: Camera, image: Image.Image) -> None:
-        wx.CallAfter(self.camera_panel.update_image, image)
@@ -100,6 +100,14 @@ class LaserStatusDialog(wx.Dialog):
             "Temp. control: {}".format(conn_mgr.laser.tube_temp_control)
         )
 
+        self.stxt_queue_wait = wx.StaticText(self)
+        self.stxt_queue_wait.SetLabel(
+            "\n".join(
+                "Queue wait ({}): {}".format(priority.name.lower(), wait)
+                for priority, wait in conn_mgr.laser.queue_wait.items()
+            )
+        )
+
         self.init_ui()
 
     def init_ui(self) -> None:
@@ -114,6 +122,7 @@ class LaserStatusDialog(wx.Dialog):
         sizer.Add(self.stxt_laser_version)
         sizer.Add(self.stxt_laser_temp)
         sizer.Add(self.stxt_laser_temp_ctrl)
+        sizer.Add(self.stxt_queue_wait)
 
         self.SetSizerAndFit(sizer)
 
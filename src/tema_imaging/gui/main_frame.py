@@ -14,16 +14,21 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+import threading
+
 import wx
-from PIL import Image
 from pubsub import pub
 
 import tema_imaging.hardware.laser_compex
+from tema_imaging.core.autofocus import Autofocus
 from tema_imaging.core.conn_mgr import conn_mgr
+from tema_imaging.core.focus_map import FocusMap, FocusMapMethod
+from tema_imaging.core.measurement import measurement_model
 from tema_imaging.core.settings import Settings
 from tema_imaging.gui.camera_frame import CameraFrame
 from tema_imaging.gui.conn_mgr import ConnectionManagerDialog
 from tema_imaging.gui.dialogs import AboutDialog, LaserStatusDialog
+from tema_imaging.gui.mosaic_frame import MosaicFrame
 from tema_imaging.gui.panels import (
     CameraPanel,
     LaserManualShootPanel,
@@ -33,8 +38,8 @@ from tema_imaging.gui.panels import (
     StagePanel,
 )
 from tema_imaging.gui.preferences import PreferencesDialog
-from tema_imaging.hardware.camera import Camera
-from tema_imaging.hardware.stage import AxisType
+from tema_imaging.hardware.camera import FrameStatistics
+from tema_imaging.hardware.stage import AxisType, StageError
 
 
 class MainFrame(wx.Frame):
@@ -44,11 +49,29 @@ class MainFrame(wx.Frame):
         icon = wx.Icon("logo.png")
         self.SetIcon(icon)
 
-        self.status_bar = self.CreateStatusBar(2)
+        self.status_bar = self.CreateStatusBar(5)
 
         self.laser_menu_status = wx.MenuItem(
             id=wx.ID_ANY, text="Status", helpString="Laser status"
         )
+        self.laser_menu_trigger_latency = wx.MenuItem(
+            id=wx.ID_ANY,
+            text="Trigger latency",
+            helpString="Show trigger event latency statistics",
+        )
+
+        self.camera_menu_record = wx.MenuItem(
+            id=wx.ID_ANY,
+            text="Record",
+            helpString="Record the camera to the logs directory",
+            kind=wx.ITEM_CHECK,
+        )
+        self.camera_menu_mosaic = wx.MenuItem(
+            id=wx.ID_ANY,
+            text="Overview mosaic",
+            helpString="Assemble an overview of the sample from camera tiles",
+        )
+        self.camera_profile_items: dict[str, wx.MenuItem] = {}
 
         self.stage_menu_reference = wx.MenuItem(
             id=wx.ID_ANY, text="Reference axes", helpString="Reference stage axes"
@@ -56,6 +79,22 @@ class MainFrame(wx.Frame):
         self.stage_menu_reset_speed = wx.MenuItem(
             id=wx.ID_ANY, text="Reset speed", helpString="Reset axis speeds"
         )
+        self.stage_menu_add_focus_point = wx.MenuItem(
+            id=wx.ID_ANY,
+            text="Add focus point",
+            helpString="Add the current position to the sample focus map",
+        )
+        self.stage_menu_clear_focus_map = wx.MenuItem(
+            id=wx.ID_ANY,
+            text="Clear focus map",
+            helpString="Remove all points from the sample focus map",
+        )
+        self.stage_menu_autofocus = wx.MenuItem(
+            id=wx.ID_ANY,
+            text="Autofocus",
+            helpString="Focus Z on the sharpest camera image",
+        )
+        self.focus_map_method = FocusMapMethod.PLANE
 
         self.help_menu_about = wx.MenuItem(
             id=wx.ID_ANY, text="About", helpString="Show information about the software"
@@ -82,10 +121,43 @@ class MainFrame(wx.Frame):
 
         laser_menu = wx.Menu()
         laser_menu.Append(self.laser_menu_status)
+        laser_menu.Append(self.laser_menu_trigger_latency)
+
+        camera_menu = wx.Menu()
+        camera_menu.Append(self.camera_menu_record)
+        camera_menu.Append(self.camera_menu_mosaic)
+        profile_menu = wx.Menu()
+        for name in Settings.get("camera.profiles"):
+            item = profile_menu.AppendRadioItem(wx.ID_ANY, name)
+            item.Check(name == Settings.get("camera.profile"))
+            self.camera_profile_items[name] = item
+            self.Bind(
+                wx.EVT_MENU,
+                lambda _, n=name: self.on_select_camera_profile(n),
+                item,
+            )
+        camera_menu.AppendSubMenu(profile_menu, "Acquisition profile")
 
         stage_menu = wx.Menu()
         stage_menu.Append(self.stage_menu_reference)
         stage_menu.Append(self.stage_menu_reset_speed)
+        stage_menu.AppendSeparator()
+        stage_menu.Append(self.stage_menu_autofocus)
+        stage_menu.Append(self.stage_menu_add_focus_point)
+        stage_menu.Append(self.stage_menu_clear_focus_map)
+        focus_method_menu = wx.Menu()
+        for method, label in (
+            (FocusMapMethod.PLANE, "Plane"),
+            (FocusMapMethod.BILINEAR, "Bilinear"),
+            (FocusMapMethod.THIN_PLATE, "Thin-plate spline"),
+        ):
+            item = focus_method_menu.AppendRadioItem(wx.ID_ANY, label)
+            self.Bind(
+                wx.EVT_MENU,
+                lambda e, m=method: self.on_click_stage_menu_focus_method(e, m),
+                item,
+            )
+        stage_menu.AppendSubMenu(focus_method_menu, "Focus map method")
 
         help_menu = wx.Menu()
         help_menu.Append(self.help_menu_about)
@@ -93,13 +165,22 @@ class MainFrame(wx.Frame):
         if not conn_mgr.laser_connected:
             self.laser_menu_status.Enable(False)
 
+        if not conn_mgr.trigger_connected:
+            self.laser_menu_trigger_latency.Enable(False)
+
+        if not conn_mgr.camera_connected:
+            self.camera_menu_record.Enable(False)
+
         if not conn_mgr.stage_connected:
             self.stage_menu_reference.Enable(False)
             self.stage_menu_reset_speed.Enable(False)
+            self.stage_menu_add_focus_point.Enable(False)
+            self.stage_menu_autofocus.Enable(False)
 
         menubar = wx.MenuBar()
         menubar.Append(file_menu, "&File")
         menubar.Append(laser_menu, "&Laser")
+        menubar.Append(camera_menu, "&Camera")
         menubar.Append(stage_menu, "&Stage")
         menubar.Append(help_menu, "Help")
         self.SetMenuBar(menubar)
@@ -123,6 +204,17 @@ class MainFrame(wx.Frame):
         self.Bind(wx.EVT_MENU, self.on_settings, file_menu_settings)
         self.Bind(wx.EVT_MENU, self.on_quit, file_menu_close)
         self.Bind(wx.EVT_MENU, self.on_click_laser_menu_status, self.laser_menu_status)
+        self.Bind(
+            wx.EVT_MENU,
+            self.on_click_laser_menu_trigger_latency,
+            self.laser_menu_trigger_latency,
+        )
+        self.Bind(
+            wx.EVT_MENU, self.on_click_camera_menu_record, self.camera_menu_record
+        )
+        self.Bind(
+            wx.EVT_MENU, self.on_click_camera_menu_mosaic, self.camera_menu_mosaic
+        )
         self.Bind(
             wx.EVT_MENU, self.on_click_stage_menu_reference, self.stage_menu_reference
         )
@@ -131,6 +223,19 @@ class MainFrame(wx.Frame):
             self.on_click_stage_menu_reset_speed,
             self.stage_menu_reset_speed,
         )
+        self.Bind(
+            wx.EVT_MENU, self.on_click_stage_menu_autofocus, self.stage_menu_autofocus
+        )
+        self.Bind(
+            wx.EVT_MENU,
+            self.on_click_stage_menu_add_focus_point,
+            self.stage_menu_add_focus_point,
+        )
+        self.Bind(
+            wx.EVT_MENU,
+            self.on_click_stage_menu_clear_focus_map,
+            self.stage_menu_clear_focus_map,
+        )
         self.Bind(wx.EVT_MENU, self.on_click_help_menu_about, self.help_menu_about)
 
         self.Bind(wx.EVT_CLOSE, self.on_quit)
@@ -138,10 +243,12 @@ class MainFrame(wx.Frame):
         pub.subscribe(self.on_laser_status_changed, "laser.status_changed")
         pub.subscribe(self.on_laser_connection_changed, "laser.connection_changed")
         pub.subscribe(self.on_stage_connection_changed, "stage.connection_changed")
+        pub.subscribe(self.on_trigger_connection_changed, "trigger.connection_changed")
         pub.subscribe(self.on_camera_connection_changed, "camera.connection_changed")
+        pub.subscribe(self.on_camera_recording_changed, "camera.recording_changed")
+        pub.subscribe(self.on_camera_statistics_changed, "camera.statistics_changed")
         pub.subscribe(self.on_measurement_step_changed, "measurement.step_changed")
         pub.subscribe(self.on_measurement_done, "measurement.done")
-        pub.subscribe(self.on_image_acquired, "camera.image_acquired")
 
         self.main_panel.SetSizerAndFit(sizer)
         sizer.SetSizeHints(self)
@@ -152,9 +259,13 @@ class MainFrame(wx.Frame):
         if connected:
             self.stage_menu_reference.Enable(True)
             self.stage_menu_reset_speed.Enable(True)
+            self.stage_menu_add_focus_point.Enable(True)
+            self.stage_menu_autofocus.Enable(True)
         else:
             self.stage_menu_reference.Enable(False)
             self.stage_menu_reset_speed.Enable(False)
+            self.stage_menu_add_focus_point.Enable(False)
+            self.stage_menu_autofocus.Enable(False)
 
     def on_camera_connection_changed(self, connected: bool) -> None:
         if Settings.get("camera.separate_window"):
@@ -163,9 +274,27 @@ class MainFrame(wx.Frame):
                 frame.Show()
 
         self.camera_panel.Show(not Settings.get("camera.separate_window") and connected)
+        self.camera_menu_record.Enable(connected)
+        if not connected:
+            self.status_bar.SetStatusText("", 2)
         self.main_panel.Fit()
         self.main_panel.GetParent().Fit()
 
+    def on_camera_recording_changed(self, recording: bool) -> None:
+        # recordings of measurements start on the measurement thread
+        wx.CallAfter(self.camera_menu_record.Check, recording)
+
+    def on_camera_statistics_changed(self, statistics: FrameStatistics) -> None:
+        # sent from the camera thread
+        latency = statistics.latency[0] if statistics.latency else 0.0
+        wx.CallAfter(
+            self.status_bar.SetStatusText,
+            "Camera: {:.1f} fps, latency {:.1f} ms, jitter {:.1f} ms".format(
+                statistics.fps, latency, statistics.jitter
+            ),
+            2,
+        )
+
     def on_connection_manager(self, _: wx.CommandEvent) -> None:
         with ConnectionManagerDialog(self) as dlg:
             dlg.ShowModal()
@@ -191,6 +320,9 @@ class MainFrame(wx.Frame):
         else:
             self.laser_menu_status.Enable(False)
 
+    def on_trigger_connection_changed(self, connected: bool) -> None:
+        self.laser_menu_trigger_latency.Enable(connected)
+
     def on_quit(self, _: wx.CloseEvent | wx.CommandEvent) -> None:
         conn_mgr.laser_disconnect()
         conn_mgr.trigger_disconnect()
@@ -199,10 +331,39 @@ class MainFrame(wx.Frame):
         conn_mgr.camera_disconnect()
         self.Destroy()
 
+    def on_select_camera_profile(self, name: str) -> None:
+        try:
+            conn_mgr.camera_set_profile(name)
+        except ValueError as e:
+            wx.MessageBox(str(e), "Acquisition profile", parent=self)
+            self.camera_profile_items[Settings.get("camera.profile")].Check()
+
     def on_click_laser_menu_status(self, _: wx.CommandEvent) -> None:
         with LaserStatusDialog(self) as dlg:
             dlg.ShowModal()
 
+    def on_click_laser_menu_trigger_latency(self, _: wx.CommandEvent) -> None:
+        trigger = conn_mgr.trigger
+        wx.MessageBox(
+            "D arrival to wake-up: {}\n"
+            "Command to D: {}\n"
+            "Step trigger to reaction: {}".format(
+                trigger.wakeup_latency, trigger.done_latency, trigger.step_latency
+            ),
+            "Trigger latency",
+            parent=self,
+        )
+
+    @staticmethod
+    def on_click_camera_menu_record(e: wx.CommandEvent) -> None:
+        if e.IsChecked():
+            conn_mgr.camera_start_recording()
+        else:
+            conn_mgr.camera_stop_recording()
+
+    def on_click_camera_menu_mosaic(self, _: wx.CommandEvent) -> None:
+        MosaicFrame(self).Show()
+
     @staticmethod
     def on_click_stage_menu_reference(_: wx.CommandEvent) -> None:
         conn_mgr.stage.find_references()
@@ -213,8 +374,52 @@ class MainFrame(wx.Frame):
         conn_mgr.stage.axes[AxisType.Y].speed = 0
         conn_mgr.stage.axes[AxisType.Z].speed = 0
 
-    def on_image_acquired(self, _: Camera, image: Image.Image) -> None:
-        wx.CallAfter(self.camera_panel.update_image, image)
+    def on_click_stage_menu_autofocus(self, _: wx.CommandEvent) -> None:
+        if not conn_mgr.stage_connected or not conn_mgr.camera_connected:
+            wx.MessageBox(
+                "Autofocus needs the stage and the camera.", "Autofocus", parent=self
+            )
+            return
+
+        def run() -> None:
+            try:
+                result = Autofocus(conn_mgr.stage, conn_mgr.camera_frames).run()
+                text = "Focus: {:.1f} µm in {:.1f} s".format(
+                    result.z / 1000, result.duration
+                )
+            except StageError as e:
+                text = "Autofocus failed: {}".format(e)
+            finally:
+                wx.CallAfter(self.stage_menu_autofocus.Enable, conn_mgr.stage_connected)
+            wx.CallAfter(self.status_bar.SetStatusText, text, 4)
+
+        self.stage_menu_autofocus.Enable(False)
+        threading.Thread(target=run, daemon=True).start()
+
+    def on_click_stage_menu_add_focus_point(self, _: wx.CommandEvent) -> None:
+        measurement = measurement_model.measurement
+        if measurement.focus_map is None:
+            measurement.focus_map = FocusMap(self.focus_map_method)
+
+        measurement.focus_map.add_point(
+            conn_mgr.stage.axes[AxisType.X].position,
+            conn_mgr.stage.axes[AxisType.Y].position,
+            conn_mgr.stage.axes[AxisType.Z].position,
+        )
+        self.status_bar.SetStatusText(
+            "Focus points: {}".format(len(measurement.focus_map)), 3
+        )
+
+    def on_click_stage_menu_clear_focus_map(self, _: wx.CommandEvent) -> None:
+        measurement_model.measurement.focus_map = None
+        self.status_bar.SetStatusText("Focus points: 0", 3)
+
+    def on_click_stage_menu_focus_method(
+        self, _: wx.CommandEvent, method: FocusMapMethod
+    ) -> None:
+        self.focus_map_method = method
+        if measurement_model.measurement.focus_map is not None:
+            measurement_model.measurement.focus_map.set_method(method)
 
     @staticmethod
     def on_click_help_menu_about(_: wx.CommandEvent) -> None:
@@ -0,0 +1,256 @@
+# This file is part of the TEMAimaging project.
+# Copyright (c) 2020, ETH Zurich
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import math
+import threading
+from pathlib import Path
+
+import wx
+from PIL import Image
+
+from tema_imaging.core.conn_mgr import conn_mgr
+from tema_imaging.core.mosaic import MosaicBuilder, MosaicPyramid
+from tema_imaging.core.settings import Settings
+from tema_imaging.core.utils import get_project_root
+from tema_imaging.hardware.stage import AxisType, StageError
+
+
+class MosaicPanel(wx.Panel):
+    """
+    Shows a mosaic, reading only the visible part of the pyramid level
+    which matches the zoom. Zoom with the mouse wheel, pan by dragging.
+    """
+
+    def __init__(self, parent: wx.Window, width: int = 800, height: int = 600) -> None:
+        super().__init__(parent, wx.ID_ANY, size=wx.Size(width, height))
+        self.mosaic: MosaicPyramid | None = None
+        self.scale = 1.0  # level 0 pixels per screen pixel
+        self.center = (0.0, 0.0)  # level 0 pixel
+        self._drag_start: wx.Point | None = None
+        self.init_ui()
+
+    def init_ui(self) -> None:
+        self.SetBackgroundStyle(wx.BG_STYLE_PAINT)
+        self.Bind(wx.EVT_PAINT, self.on_paint)
+        self.Bind(wx.EVT_MOUSEWHEEL, self.on_mouse_wheel)
+        self.Bind(wx.EVT_LEFT_DOWN, self.on_left_down)
+        self.Bind(wx.EVT_LEFT_UP, self.on_left_up)
+        self.Bind(wx.EVT_MOTION, self.on_motion)
+
+    def set_mosaic(self, mosaic: MosaicPyramid | None) -> None:
+        self.mosaic = mosaic
+        if mosaic is not None:
+            width, height = mosaic.size
+            size = self.GetClientSize()
+            self.scale = max(width / size.width, height / size.height, 1e-3)
+            self.center = (width / 2, height / 2)
+        self.Refresh()
+
+    def on_paint(self, _: wx.PaintEvent) -> None:
+        dc = wx.AutoBufferedPaintDC(self)
+        dc.SetBackground(wx.BLACK_BRUSH)
+        dc.Clear()
+        if self.mosaic is None:
+            return
+
+        size = self.GetClientSize()
+        level = self.mosaic.level_for(self.scale)
+        factor = 2**level
+        # visible rectangle in level 0 and in level pixels
+        left = self.center[0] - size.width / 2 * self.scale
+        top = self.center[1] - size.height / 2 * self.scale
+        x0 = max(math.floor(left / factor), 0)
+        y0 = max(math.floor(top / factor), 0)
+        x1 = math.ceil((left + size.width * self.scale) / factor)
+        y1 = math.ceil((top + size.height * self.scale) / factor)
+        pixels = self.mosaic.region(level, x0, y0, x1, y1)
+        if not pixels.size:
+            return
+
+        height, width = pixels.shape[:2]
+        screen_width = max(round(width * factor / self.scale), 1)
+        screen_height = max(round(height * factor / self.scale), 1)
+        image = Image.fromarray(pixels).resize(
+            (screen_width, screen_height), Image.BILINEAR, reducing_gap=2.0
+        )
+        bitmap = wx.Bitmap.FromBuffer(screen_width, screen_height, image.tobytes())
+        dc.DrawBitmap(
+            bitmap,
+            round((x0 * factor - left) / self.scale),
+            round((y0 * factor - top) / self.scale),
+        )
+
+    def on_mouse_wheel(self, e: wx.MouseEvent) -> None:
+        # keep the pixel under the cursor in place
+        size = self.GetClientSize()
+        dx = e.GetX() - size.width / 2
+        dy = e.GetY() - size.height / 2
+        x = self.center[0] + dx * self.scale
+        y = self.center[1] + dy * self.scale
+        self.scale *= 0.8 if e.GetWheelRotation() > 0 else 1.25
+        self.center = (x - dx * self.scale, y - dy * self.scale)
+        self.Refresh()
+
+    def on_left_down(self, e: wx.MouseEvent) -> None:
+        self._drag_start = e.GetPosition()
+        self.CaptureMouse()
+
+    def on_left_up(self, _: wx.MouseEvent) -> None:
+        if self.HasCapture():
+            self.ReleaseMouse()
+        self._drag_start = None
+
+    def on_motion(self, e: wx.MouseEvent) -> None:
+        if self._drag_start is None or not e.Dragging():
+            return
+        position = e.GetPosition()
+        self.center = (
+            self.center[0] - (position.x - self._drag_start.x) * self.scale,
+            self.center[1] - (position.y - self._drag_start.y) * self.scale,
+        )
+        self._drag_start = position
+        self.Refresh()
+
+
+class MosaicFrame(wx.Frame):
+    def __init__(self, parent: wx.Window) -> None:
+        super().__init__(parent, title="Overview mosaic")
+
+        self.num_x = wx.SpinCtrlDouble(self, min=-100000, max=100000, inc=100)
+        self.num_y = wx.SpinCtrlDouble(self, min=-100000, max=100000, inc=100)
+        self.num_width = wx.SpinCtrlDouble(self, min=1, max=100000, inc=100)
+        self.num_height = wx.SpinCtrlDouble(self, min=1, max=100000, inc=100)
+        self.btn_build = wx.Button(self, wx.ID_ANY, "Build")
+        self.btn_stop = wx.Button(self, wx.ID_ANY, "Stop")
+        self.btn_open = wx.Button(self, wx.ID_ANY, "Open...")
+        self.mosaic_panel = MosaicPanel(self)
+        self.status_bar = self.CreateStatusBar()
+
+        self.builder: MosaicBuilder | None = None
+
+        self.init_ui()
+
+    def init_ui(self) -> None:
+        self.num_width.SetValue(5000)
+        self.num_height.SetValue(5000)
+        if conn_mgr.stage_connected:
+            self.num_x.SetValue(conn_mgr.stage.axes[AxisType.X].position / 1000)
+            self.num_y.SetValue(conn_mgr.stage.axes[AxisType.Y].position / 1000)
+        self.btn_stop.Enable(False)
+
+        ctrl_sizer = wx.BoxSizer()
+        for label, ctrl in (
+            ("X (µm):", self.num_x),
+            ("Y (µm):", self.num_y),
+            ("Width (µm):", self.num_width),
+            ("Height (µm):", self.num_height),
+        ):
+            ctrl_sizer.Add(
+                wx.StaticText(self, label=label),
+                0,
+                wx.ALIGN_CENTER_VERTICAL | wx.ALL,
+                5,
+            )
+            ctrl_sizer.Add(ctrl, 0, wx.ALL, 5)
+        ctrl_sizer.Add(self.btn_build, 0, wx.ALL, 5)
+        ctrl_sizer.Add(self.btn_stop, 0, wx.ALL, 5)
+        ctrl_sizer.Add(self.btn_open, 0, wx.ALL, 5)
+
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(ctrl_sizer)
+        sizer.Add(self.mosaic_panel, 1, wx.EXPAND)
+        self.SetSizerAndFit(sizer)
+
+        self.Bind(wx.EVT_BUTTON, self.on_click_build, self.btn_build)
+        self.Bind(wx.EVT_BUTTON, self.on_click_stop, self.btn_stop)
+        self.Bind(wx.EVT_BUTTON, self.on_click_open, self.btn_open)
+        self.Bind(wx.EVT_CLOSE, self.on_close)
+
+    def on_click_build(self, _: wx.CommandEvent) -> None:
+        if not conn_mgr.stage_connected or not conn_mgr.camera_connected:
+            wx.MessageBox("The mosaic needs the stage and the camera.", parent=self)
+            return
+
+        x = self.num_x.GetValue() * 1000
+        y = self.num_y.GetValue() * 1000
+        half_width = self.num_width.GetValue() * 1000 / 2
+        half_height = self.num_height.GetValue() * 1000 / 2
+        mosaic = MosaicPyramid.create(
+            get_project_root()
+            / "logs"
+            / "mosaic_{}".format(datetime.datetime.now().isoformat()),
+            (round(x - half_width), round(y - half_height)),
+            (round(x + half_width), round(y + half_height)),
+            # binned frames cover the same area with fewer pixels
+            Settings.get("camera.pixel_size") * conn_mgr.camera.profile.binning,
+        )
+        self.builder = MosaicBuilder(
+            conn_mgr.stage,
+            conn_mgr.camera_frames,
+            mosaic,
+            Settings.get("camera.mosaic.overlap"),
+            Settings.get("camera.mosaic.settle_frames"),
+            (
+                Settings.get("camera.mosaic.flip_x"),
+                Settings.get("camera.mosaic.flip_y"),
+            ),
+        )
+        self.mosaic_panel.set_mosaic(mosaic)
+        self.btn_build.Enable(False)
+        self.btn_stop.Enable(True)
+        threading.Thread(target=self._build, args=(self.builder,), daemon=True).start()
+
+    def _build(self, builder: MosaicBuilder) -> None:
+        text = "Mosaic failed"
+        try:
+            tiles = builder.run(lambda *_: wx.CallAfter(self.on_tile, builder))
+            text = "{} tiles in {}".format(tiles, builder.mosaic.directory.name)
+        except (StageError, OSError) as e:
+            text = "Mosaic failed: {}".format(e)
+        finally:
+            # re-enable the buttons whatever went wrong
+            wx.CallAfter(self.on_build_done, text)
+
+    def on_tile(self, builder: MosaicBuilder) -> None:
+        # the frame may have been closed while building
+        if not self:
+            return
+        self.status_bar.SetStatusText("Tiles: {}".format(builder.tiles))
+        self.mosaic_panel.Refresh()
+
+    def on_build_done(self, text: str) -> None:
+        if not self:
+            return
+        self.builder = None
+        self.btn_build.Enable(True)
+        self.btn_stop.Enable(False)
+        self.status_bar.SetStatusText(text)
+        self.mosaic_panel.Refresh()
+
+    def on_click_stop(self, _: wx.CommandEvent) -> None:
+        if self.builder is not None:
+            self.builder.stop()
+
+    def on_click_open(self, _: wx.CommandEvent) -> None:
+        with wx.DirDialog(self, "Open mosaic", str(get_project_root() / "logs")) as dlg:
+            if dlg.ShowModal() == wx.ID_OK:
+                self.mosaic_panel.set_mosaic(MosaicPyramid.open(Path(dlg.GetPath())))
+
+    def on_close(self, e: wx.CloseEvent) -> None:
+        if self.builder is not None:
+            self.builder.stop()
+        e.Skip()
@@ -22,12 +22,13 @@ import matplotlib.figure
 import matplotlib.patches
 import wx
 import wx.dataview
-from PIL import Image
 from pubsub import pub
 
 import tema_imaging.core.scanner_registry
+from tema_imaging.core.camera_render import CameraRenderer
 from tema_imaging.core.conn_mgr import conn_mgr
 from tema_imaging.core.measurement import MeasurementController, Step, measurement_model
+from tema_imaging.core.settings import Settings
 from tema_imaging.gui.dialogs import AddScanDialog
 from tema_imaging.gui.renderers import (
     SequenceEditorTextRenderer,
@@ -388,6 +389,12 @@ class MeasurementPanel(wx.Panel):
                     self.on_click_go_to_start(e, self.dvc.GetSelection())
 
 
+# scales camera frames for all camera panels, off the UI thread
+camera_renderer = CameraRenderer(
+    conn_mgr.camera_frames, Settings.get("camera.display_fps")
+)
+
+
 class CameraPanel(wx.Panel):
     def __init__(self, parent: wx.Window, width: int = 320, height: int = 240) -> None:
         super().__init__(parent, wx.ID_ANY, size=wx.Size(width, height))
@@ -395,24 +402,41 @@ class CameraPanel(wx.Panel):
         self.height = height
         self.static_bitmap = wx.Bitmap(width, height)
         self.image_set = False
+        self._frame_number = 0
+        self.view = camera_renderer.add_view(width, height)
+        self.timer = wx.Timer(self)
         self.init_ui()
 
     def init_ui(self) -> None:
         self.SetBackgroundStyle(wx.BG_STYLE_PAINT)
         self.Bind(wx.EVT_PAINT, self.on_paint)
+        # the latest rendered frame is taken at the display rate
+        self.Bind(wx.EVT_TIMER, self.on_timer, self.timer)
+        self.Bind(wx.EVT_WINDOW_DESTROY, self.on_destroy)
+        self.timer.Start(round(1000 / Settings.get("camera.display_fps")))
+
+    def on_timer(self, _: wx.TimerEvent) -> None:
+        self.view.active = self.IsShownOnScreen()
+        if not self.view.active:
+            return
+        latest = self.view.take(self._frame_number)
+        if latest is not None:
+            self._frame_number, pixels = latest
+            self.static_bitmap.CopyFromBuffer(pixels)
+            self.image_set = True
+            self.Refresh()
+
+    def on_destroy(self, e: wx.WindowDestroyEvent) -> None:
+        if e.GetEventObject() is self:
+            self.timer.Stop()
+            camera_renderer.remove_view(self.view)
+        e.Skip()
 
     def on_paint(self, _: wx.PaintEvent) -> None:
         if self.image_set:
             dc = wx.AutoBufferedPaintDC(self)
             dc.DrawBitmap(self.static_bitmap, 0, 0)
 
-    def update_image(self, im: Image) -> None:
-        im = im.resize((self.width, self.height)).tobytes()
-
-        self.static_bitmap.CopyFromBuffer(im)
-        self.image_set = True
-        self.Refresh()
-
 
 class LaserPanel(wx.Panel):
     def __init__(self, parent: wx.Window) -> None:
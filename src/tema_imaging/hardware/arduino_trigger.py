@@ -18,13 +18,51 @@ import logging
 import queue
 import threading
 import time
+from typing import NamedTuple
 
+import numpy as np
 import serial.threaded
-import wx
-from pubsub import pub
+
+from tema_imaging.core.settings import Settings
+from tema_imaging.core.utils import LatencyStatistics
+from tema_imaging.hardware.stage import EventHandler
+from tema_imaging.hardware.trigger_program import program_runs
+from tema_imaging.hardware.utils import GuiNotifier
 
 logger = logging.getLogger(__name__)
 
+PROTOCOL_LEGACY = 1
+PROTOCOL_BATCHED_CONFIG = 2
+PROTOCOL_SPOT_PROGRAM = 3
+
+PROGRAM_CHUNK = 16  # runs per upload line, fits the firmware line buffer
+STEP_COMMAND = b"N"  # sent without terminator
+
+
+class ArduTriggerException(Exception):
+    pass
+
+
+class TriggerEvent(NamedTuple):
+    kind: str  # "D" (done) or "S" (step)
+    received_ns: int  # time.monotonic_ns() when the line was read
+
+
+class TriggerConfig(NamedTuple):
+    shot_count: int
+    freq: int
+    first_only: bool
+    cleaning: bool = False
+    cleaning_delay: int = 0
+
+
+def frame_message(payload: str) -> str:
+    """Append the XOR checksum of the payload: ``<payload>*<checksum hex>``."""
+    checksum = 0
+    for c in payload.encode("ascii"):
+        checksum ^= c
+    return "{}*{:02X}".format(payload, checksum)
+
 
 class ArduTrigger(serial.threaded.LineReader):
     TERMINATOR = b"\n"
@@ -39,13 +77,31 @@ class ArduTrigger(serial.threaded.LineReader):
         self.stop_done_event = threading.Event()
         self.rep_sleep_time = 0
         self.rep_count = 1
-        self.events = queue.Queue[str | None]()
+        self.events = queue.Queue[TriggerEvent | None]()
         self._event_thread = threading.Thread(target=self._run_event)
         self._event_thread.daemon = True
         self._event_thread.name = "at-event"
         self._event_thread.start()
         self.done = False
+        # set with ``done``, ``_wait_done`` sleeps on it
+        self._done_event = threading.Event()
+        self.last_done: TriggerEvent | None = None
+        self._command_sent_ns = 0
         self.send_done_msg = False
+        # direct notification of D and S events on the event thread, the
+        # GUI gets rate limited pubsub messages
+        self.on_done = EventHandler()
+        self.on_step = EventHandler()
+        self.gui_notifier = GuiNotifier(Settings.get("trigger.gui_notify_interval"))
+        # arrival of D to the waiter waking up, command sent to D arrival
+        self.wakeup_latency = LatencyStatistics()
+        self.done_latency = LatencyStatistics()
+        # arrival of S to the measurement reacting to it
+        self.step_latency = LatencyStatistics()
+        self.protocol_version = PROTOCOL_LEGACY
+        self._config: TriggerConfig | None = None
+        self.program_length = 0
+        self.program_position = 0
 
     def stop(self) -> None:
         """
@@ -70,23 +126,28 @@ class ArduTrigger(serial.threaded.LineReader):
         """
         Handle input from serial port, check for events.
         """
+        received_ns = time.monotonic_ns()
         if line.startswith("D") or line.startswith("S"):
-            self.events.put(line)
+            self.events.put(TriggerEvent(line, received_ns))
         else:
             self.responses.put(line)
 
-    def handle_event(self, event: str | None) -> None:
+    def handle_event(self, event: TriggerEvent | None) -> None:
         """Handle events"""
         if event is None:
             return
 
-        if event == "D":
+        if event.kind == "D":
             time.sleep(self.rep_sleep_time / 1000)
+            self.last_done = event
             self.done = True
+            self._done_event.set()
+            self.on_done(event)
             if self.send_done_msg:
-                wx.CallAfter(pub.sendMessage, "trigger.done")
-        elif event == "S":
-            wx.CallAfter(pub.sendMessage, "trigger.step")
+                self.gui_notifier.send("trigger.done")
+        elif event.kind == "S":
+            self.on_step(event)
+            self.gui_notifier.send("trigger.step")
             logger.info("Step trigger received")
 
     def command(self, command: str) -> None:
@@ -94,39 +155,234 @@ class ArduTrigger(serial.threaded.LineReader):
         with self.lock:  # ensure that just one thread is sending commands at once
             self.write_line(command)
 
-    def command_with_response(self, command: str) -> str:
+    def command_with_response(self, command: str, timeout: float | None = None) -> str:
         """
         Send a command and wait for the response.
         """
         with self.lock:  # ensure that just one thread is sending commands at once
+            # replies which arrived after their command timed out, or lines
+            # sent while booting, are not the answer to this command
+            self._drain_responses()
             self._awaiting_response_for = command
             self.write_line(command)
-            response = self.responses.get()
-            self._awaiting_response_for = None
-            return response
+            try:
+                return self.responses.get(timeout=timeout)
+            except queue.Empty:
+                raise ArduTriggerException(
+                    "No response to command '{}'".format(command)
+                )
+            finally:
+                self._awaiting_response_for = None
+
+    def _drain_responses(self) -> None:
+        while True:
+            try:
+                line = self.responses.get_nowait()
+            except queue.Empty:
+                return
+            logger.debug("Discarded trigger response: {}".format(line))
+
+    def detect_protocol(
+        self, boot_timeout: float | None = None, probe_timeout: float = 0.25
+    ) -> int:
+        """
+        Query the firmware protocol version. Firmware without the version
+        command doesn't answer and is treated as legacy firmware.
+
+        Opening the port resets the Arduino and commands sent to the boot
+        loader are lost, so the query is repeated every ``probe_timeout``
+        until ``boot_timeout`` (default ``trigger.boot_timeout``) has
+        passed. Any other line means the firmware is running and only one
+        more query is sent.
+        """
+        if boot_timeout is None:
+            boot_timeout = Settings.get("trigger.boot_timeout")
+        self.protocol_version = PROTOCOL_LEGACY
+        deadline = time.monotonic() + boot_timeout
+        while True:
+            try:
+                response = self.command_with_response("V", probe_timeout)
+            except ArduTriggerException:
+                response = None
+            if response is not None:
+                if response.startswith("V") and response[1:].isdigit():
+                    self.protocol_version = int(response[1:])
+                    break
+                deadline = min(deadline, time.monotonic() + probe_timeout)
+            if time.monotonic() >= deadline:
+                break
+        logger.info("Trigger protocol version: {}".format(self.protocol_version))
+        return self.protocol_version
+
+    def configure(
+        self,
+        count: int,
+        freq: int,
+        first_only: bool,
+        cleaning: bool = False,
+        cleaning_delay: int = 0,
+    ) -> None:
+        """
+        Set shot count, frequency, first-only and cleaning shot settings for
+        the following ``go`` commands. Firmware supporting it gets them in one
+        acknowledged message, otherwise the legacy commands are sent.
+        """
+        config = TriggerConfig(count, freq, first_only, cleaning, cleaning_delay)
+        if config == self._config:
+            return
+
+        if self.protocol_version >= PROTOCOL_BATCHED_CONFIG:
+            message = frame_message(
+                "K{},{},{},{},{}".format(
+                    count, freq, int(first_only), int(cleaning), cleaning_delay
+                )
+            )
+            response = self.command_with_response(message, timeout=1.0)
+            if response != "K":
+                raise ArduTriggerException(
+                    "Configuration not acknowledged: {}".format(response)
+                )
+        else:
+            self.set_count(count)
+            self.set_freq(freq)
+            self.set_first_only(first_only)
+        self._config = config
 
     def set_freq(self, freq: int) -> None:
+        self._config = None
         self.command("F{}".format(freq))
 
     def set_count(self, counts: int) -> None:
+        self._config = None
         self.command("C{}".format(counts))
 
     def set_first_only(self, on: bool) -> None:
+        self._config = None
         self.command("O{}".format(1 if on else 0))
 
+    @property
+    def _firmware_cleaning(self) -> bool:
+        return (
+            self.protocol_version >= PROTOCOL_BATCHED_CONFIG
+            and self._config is not None
+            and self._config.cleaning
+        )
+
+    def upload_program(self, program: np.ndarray) -> bool:
+        """
+        Upload a spot program (``PROGRAM_DTYPE`` entries) which is then
+        advanced with ``step``. Frequency, first-only and cleaning delay are
+        taken from ``configure``. Returns False if the firmware doesn't
+        support programs, the spots have to be fired with ``go`` then.
+
+        The program is sent run-length encoded as ``count:shots:flags``
+        runs, every line of up to ``PROGRAM_CHUNK`` runs is acknowledged.
+        A uniform scan is a single run and costs two round trips.
+        """
+        self.program_length = 0
+        self.program_position = 0
+        if self.protocol_version < PROTOCOL_SPOT_PROGRAM:
+            return False
+
+        runs = program_runs(program)
+        self._program_command("P{}".format(len(program)))
+        for start in range(0, len(runs), PROGRAM_CHUNK):
+            self._program_command(
+                "Q"
+                + ",".join(
+                    "{}:{}:{}".format(*run)
+                    for run in runs[start : start + PROGRAM_CHUNK]
+                )
+            )
+        self.program_length = len(program)
+        logger.info(
+            "Uploaded trigger program ({} spots in {} runs)".format(
+                len(program), len(runs)
+            )
+        )
+        return True
+
+    def _program_command(self, payload: str) -> None:
+        response = self.command_with_response(frame_message(payload), timeout=1.0)
+        if response != "K":
+            raise ArduTriggerException(
+                "Program upload not acknowledged: {}".format(response)
+            )
+
+    def clear_program(self) -> None:
+        self.program_length = 0
+        self.program_position = 0
+
+    @property
+    def program_loaded(self) -> bool:
+        return self.program_length > 0
+
+    def step(self) -> None:
+        """Fire the next spot of the uploaded program."""
+        if self.program_position >= self.program_length:
+            raise ArduTriggerException("Trigger program exhausted")
+        self.program_position += 1
+        with self.lock:
+            self._command_sent_ns = time.monotonic_ns()
+            self.transport.write(STEP_COMMAND)
+
+    def step_and_wait(self) -> None:
+        self._clear_done()
+        self.step()
+        self._wait_done()
+
+    def _clear_done(self) -> None:
+        self.done = False
+        self._done_event.clear()
+
+    def _wait_done(self) -> None:
+        self._done_event.wait()
+        woke_ns = time.monotonic_ns()
+        event = self.last_done
+        if event is not None:
+            self.wakeup_latency.record(woke_ns - event.received_ns)
+            self.done_latency.record(event.received_ns - self._command_sent_ns)
+
+    def reset_statistics(self) -> None:
+        self.wakeup_latency.reset()
+        self.done_latency.reset()
+        self.step_latency.reset()
+
+    def log_statistics(self) -> None:
+        logger.info("trigger D wake-up latency: {}".format(self.wakeup_latency))
+        logger.info("trigger command to D latency: {}".format(self.done_latency))
+        logger.info("trigger step latency: {}".format(self.step_latency))
+
+    def spot_and_wait(self, cleaning: bool = False, delay_ms: int = 200) -> None:
+        """
+        Fire a spot and wait until it is done, from the program if one is
+        loaded.
+        """
+        if self.program_loaded:
+            self.step_and_wait()
+        else:
+            self.go_and_wait(cleaning, delay_ms)
+
+    def blank_spot(self) -> None:
+        """Trigger the TOF only, from the program if one is loaded."""
+        if self.program_loaded:
+            self.step_and_wait()
+        else:
+            self.single_tof()
+
     def go(self) -> None:
         logger.info("go")
         self.command("G")
 
     def go_and_wait(self, cleaning: bool = False, delay_ms: int = 200) -> None:
         logger.info("go_and_wait (cleaning={})".format(cleaning))
-        if cleaning:
+        if cleaning and not self._firmware_cleaning:
             self.single_shot()
             time.sleep(delay_ms / 1000)
+        self._clear_done()
+        self._command_sent_ns = time.monotonic_ns()
         self.command("G")
-        self.done = False
-        while not self.done:
-            time.sleep(0.001)
+        self._wait_done()
 
     def single_shot(self) -> None:
         logger.info("single_shot")
@@ -138,7 +394,7 @@ class ArduTrigger(serial.threaded.LineReader):
     def start_trigger(self) -> None:
         self.cease_continuous_run.clear()
         self.stop_done_event.clear()
-        self.done = False
+        self._clear_done()
 
         class ScheduleThread(threading.Thread):
             @classmethod
@@ -149,10 +405,13 @@ class ArduTrigger(serial.threaded.LineReader):
                 while (
                     not self.cease_continuous_run.is_set() and counter < self.rep_count
                 ):
-                    if self.done:
+                    # woken by D, or by stop_trigger
+                    if self._done_event.wait(0.1):
+                        if self.cease_continuous_run.is_set():
+                            break
+                        self._clear_done()
                         self.go()
                         counter += 1
-                        self.done = False
 
                 self.stop_done_event.set()
 
@@ -163,3 +422,4 @@ class ArduTrigger(serial.threaded.LineReader):
         self.cease_continuous_run.set()
         self.command("S")
         self.done = True
+        self._done_event.set()
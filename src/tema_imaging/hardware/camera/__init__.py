@@ -15,14 +15,18 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import abc
+import logging
 import time
 from importlib import import_module
-from threading import Thread
-from typing import Callable
+from threading import Condition, Lock, Thread
+from typing import Callable, NamedTuple
 
+import numpy as np
 from PIL import Image
 
-from tema_imaging.core.utils import get_project_root
+from tema_imaging.core.utils import LatencyStatistics, get_project_root
+
+logger = logging.getLogger(__name__)
 
 camera_resolutions = {
     "640x480": (640, 480),
@@ -32,8 +36,22 @@ camera_resolutions = {
 }
 
 
+class AcquisitionProfile(NamedTuple):
+    """
+    Acquisition mode of a camera: 8 bit mono instead of RGB, area of
+    interest (x, y, width, height in pixels of the full frame, None for the
+    full frame) and binning (factor per direction).
+    """
+
+    mono: bool = False
+    aoi: tuple[int, int, int, int] | None = None
+    binning: int = 1
+
+
 class Camera(abc.ABC):
     driver_name: str
+    # binning factors of the driver, None if any factor is binned in software
+    binning_factors: tuple[int, ...] | None = None
 
     @staticmethod
     def get_driver_from_name(name: str) -> type["Camera"]:
@@ -47,46 +65,258 @@ class Camera(abc.ABC):
     def __init__(self, dev_id: str, img_width: int, img_height: int) -> None:
         self.img_width = img_width
         self.img_height = img_height
+        # frames delivered, frames lost before they were delivered and
+        # frames captured but not yet delivered, if the driver knows them
+        self.frame_count = 0
+        self.dropped_frames = 0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+
+        self.profile = AcquisitionProfile()
+        self._pending_profile: AcquisitionProfile | None = None
 
     def init(self) -> None:
         pass
 
+    def set_profile(self, profile: AcquisitionProfile) -> None:
+        """
+        Switch the acquisition mode. May be called from any thread, the
+        camera thread applies it before it requests the next frame.
+        """
+        self._pending_profile = profile
+
+    def apply_pending_profile(self) -> None:
+        profile, self._pending_profile = self._pending_profile, None
+        if profile is not None and profile != self.profile:
+            self._apply_profile(profile)
+            self.profile = profile
+
+    def _apply_profile(self, profile: AcquisitionProfile) -> None:
+        """
+        Configure the driver for ``profile``. Drivers without hardware
+        support keep the default, which leaves it to ``_software_profile``.
+        """
+        pass
+
+    def _software_profile(self, frame: np.ndarray) -> np.ndarray:
+        """Crop, convert and bin a full frame as the profile asks."""
+        profile = self.profile
+        if profile.aoi is not None:
+            x, y, width, height = profile.aoi
+            frame = frame[y : y + height, x : x + width]
+        mono = profile.mono and frame.ndim == 3
+        if mono or profile.binning > 1:
+            # PIL's conversions are much faster than the NumPy equivalents
+            image = Image.fromarray(frame)
+            if mono:
+                image = image.convert("L")
+            if profile.binning > 1:
+                image = image.reduce(profile.binning)
+            frame = np.asarray(image)
+        return frame
+
     @abc.abstractmethod
-    def get_frame(self) -> Image.Image:
+    def get_frame_array(self) -> np.ndarray | None:
+        """
+        Next frame as (height, width[, channels]) uint8 array, None if no
+        frame arrived. Drivers return a view of the driver memory where
+        possible, which is only valid until the next frame is requested.
+        """
         pass
 
+    def get_frame(self) -> Image.Image | None:
+        """Copy of the next frame as image, None if no frame arrived."""
+        frame = self.get_frame_array()
+        return None if frame is None else Image.fromarray(frame)
+
     @staticmethod
     @abc.abstractmethod
     def get_device_ids() -> list[str]:
         pass
 
 
+class FrameMailbox:
+    """
+    Single slot for the latest camera frame. The camera thread replaces the
+    frame, readers take it at their own pace. Frames replaced before any
+    reader took them are counted as skipped instead of being queued.
+    """
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._new_frame = Condition(self._lock)
+        self._frame: np.ndarray | None = None
+        self._number = 0
+        self._taken = True
+        self.skipped = 0
+
+    def put(self, frame: np.ndarray) -> None:
+        """Store a copy of ``frame``, which may be driver memory."""
+        frame = frame.copy()
+        frame.flags.writeable = False
+        with self._lock:
+            if not self._taken:
+                self.skipped += 1
+            self._frame = frame
+            self._number += 1
+            self._taken = False
+            self._new_frame.notify_all()
+
+    def get(self, after: int = 0) -> tuple[int, np.ndarray] | None:
+        """
+        Number and (read-only) array of the latest frame, None if there is
+        no frame newer than number ``after``.
+        """
+        with self._lock:
+            return self._get(after)
+
+    def wait(
+        self, after: int = 0, timeout: float | None = None
+    ) -> tuple[int, np.ndarray] | None:
+        """Like ``get``, waiting up to ``timeout`` for a newer frame."""
+        with self._lock:
+            self._new_frame.wait_for(
+                lambda: self._frame is not None and self._number > after, timeout
+            )
+            return self._get(after)
+
+    def next(
+        self, skip: int = 0, timeout: float | None = None
+    ) -> tuple[int, np.ndarray] | None:
+        """
+        The ``skip + 1``-th frame put after the call, e.g. to skip frames
+        exposed while the stage still moved. None if any of them takes
+        longer than ``timeout``.
+        """
+        with self._lock:
+            number = self._number
+            for _ in range(skip + 1):
+                after = number
+                if not self._new_frame.wait_for(lambda: self._number > after, timeout):
+                    return None
+                number = self._number
+            return self._get(number - 1)
+
+    def _get(self, after: int) -> tuple[int, np.ndarray] | None:
+        if self._frame is None or self._number <= after:
+            return None
+        self._taken = True
+        return self._number, self._frame
+
+    def clear(self) -> None:
+        with self._lock:
+            self._frame = None
+            self._taken = True
+
+
+class FrameStatistics(NamedTuple):
+    """Camera thread statistics, rates since the last report."""
+
+    fps: float
+    latency: tuple[float, float, float] | None  # recent mean, p95, max in ms
+    jitter: float  # standard deviation of the frame intervals in ms
+    dropped_frames: int
+
+
 class CameraThread(Thread):
+    """
+    Takes frames from the camera and passes them to ``notify`` with their
+    capture time (``time.monotonic_ns()`` when the driver returned). With
+    ``target_fps`` frames are requested on a fixed schedule, ``max_fps``
+    caps the rate of a free-running (``target_fps`` 0) camera. A late
+    frame moves the schedule instead of being caught up with a burst.
+
+    Every ``statistics_interval`` s the achieved rate, the capture
+    latency (time waiting for the driver) and the jitter of the frame
+    intervals are passed to ``on_statistics``.
+    """
+
     def __init__(
         self,
         camera: Camera,
-        notify: Callable[[Camera, Image.Image], None],
+        notify: Callable[[Camera, np.ndarray, int], None],
         timeout: int = 100,
+        target_fps: float = 0,
+        max_fps: float = 0,
+        on_statistics: Callable[[FrameStatistics], None] | None = None,
+        statistics_interval: float = 1.0,
     ) -> None:
         super(CameraThread, self).__init__()
         self.alive = True
         self.camera = camera
         self.notify = notify
         self.timeout = timeout
+        self.target_fps = target_fps
+        self.max_fps = max_fps
+        self.on_statistics = on_statistics
+        self.statistics_interval = statistics_interval
+
+        self.capture_latency = LatencyStatistics()
+        self._frame_times: list[int] = []  # ns, since the last report
+
+    @property
+    def interval(self) -> float:
+        """Minimum time between frame requests in s."""
+        return max(
+            1 / self.target_fps if self.target_fps else 0,
+            1 / self.max_fps if self.max_fps else 0,
+        )
 
     def run(self) -> None:
+        deadline = time.monotonic()
+        report_at = deadline + self.statistics_interval
+        dropped = self.camera.dropped_frames
         while self.alive:
+            interval = self.interval
+            if interval:
+                time.sleep(max(deadline - time.monotonic(), 0))
+
             # ignore image transfer errors
             try:
-                image = self.camera.get_frame()
-                self.notify(self.camera, image)
+                self.camera.apply_pending_profile()
+                start = time.monotonic_ns()
+                # the frame may be driver memory, notify must not keep it
+                frame = self.camera.get_frame_array()
+                if frame is not None:
+                    captured = time.monotonic_ns()
+                    self.capture_latency.record(captured - start)
+                    self._frame_times.append(captured)
+                    self.camera.frame_count += 1
+                    self.notify(self.camera, frame, captured)
             except CameraException as e:
                 if e.fatal:
                     raise e
-            if self.camera.driver_name == "v4l2":
-                time.sleep(
-                    1 / 30
-                )  # TODO: Fix this; sleep a bit so the UI thread has time to process
+
+            now = time.monotonic()
+            if interval:
+                deadline = max(deadline + interval, now)
+            if now >= report_at:
+                report_at = now + self.statistics_interval
+                statistics = self._statistics(self.camera.dropped_frames - dropped)
+                dropped = self.camera.dropped_frames
+                if self.on_statistics is not None:
+                    self.on_statistics(statistics)
+
+        logger.info(
+            "camera: {} frames, {} dropped, max. queue depth {}, "
+            "capture latency {}".format(
+                self.camera.frame_count,
+                self.camera.dropped_frames,
+                self.camera.max_queue_depth,
+                self.capture_latency,
+            )
+        )
+
+    def _statistics(self, dropped_frames: int) -> FrameStatistics:
+        intervals = np.diff(np.array(self._frame_times, dtype=np.int64)) / 1e6
+        # the last frame starts the next window
+        self._frame_times = self._frame_times[-1:]
+        return FrameStatistics(
+            1000 / intervals.mean() if len(intervals) else 0.0,
+            self.capture_latency.summary(),
+            float(intervals.std()) if len(intervals) else 0.0,
+            dropped_frames,
+        )
 
     def stop(self) -> None:
         self.alive = False
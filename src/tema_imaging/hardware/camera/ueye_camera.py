@@ -17,10 +17,15 @@
 
 from types import TracebackType
 
-from PIL import Image
+import numpy as np
 from pyueye import ueye
 
-from tema_imaging.hardware.camera import Camera, CameraException
+from tema_imaging.core.settings import Settings
+from tema_imaging.hardware.camera import (
+    AcquisitionProfile,
+    Camera,
+    CameraException,
+)
 
 
 class UeyeCameraException(CameraException):
@@ -35,6 +40,14 @@ class UeyeCameraException(CameraException):
 class UeyeCamera(Camera):
     driver_name = "uEye"
 
+    binning_modes = {
+        1: ueye.IS_BINNING_DISABLE,
+        2: ueye.IS_BINNING_2X_VERTICAL | ueye.IS_BINNING_2X_HORIZONTAL,
+        3: ueye.IS_BINNING_3X_VERTICAL | ueye.IS_BINNING_3X_HORIZONTAL,
+        4: ueye.IS_BINNING_4X_VERTICAL | ueye.IS_BINNING_4X_HORIZONTAL,
+    }
+    binning_factors = tuple(binning_modes)
+
     @staticmethod
     def check_code(return_code, ok_codes=None):
         if ok_codes is None:
@@ -83,6 +96,8 @@ class UeyeCamera(Camera):
     ) -> None:
         super().__init__(dev_id, img_width, img_height)
         self.h_cam = ueye.HIDS(int(dev_id))
+        # color mode of profiles which are not mono
+        self.default_color_mode = color_mode
         self.color_mode = color_mode
         self.aoi = ueye.IS_RECT()
         self.aoi.s32X = ueye.int(0)
@@ -92,8 +107,14 @@ class UeyeCamera(Camera):
         self.bpp = UeyeCamera.get_bits_per_pixel(self.color_mode)
         self.n_channels = int((7 + self.bpp) / 8)
 
-        self.mem_id = ueye.int()
-        self.mem_ptr = ueye.c_mem_p()
+        # ring of image memories the driver fills in turn, a memory stays
+        # locked while its frame is used
+        self.buffer_count = Settings.get("camera.buffer_count")
+        self.buffers: list[tuple[ueye.c_mem_p, ueye.int]] = []
+        self._buffer_ids: dict[int, ueye.int] = {}
+        self._locked: tuple[ueye.c_mem_p, ueye.int] | None = None
+        self._frame_number: int | None = None
+
         self.x = ueye.int()
         self.y = ueye.int()
         self.bits = ueye.int()
@@ -112,60 +133,179 @@ class UeyeCamera(Camera):
 
     def init(self) -> None:
         UeyeCamera.check_code(ueye.is_InitCamera(self.h_cam, None))
+        UeyeCamera.check_code(ueye.is_SetDisplayMode(self.h_cam, ueye.IS_SET_DM_DIB))
+        # the requested resolution may exceed the sensor
+        sensor = ueye.SENSORINFO()
+        UeyeCamera.check_code(ueye.is_GetSensorInfo(self.h_cam, sensor))
+        self.img_width = min(self.img_width, int(sensor.nMaxWidth))
+        self.img_height = min(self.img_height, int(sensor.nMaxHeight))
+        self._configure(self.profile)
+        self._start_capture()
 
+    def _apply_profile(self, profile: AcquisitionProfile) -> None:
+        # the image memories depend on the format and size
+        self._stop_capture()
+        self._configure(profile)
+        self._start_capture()
+
+    def _configure(self, profile: AcquisitionProfile) -> None:
+        self.color_mode = ueye.IS_CM_MONO8 if profile.mono else self.default_color_mode
+        self.bpp = UeyeCamera.get_bits_per_pixel(self.color_mode)
+        self.n_channels = int((7 + self.bpp) / 8)
         UeyeCamera.check_code(ueye.is_SetColorMode(self.h_cam, self.color_mode))
-        UeyeCamera.check_code(ueye.is_SetDisplayMode(self.h_cam, ueye.IS_SET_DM_DIB))
+        UeyeCamera.check_code(
+            ueye.is_SetBinning(self.h_cam, UeyeCamera.binning_modes[profile.binning])
+        )
+
+        # AOI in binned pixels, on the sensor's position and size grid
+        x, y, width, height = profile.aoi or (0, 0, self.img_width, self.img_height)
+        pos_inc = ueye.IS_POINT_2D()
+        size_inc = ueye.IS_SIZE_2D()
         UeyeCamera.check_code(
             ueye.is_AOI(
-                self.h_cam, ueye.IS_AOI_IMAGE_SET_AOI, self.aoi, ueye.sizeof(self.aoi)
+                self.h_cam,
+                ueye.IS_AOI_IMAGE_GET_POS_INC,
+                pos_inc,
+                ueye.sizeof(pos_inc),
             )
         )
-
         UeyeCamera.check_code(
-            ueye.is_AllocImageMem(
+            ueye.is_AOI(
                 self.h_cam,
-                self.img_width,
-                self.img_height,
-                self.bpp,
-                self.mem_ptr,
-                self.mem_id,
+                ueye.IS_AOI_IMAGE_GET_SIZE_INC,
+                size_inc,
+                ueye.sizeof(size_inc),
             )
         )
+
+        def snap(value: int, inc: ueye.int) -> int:
+            step = max(inc.value, 1)
+            return value // profile.binning // step * step
+
+        self.aoi.s32X = ueye.int(snap(x, pos_inc.s32X))
+        self.aoi.s32Y = ueye.int(snap(y, pos_inc.s32Y))
+        self.aoi.s32Width = ueye.int(
+            max(snap(width, size_inc.s32Width), size_inc.s32Width.value)
+        )
+        self.aoi.s32Height = ueye.int(
+            max(snap(height, size_inc.s32Height), size_inc.s32Height.value)
+        )
         UeyeCamera.check_code(
-            ueye.is_SetImageMem(self.h_cam, self.mem_ptr, self.mem_id)
+            ueye.is_AOI(
+                self.h_cam, ueye.IS_AOI_IMAGE_SET_AOI, self.aoi, ueye.sizeof(self.aoi)
+            )
         )
+
+    def _start_capture(self) -> None:
+        width = self.aoi.s32Width.value
+        height = self.aoi.s32Height.value
+        for _ in range(self.buffer_count):
+            mem_ptr = ueye.c_mem_p()
+            mem_id = ueye.int()
+            UeyeCamera.check_code(
+                ueye.is_AllocImageMem(
+                    self.h_cam, width, height, self.bpp, mem_ptr, mem_id
+                )
+            )
+            UeyeCamera.check_code(ueye.is_AddToSequence(self.h_cam, mem_ptr, mem_id))
+            self.buffers.append((mem_ptr, mem_id))
+            self._buffer_ids[mem_ptr.value] = mem_id
+        UeyeCamera.check_code(ueye.is_InitImageQueue(self.h_cam, 0))
+
         UeyeCamera.check_code(ueye.is_CaptureVideo(self.h_cam, ueye.IS_DONT_WAIT))
+        mem_ptr, mem_id = self.buffers[0]
         UeyeCamera.check_code(
             ueye.is_InquireImageMem(
                 self.h_cam,
-                self.mem_ptr,
-                self.mem_id,
+                mem_ptr,
+                mem_id,
                 self.x,
                 self.y,
                 self.bits,
                 self.pitch,
             )
         )
+        self._frame_number = None
 
-        ueye.is_EnableEvent(self.h_cam, ueye.IS_SET_EVENT_FRAME)
+    def _stop_capture(self) -> None:
+        self._unlock()
+        ueye.is_StopLiveVideo(self.h_cam, ueye.IS_FORCE_VIDEO_STOP)
+        ueye.is_ExitImageQueue(self.h_cam)
+        ueye.is_ClearSequence(self.h_cam)
+        for mem_ptr, mem_id in self.buffers:
+            ueye.is_FreeImageMem(self.h_cam, mem_ptr, mem_id)
+        self.buffers.clear()
+        self._buffer_ids.clear()
 
-    def get_frame(self) -> Image.Image:
+    def get_frame_array(self) -> np.ndarray | None:
+        """
+        Frame in the oldest filled image memory, which stays locked until
+        the next call.
+        """
+        self._unlock()
+        mem_ptr = ueye.c_mem_p()
+        mem_id = ueye.int()
         if (
-            ueye.is_WaitEvent(self.h_cam, ueye.IS_SET_EVENT_FRAME, 1000)
-            == ueye.IS_SUCCESS
+            ueye.is_WaitForNextImage(self.h_cam, 1000, mem_ptr, mem_id)
+            != ueye.IS_SUCCESS
         ):
-            raw_data = ueye.get_data(
-                self.mem_ptr, self.x, self.y, self.bits, self.pitch, False
-            )
-            if self.n_channels == 1:
-                return Image.frombytes(
-                    "L", (self.img_width, self.img_height), raw_data, "raw", "L"
-                )
-            return Image.frombytes(
-                "RGB", (self.img_width, self.img_height), raw_data, "raw", "RGB"
-            )
+            return None
+
+        self._locked = mem_ptr, mem_id
+        self._update_counters(mem_id)
+        return self._frame_view(mem_ptr)
+
+    def _unlock(self) -> None:
+        if self._locked is not None:
+            mem_ptr, mem_id = self._locked
+            self._locked = None
+            ueye.is_UnlockSeqBuf(self.h_cam, mem_id, mem_ptr)
+
+    def _get_frame_number(self, mem_id: ueye.int) -> int | None:
+        info = ueye.UEYEIMAGEINFO()
+        if (
+            ueye.is_GetImageInfo(self.h_cam, mem_id, info, ueye.sizeof(info))
+            != ueye.IS_SUCCESS
+        ):
+            return None
+        return int(info.u64FrameNumber)
+
+    def _update_counters(self, mem_id: ueye.int) -> None:
+        """Count frames skipped since the last one, and filled buffers."""
+        number = self._get_frame_number(mem_id)
+        if number is None:
+            return
+        if self._frame_number is not None:
+            self.dropped_frames += max(number - self._frame_number - 1, 0)
+        self._frame_number = number
+
+        buffer_number = ueye.int()
+        current = ueye.c_mem_p()
+        last = ueye.c_mem_p()
+        if (
+            ueye.is_GetActSeqBuf(self.h_cam, buffer_number, current, last)
+            != ueye.IS_SUCCESS
+        ):
+            return
+        last_id = self._buffer_ids.get(last.value)
+        last_number = None if last_id is None else self._get_frame_number(last_id)
+        if last_number is not None:
+            self.queue_depth = max(last_number - number, 0)
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+
+    def _frame_view(self, mem_ptr) -> np.ndarray:
+        """Image memory as array, rows are ``pitch`` bytes apart."""
+        raw_data = ueye.get_data(mem_ptr, self.x, self.y, self.bits, self.pitch, False)
+        frame = np.lib.stride_tricks.as_strided(
+            raw_data,
+            (self.aoi.s32Height.value, self.aoi.s32Width.value, self.n_channels),
+            (self.pitch.value, self.n_channels, 1),
+            writeable=False,
+        )
+        if self.n_channels == 1:
+            return frame[:, :, 0]
+        return frame
 
     def close(self) -> None:
-        ueye.is_DisableEvent(self.h_cam, ueye.IS_SET_EVENT_FRAME)
-        ueye.is_FreeImageMem(self.h_cam, self.mem_ptr, self.mem_id)
+        self._stop_capture()
         UeyeCamera.check_code(ueye.is_ExitCamera(self.h_cam))
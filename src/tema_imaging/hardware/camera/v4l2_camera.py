@@ -16,7 +16,7 @@
 
 import glob
 
-from PIL import Image
+import numpy as np
 
 try:
     from PyV4L2Camera.camera import Camera as PYV4L2Camera
@@ -41,16 +41,23 @@ class V4L2Camera(Camera):
     def __init__(
         self, dev_id: str, img_width: int = 640, img_height: int = 480
     ) -> None:
-        super().__init__(dev_id, img_width=640, img_height=480)
+        super().__init__(dev_id, img_width, img_height)
         self.camera = PYV4L2Camera(dev_id, img_width, img_height)
+        # the driver picks the nearest size it supports
+        self.img_width = self.camera.width
+        self.img_height = self.camera.height
 
     def init(self) -> None:
         pass
 
-    def get_frame(self) -> Image.Image:
+    def get_frame_array(self) -> np.ndarray:
+        # no AOI, binning or mono formats in the driver, the profile at least
+        # reduces the data for the GUI and the recorder
         frame = self.camera.get_frame()
-        return Image.frombytes(
-            "RGB", (self.img_width, self.img_height), frame, "raw", "RGB"
+        return self._software_profile(
+            np.frombuffer(frame, dtype=np.uint8).reshape(
+                self.img_height, self.img_width, 3
+            )
         )
 
     def close(self) -> None:
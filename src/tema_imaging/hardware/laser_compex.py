@@ -14,13 +14,26 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+import contextlib
 import enum
+import heapq
+import itertools
 import logging
-import queue
+import re
 import threading
+import time
+from collections import deque
+from collections.abc import Iterator, Sequence
+from typing import NamedTuple
 
 import serial.threaded
 
+from tema_imaging.core.settings import Settings
+from tema_imaging.core.utils import LatencyStatistics
+from tema_imaging.hardware.stage import EventHandler
+
+logger = logging.getLogger(__name__)
+
 
 class OpMode(enum.Enum):
     OFF = "OFF"
@@ -84,15 +97,119 @@ class CompexException(Exception):
     pass
 
 
+class CompexTimeout(CompexException):
+    pass
+
+
+_NUMBER = re.compile(r"^-?\d+(\.\d+)?$")
+
+# valid responses of the queries, anything else is a late response to an
+# earlier query or garbage; queries not listed accept any response
+RESPONSE_PATTERNS = {
+    "OPMODE?": re.compile(r"^[A-Z][A-Z ,]*(:\d+)?$"),
+    "TRIGGER?": re.compile(r"^(INT|EXT)$"),
+    "REPRATE?": _NUMBER,
+    "COUNTS?": _NUMBER,
+    "PRESSURE?": _NUMBER,
+    "HV?": _NUMBER,
+    "EGY?": _NUMBER,
+    "FILTER CONTAMINATION?": _NUMBER,
+    "TOTALCOUNTER?": _NUMBER,
+}
+
+
+class Priority(enum.IntEnum):
+    """Command priorities, lower values are sent first."""
+
+    USER = 0
+    TELEMETRY = 1
+
+
+class PriorityLock:
+    """
+    Lock granted to the waiting thread with the highest priority, in order
+    of arrival within a priority.
+    """
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition()
+        self._locked = False
+        self._waiting: list[tuple[int, int]] = []
+        self._seq = itertools.count()
+
+    def acquire(self, priority: int) -> None:
+        with self._cond:
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._waiting, entry)
+            while self._locked or self._waiting[0] != entry:
+                self._cond.wait()
+            heapq.heappop(self._waiting)
+            self._locked = True
+
+    def release(self) -> None:
+        with self._cond:
+            self._locked = False
+            self._cond.notify_all()
+
+    def higher_waiting(self, priority: int) -> bool:
+        """Whether a thread with a higher priority waits for the lock."""
+        with self._cond:
+            return bool(self._waiting) and self._waiting[0][0] < priority
+
+
+class LaserSample(NamedTuple):
+    wall_time: float  # time.time()
+    monotonic: float  # time.monotonic()
+    status: tuple[OpMode | None, StatusCodes | None]
+    hv: float
+    egy: float
+    pressure: int | None = None
+    tube_temp: float | None = None
+
+
+class _Request:
+    __slots__ = ("command", "pattern", "sent_ns", "deadline", "response")
+
+    def __init__(self, command: str, timeout: float) -> None:
+        self.command = command
+        self.pattern = RESPONSE_PATTERNS.get(command)
+        self.sent_ns = time.monotonic_ns()
+        self.deadline = time.monotonic() + timeout
+        self.response: str | None = None
+
+    def accepts(self, line: str) -> bool:
+        return self.pattern is None or self.pattern.match(line) is not None
+
+
 class CompexLaserProtocol(serial.threaded.LineReader):
+    """
+    Compex RS232 protocol. Queries are answered in order, so responses are
+    matched to the queries in flight in FIFO order and checked against the
+    expected format. Up to ``pipeline_depth`` queries are sent before the
+    first response arrives. A query without response in time is retried
+    after resynchronizing: the queries in flight are dropped together with
+    the responses still arriving for them.
+    """
+
     TERMINATOR = b"\r"
 
     def __init__(self) -> None:
         super(CompexLaserProtocol, self).__init__()
         self.alive = True
-        self.responses = queue.Queue[str]()
-        self.lock = threading.Lock()
-        self._awaiting_response_for: str | None = None
+        self.lock = PriorityLock()
+        self.queue_wait = {p: LatencyStatistics() for p in Priority}
+        self.on_opmode_command = EventHandler()
+
+        self.timeout = Settings.get("laser.response.timeout")
+        self.retries = Settings.get("laser.response.retries")
+        self.pipeline_depth = Settings.get("laser.response.pipeline_depth")
+        self.resync_time = Settings.get("laser.response.resync_time")
+        self._cond = threading.Condition()
+        self._in_flight = deque[_Request]()
+        self._discard_until = 0.0
+        # query sent to response received
+        self.round_trip = LatencyStatistics()
+        self.timeouts = 0
 
         self.connection_lost_cb = None
 
@@ -100,45 +217,179 @@ class CompexLaserProtocol(serial.threaded.LineReader):
         """
         Stop the event processing thread, abort pending commands, if any.
         """
-        self.alive = False
-        self.responses.put("<exit>")  # TODO: ??
+        with self._cond:
+            self.alive = False
+            self._cond.notify_all()
 
     def connection_lost(self, exc: Exception) -> None:
+        self.stop()
         logging.exception(exc)
         if self.connection_lost_cb:
             self.connection_lost_cb(exc)
 
     def handle_line(self, line: str) -> None:
         """
-        Handle input from serial port, check for events.
+        Handle input from serial port, match responses to the queries.
         """
-        self.responses.put(line)
+        with self._cond:
+            now = time.monotonic()
+            if now < self._discard_until:
+                self._discard_until = now + self.resync_time
+                logger.debug("Discarded '{}' while resynchronizing".format(line))
+            elif not self._in_flight:
+                logger.warning("Unexpected response '{}'".format(line))
+            elif not self._in_flight[0].accepts(line):
+                logger.warning(
+                    "Discarded response '{}' to '{}'".format(
+                        line, self._in_flight[0].command
+                    )
+                )
+            else:
+                self._in_flight.popleft().response = line
+                self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def _locked(self, priority: Priority) -> Iterator[None]:
+        """Hold the command lock, measure the time waited for it."""
+        start = time.monotonic_ns()
+        self.lock.acquire(priority)
+        self.queue_wait[priority].record(time.monotonic_ns() - start)
+        try:
+            yield
+        finally:
+            self.lock.release()
 
-    def command(self, command: str) -> None:
+    def command(self, command: str, priority: Priority = Priority.USER) -> None:
         """Send a command that doesn't respond"""
-        with self.lock:  # ensure that just one thread is sending commands at once
+        with self._locked(priority):  # just one thread is sending commands at once
             try:
                 self.write_line(command)
             except serial.SerialException as exc:
                 self.connection_lost(exc)
 
-    def command_with_response(self, command: str) -> str:
+    def command_with_response(
+        self,
+        command: str,
+        priority: Priority = Priority.USER,
+        timeout: float | None = None,
+    ) -> str:
         """
-        Set an Compex command and wait for the response.
+        Set an Compex command and wait for the response, ``timeout``
+        defaults to ``laser.response.timeout``.
         """
-        with self.lock:  # ensure that just one thread is sending commands at once
-            self._awaiting_response_for = command
-            self.write_line(command)
+        with self._locked(priority):  # just one thread is sending commands at once
+            return self._query([command], timeout)[0]
+
+    def _query(
+        self, commands: Sequence[str], timeout: float | None = None
+    ) -> list[str]:
+        """
+        Send the queries and return their responses, retrying after
+        timeouts. The caller holds the lock.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        failures = 0
+        while True:
             try:
-                response = self.responses.get()
-            except queue.Empty as e:
-                self.connection_lost(e)
-            self._awaiting_response_for = None
-            return response
+                return self._exchange(commands, timeout)
+            except CompexTimeout as e:
+                self.timeouts += 1
+                failures += 1
+                self._resync()
+                if failures > self.retries:
+                    raise
+                logger.warning("{}, retrying".format(e))
+
+    def _exchange(self, commands: Sequence[str], timeout: float) -> list[str]:
+        """
+        Send the queries pipelined. With a lost response the following
+        responses match the wrong queries until one times out, so the
+        responses are only valid if all arrived.
+        """
+        todo = deque(commands)
+        sent = deque[_Request]()
+        responses = []
+        while todo or sent:
+            while todo and len(sent) < self.pipeline_depth:
+                request = _Request(todo.popleft(), timeout)
+                with self._cond:
+                    self._in_flight.append(request)
+                self.write_line(request.command)
+                sent.append(request)
+
+            request = sent.popleft()
+            with self._cond:
+                while request.response is None and self.alive:
+                    wait = request.deadline - time.monotonic()
+                    if wait <= 0:
+                        raise CompexTimeout(
+                            "No response to '{}'".format(request.command)
+                        )
+                    self._cond.wait(wait)
+            if request.response is None:
+                raise CompexException("Connection closed")
+            self.round_trip.record(time.monotonic_ns() - request.sent_ns)
+            responses.append(request.response)
+        return responses
+
+    def _resync(self) -> None:
+        """
+        Drop the queries in flight and wait until their responses stopped
+        arriving.
+        """
+        with self._cond:
+            self._in_flight.clear()
+            self._discard_until = time.monotonic() + self.resync_time
+            while self.alive:
+                wait = self._discard_until - time.monotonic()
+                if wait <= 0:
+                    break
+                self._cond.wait(wait)
+
+    def query_batch(
+        self, commands: Sequence[str], priority: Priority = Priority.TELEMETRY
+    ) -> list[str]:
+        """
+        Send several queries holding the lock once, pipelined. The lock is
+        handed over between pipelined groups if commands with a higher
+        priority are waiting.
+        """
+        responses: list[str] = []
+        with self._locked(priority):
+            for i in range(0, len(commands), self.pipeline_depth):
+                if i and self.lock.higher_waiting(priority):
+                    self.lock.release()
+                    self.lock.acquire(priority)
+                responses += self._query(commands[i : i + self.pipeline_depth])
+        return responses
+
+    def poll_telemetry(self, gas: bool = False) -> LaserSample:
+        """
+        Opmode, HV and energy, with ``gas`` also pressure and tube
+        temperature, in one batch with telemetry priority.
+        """
+        commands = ["OPMODE?", "HV?", "EGY?"]
+        if gas:
+            commands += ["PRESSURE?", "RESERVOIR TEMP?"]
+        responses = self.query_batch(commands)
+        sample = LaserSample(
+            time.time(),
+            time.monotonic(),
+            self._parse_opmode(responses[0]),
+            float(responses[1]),
+            float(responses[2]),
+        )
+        if gas:
+            try:
+                tube_temp = float(responses[4])
+            except ValueError:
+                tube_temp = None
+            sample = sample._replace(pressure=int(responses[3]), tube_temp=tube_temp)
+        return sample
 
-    @property
-    def opmode(self) -> tuple[OpMode | None, StatusCodes | None]:
-        data = self.command_with_response("OPMODE?").split(":")
+    @staticmethod
+    def _parse_opmode(response: str) -> tuple[OpMode | None, StatusCodes | None]:
+        data = response.split(":")
 
         try:
             opmode = OpMode(data[0])
@@ -150,9 +401,14 @@ class CompexLaserProtocol(serial.threaded.LineReader):
         else:
             return opmode, None
 
+    @property
+    def opmode(self) -> tuple[OpMode | None, StatusCodes | None]:
+        return self._parse_opmode(self.command_with_response("OPMODE?"))
+
     @opmode.setter
     def opmode(self, mode: OpMode) -> None:
         self.command("OPMODE={}".format(mode.value))
+        self.on_opmode_command()
 
     @property
     def trigger(self) -> TriggerModes | None:
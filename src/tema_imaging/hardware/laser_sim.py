@@ -0,0 +1,256 @@
+# This file is part of the TEMAimaging project.
+# Copyright (c) 2020, ETH Zurich
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Model of the Compex laser serial interface, to run the laser without
+hardware.
+"""
+
+import logging
+import random
+import time
+from collections.abc import Callable
+
+from tema_imaging.hardware.laser_compex import (
+    CompexLaserProtocol,
+    OpMode,
+    StatusCodes,
+    TriggerModes,
+)
+from tema_imaging.hardware.sim_device import LoopbackTransport, SimulatedDevice
+
+logger = logging.getLogger(__name__)
+
+FILLS = (
+    OpMode.NEW_FILL,
+    OpMode.PRESERVATION_FILL,
+    OpMode.PURGE_RESERVOIR,
+    OpMode.SAFETY_FILL,
+    OpMode.TRANSPORT_FILL,
+    OpMode.FLUSHING,
+    OpMode.MANUAL_FILL_INERT,
+)
+
+
+class LaserDevice(SimulatedDevice):
+    """
+    Compex state: the opmode with the OFF,WAIT and gas fill phases, pulses
+    at the repetition rate while ON with the internal trigger, pulse energy
+    proportional to the HV, counters and filter contamination. ``status`` is
+    reported with the opmode, an ``interlock`` other than NONE prevents ON.
+
+    In real time every command takes ``latency`` plus up to ``jitter`` to
+    process. Responses are lost with the probability ``drop_rate``.
+    """
+
+    TERMINATOR = b"\r"
+
+    OFF_WAIT_TIME = 2.0  # s
+    FILL_TIME = 5.0  # s
+    ENERGY_PER_KV = 15.0  # mJ
+    ENERGY_NOISE = 0.01  # relative
+    HV_RANGE = (18.0, 30.0)  # kV
+    MAX_REPRATE = 50  # Hz
+    MAX_REPRATE_COD = 20  # Hz
+
+    def __init__(
+        self,
+        realtime: bool = False,
+        baudrate: int | None = None,
+        latency: float = 0.01,
+        jitter: float = 0.0,
+        drop_rate: float = 0.0,
+        status: StatusCodes = StatusCodes.NO_MSG_OR_WARN_OR_INTERLOCK,
+        interlock: str = "NONE",
+        seed: int | None = None,
+    ) -> None:
+        super().__init__(realtime, baudrate)
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.status = status
+        self.interlock = interlock
+        self._random = random.Random(seed)
+
+        self.opmode = OpMode.OFF
+        self._opmode_until = 0.0  # end of OFF,WAIT or a fill
+        self.trigger = TriggerModes.INT
+        self.reprate = 10
+        self.counts = 0
+        self.total_counter = 0
+        self.hv = 22.0
+        self.egy = 0.0
+        self.pressure = 3500
+        self.tube_temp = 35.0
+        self.temp_control = "ON"
+        self.cod = "OFF"
+        self.filter_contamination = 0
+        self._pulses = 0.0
+        self._updated = time.monotonic()
+
+        self.commands = 0
+        self.dropped = 0
+
+        self._queries: dict[str, Callable[[], str]] = {
+            "OPMODE": self._opmode_response,
+            "TRIGGER": lambda: self.trigger.value,
+            "REPRATE": lambda: str(self.reprate),
+            "COUNTS": lambda: str(self.counts),
+            "HV": lambda: "{:.1f}".format(self.hv),
+            "EGY": lambda: "{:.1f}".format(self.egy),
+            "PRESSURE": lambda: str(self.pressure),
+            "RESERVOIR TEMP": lambda: "{:.1f}".format(self.tube_temp),
+            "TEMP CONTROL": lambda: self.temp_control,
+            "COD": lambda: self.cod,
+            "FILTER CONTAMINATION": lambda: str(self.filter_contamination),
+            "INTERLOCK": lambda: self.interlock,
+            "POWER STABILIZATION ACHIEVED": self._stabilization_response,
+            "TOTALCOUNTER": lambda: str(self.total_counter),
+            "TYPE OF LASER": lambda: "COMPEX 102",
+            "VERSION": lambda: "SIM",
+        }
+        self._setters: dict[str, Callable[[str], None]] = {
+            "OPMODE": self._set_opmode,
+            "TRIGGER": self._set_trigger,
+            "REPRATE": self._set_reprate,
+            "COUNTS": self._set_counts,
+            "HV": self._set_hv,
+            "COD": self._set_cod,
+            "FILTER CONTAMINATION": self._reset_filter_contamination,
+        }
+
+    def _handle_line(self, line: str) -> None:
+        if not line:
+            return
+        self.commands += 1
+        self._run(self.latency + self._random.uniform(0, self.jitter))
+        self._update()
+
+        if line.endswith("?"):
+            query = self._queries.get(line[:-1])
+            if query is None:
+                logger.debug("Unknown query: {}".format(line))
+            else:
+                self._respond(query())
+            return
+
+        name, _, value = line.partition("=")
+        setter = self._setters.get(name)
+        if setter is None or not value:
+            logger.debug("Unknown command: {}".format(line))
+            return
+        try:
+            setter(value)
+        except ValueError:
+            logger.debug("Invalid value: {}".format(line))
+
+    def _respond(self, response: str) -> None:
+        if self.drop_rate and self._random.random() < self.drop_rate:
+            self.dropped += 1
+            return
+        self._send(response)
+
+    def _update(self) -> None:
+        """Advance the state to now."""
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+
+        if self._opmode_until and now >= self._opmode_until:
+            self.opmode = OpMode.OFF
+            self._opmode_until = 0.0
+
+        if self.opmode == OpMode.ON and self.trigger == TriggerModes.INT:
+            self._pulses += elapsed * self.reprate
+            pulses = int(self._pulses)
+            self._pulses -= pulses
+            if pulses:
+                self.counts += pulses
+                self.total_counter += pulses
+                self.filter_contamination += pulses
+                self.egy = (
+                    self.hv
+                    * self.ENERGY_PER_KV
+                    * self._random.gauss(1, self.ENERGY_NOISE)
+                )
+
+    def _opmode_response(self) -> str:
+        if self.opmode == OpMode.OFF_WAIT:
+            return self.opmode.value
+        return "{}:{}".format(self.opmode.value, int(self.status))
+
+    def _stabilization_response(self) -> str:
+        return "YES" if self.opmode == OpMode.ON else "NO"
+
+    def _set_opmode(self, value: str) -> None:
+        mode = OpMode(value)
+        self._opmode_until = 0.0
+        if mode == OpMode.ON and self.interlock != "NONE":
+            self.status = StatusCodes.INTERLOCK
+        elif mode == OpMode.OFF and self.opmode != OpMode.OFF:
+            self.opmode = OpMode.OFF_WAIT
+            self._opmode_until = time.monotonic() + self.OFF_WAIT_TIME
+        elif mode in FILLS:
+            self.opmode = mode
+            self._opmode_until = time.monotonic() + self.FILL_TIME
+        else:
+            self.opmode = mode
+            self._pulses = 0.0
+
+    def _set_trigger(self, value: str) -> None:
+        self.trigger = TriggerModes(value)
+
+    def _set_reprate(self, value: str) -> None:
+        rate = int(value)
+        limit = self.MAX_REPRATE_COD if self.cod == "ON" else self.MAX_REPRATE
+        if rate > limit:
+            self.status = (
+                StatusCodes.REPRATE_FOR_COD_HIGH
+                if self.cod == "ON"
+                else StatusCodes.ENTERED_VALUE_TOO_HIGH
+            )
+            return
+        self.reprate = max(rate, 1)
+
+    def _set_counts(self, value: str) -> None:
+        self.counts = int(value)
+
+    def _set_hv(self, value: str) -> None:
+        hv = float(value)
+        if hv > self.HV_RANGE[1]:
+            self.status = StatusCodes.ENTERED_VALUE_TOO_HIGH
+            return
+        self.hv = max(hv, self.HV_RANGE[0])
+
+    def _set_cod(self, value: str) -> None:
+        if value not in ("ON", "OFF"):
+            raise ValueError(value)
+        self.cod = value
+
+    def _reset_filter_contamination(self, value: str) -> None:
+        if value != "RESET":
+            raise ValueError(value)
+        self.filter_contamination = 0
+
+
+def connect(
+    device: LaserDevice | None = None,
+) -> tuple[CompexLaserProtocol, LaserDevice]:
+    """Create a laser protocol connected to a (new) simulated device."""
+    device = device or LaserDevice()
+    laser = CompexLaserProtocol()
+    LoopbackTransport(device, laser)
+    return laser, device
@@ -0,0 +1,157 @@
+# This file is part of the TEMAimaging project.
+# Copyright (c) 2020, ETH Zurich
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Base of the in-process device models that stand in for the hardware.
+"""
+
+import heapq
+import queue
+import threading
+import time
+
+import serial.threaded
+
+
+class SimulatedDevice:
+    """
+    Line based device model. Bytes from the host are passed to ``write``,
+    lines to the host are put into ``output`` (None when closed).
+
+    With ``realtime`` the device takes as long as the hardware: commands
+    keep it busy for the durations passed to ``_run``, and with a
+    ``baudrate`` every byte takes 10 bit times on the line. Otherwise every
+    answer is immediate.
+    """
+
+    TERMINATOR = b"\n"
+
+    def __init__(self, realtime: bool = False, baudrate: int | None = None) -> None:
+        self.realtime = realtime
+        self.baudrate = baudrate
+        self.output = queue.Queue[bytes | None]()
+        self._buffer = bytearray()
+
+        self._arrival = 0.0  # when the last command was fully received
+        self._busy_until = 0.0  # end of the last command execution
+        self._last_due = 0.0
+        self._pending: list[tuple[float, int, bytes]] = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._scheduler: threading.Thread | None = None
+
+    def write(self, data: bytes) -> None:
+        self._arrival = time.monotonic() + self._transfer_time(len(data))
+        for b in data:
+            self._receive(b)
+
+    def _receive(self, b: int) -> None:
+        if b == self.TERMINATOR[0]:
+            line = self._buffer.decode("ascii", errors="replace")
+            self._buffer.clear()
+            self._handle_line(line)
+        else:
+            self._buffer.append(b)
+
+    def _handle_line(self, line: str) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        with self._cond:
+            self._pending.clear()
+            self._scheduler = None
+            self._cond.notify()
+        self.output.put(None)
+
+    def _transfer_time(self, size: int) -> float:
+        if not self.realtime or not self.baudrate:
+            return 0.0
+        return 10 * size / self.baudrate
+
+    def _run(self, duration: float) -> None:
+        """Keep the device busy for ``duration`` after the current command."""
+        if self.realtime:
+            start = max(self._arrival, self._busy_until)
+            self._busy_until = start + duration
+
+    def _send(self, line: str) -> None:
+        data = line.encode("ascii") + self.TERMINATOR
+        if not self.realtime:
+            self.output.put(data)
+            return
+
+        due = max(self._arrival, self._busy_until, self._last_due)
+        due += self._transfer_time(len(data))
+        self._last_due = due
+        with self._cond:
+            heapq.heappush(self._pending, (due, self._seq, data))
+            self._seq += 1
+            if self._scheduler is None:
+                self._scheduler = threading.Thread(
+                    target=self._run_scheduler,
+                    name="{}-scheduler".format(type(self).__name__),
+                )
+                self._scheduler.daemon = True
+                self._scheduler.start()
+            self._cond.notify()
+
+    def _run_scheduler(self) -> None:
+        """Pass scheduled lines to the output when they are due."""
+        with self._cond:
+            while self._scheduler is threading.current_thread():
+                if not self._pending:
+                    self._cond.wait()
+                    continue
+                wait = self._pending[0][0] - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                self.output.put(heapq.heappop(self._pending)[2])
+
+
+class LoopbackTransport:
+    """
+    Connects a protocol to a ``SimulatedDevice`` in place of the serial
+    port. Device output is delivered by a reader thread, like
+    ``serial.threaded.ReaderThread`` does.
+    """
+
+    def __init__(
+        self, device: SimulatedDevice, protocol: serial.threaded.Protocol
+    ) -> None:
+        self.device = device
+        self.protocol = protocol
+        self._reader = threading.Thread(
+            target=self._run, name="{}-reader".format(type(device).__name__)
+        )
+        self._reader.daemon = True
+        self._reader.start()
+        protocol.connection_made(self)
+
+    def _run(self) -> None:
+        while True:
+            data = self.device.output.get()
+            if data is None:
+                break
+            self.protocol.data_received(data)
+
+    def write(self, data: bytes) -> None:
+        self.device.write(data)
+
+    def close(self) -> None:
+        self.device.close()
+        self._reader.join()
+        self.protocol.connection_lost(None)
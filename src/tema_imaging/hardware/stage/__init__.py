@@ -14,14 +14,23 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
-import collections
+import inspect
+import logging
+import threading
+import time
+import weakref
 from abc import ABC, abstractmethod
+from concurrent.futures import Executor, Future
 from enum import Enum
-from typing import Any, Callable, Self, Type
+from typing import Callable, Self, Type
+
+import numpy as np
 
 from tema_imaging.core.settings import Settings
 from tema_imaging.scans import Spot
 
+logger = logging.getLogger(__name__)
+
 
 class AxisType(Enum):
     X = 0
@@ -44,33 +53,236 @@ class StageError(Exception):
     pass
 
 
-class EventHandler:
-    # TODO: semantics for unregistering event handlers after scan is done
+class SettleCriterion:
+    """
+    Treat a moved axis as settled once its position stays within ``tolerance``
+    (nm) of the move target for ``samples`` consecutive polls, instead of
+    waiting for the controller to report the axis as stopped/holding.
+    """
+
+    def __init__(self, tolerance: int, samples: int) -> None:
+        self.tolerance = tolerance
+        self.samples = max(1, samples)
+
+    def __repr__(self) -> str:
+        return "Tolerance: {} nm, Samples: {}".format(self.tolerance, self.samples)
+
+
+class SettleStatistics:
     def __init__(self) -> None:
-        self._handlers: list[Callable[[Any | None], None]] = []
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def reset(self) -> None:
+        with self._lock:
+            self.count = 0
+            self.total = 0.0
+            self.max = 0.0
+
+    def record(self, saved: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.total += saved
+            self.max = max(self.max, saved)
+
+    @property
+    def mean(self) -> float:
+        with self._lock:
+            return self.total / self.count if self.count else 0.0
+
+    def __repr__(self) -> str:
+        return (
+            "Early completions: {}, Saved: {:.3f} s, Mean: {:.1f} ms, Max: {:.1f} ms"
+        ).format(self.count, self.total, self.mean * 1000, self.max * 1000)
+
+
+class HandlerStatistics:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls = 0
+            self.total = 0.0
+            self.max = 0.0
+
+    def record(self, duration: float) -> None:
+        # handlers may run on several executor workers at once
+        with self._lock:
+            self.calls += 1
+            self.total += duration
+            self.max = max(self.max, duration)
+
+    def merge(self, other: "HandlerStatistics") -> None:
+        with other._lock:
+            calls, total, maximum = other.calls, other.total, other.max
+        with self._lock:
+            self.calls += calls
+            self.total += total
+            self.max = max(self.max, maximum)
 
-    def __iadd__(self, handler: Callable[[Any | None], None]) -> Self:
-        if handler not in self._handlers:
-            self._handlers.append(handler)
+    @property
+    def mean(self) -> float:
+        with self._lock:
+            return self.total / self.calls if self.calls else 0.0
+
+    def __repr__(self) -> str:
+        return "{}: calls: {}, mean: {:.3f} ms, max: {:.3f} ms".format(
+            self.name, self.calls, self.mean * 1000, self.max * 1000
+        )
+
+
+class _HandlerRef:
+    def __init__(self, handler: Callable[..., None], weak: bool) -> None:
+        self._handler: Callable[..., None] | None = None
+        self._ref: weakref.ref | None = None
+        if not weak:
+            self._handler = handler
+        elif inspect.ismethod(handler):
+            self._ref = weakref.WeakMethod(handler)
+        else:
+            self._ref = weakref.ref(handler)
+        self.statistics = HandlerStatistics(
+            getattr(handler, "__qualname__", repr(handler))
+        )
+
+    def resolve(self) -> Callable[..., None] | None:
+        if self._ref is not None:
+            return self._ref()
+        return self._handler
+
+
+class EventHandler:
+    """
+    Thread-safe handler registry. Subscribing and unsubscribing replace the
+    handler tuple (copy-on-write), so notifying never needs to take the lock
+    and a handler list change doesn't affect an ongoing notification.
+
+    Handlers are called inline on the notifying thread unless an executor is
+    set, in which case they are submitted to it and the notifier returns
+    immediately.
+
+    The timing of removed handlers is kept, summed up per handler name, so
+    that handlers which only live for one scan still show up in the
+    statistics until ``reset_statistics``.
+    """
+
+    # TODO: semantics for unregistering event handlers after scan is done
+    def __init__(self, executor: Executor | None = None) -> None:
+        self._lock = threading.Lock()
+        self._handlers: tuple[_HandlerRef, ...] = ()
+        self._retired: dict[str, HandlerStatistics] = {}
+        self.executor = executor
+
+    def subscribe(self, handler: Callable[..., None], weak: bool = False) -> None:
+        with self._lock:
+            if self._find(handler) is None:
+                self._handlers = self._handlers + (_HandlerRef(handler, weak),)
+
+    def unsubscribe(self, handler: Callable[..., None]) -> None:
+        with self._lock:
+            ref = self._find(handler)
+            if ref is not None:
+                self._handlers = tuple(h for h in self._handlers if h is not ref)
+                self._retire(ref)
+
+    def _find(self, handler: Callable[..., None]) -> _HandlerRef | None:
+        for ref in self._handlers:
+            if ref.resolve() == handler:
+                return ref
+        return None
+
+    def _retire(self, ref: _HandlerRef) -> None:
+        name = ref.statistics.name
+        if name not in self._retired:
+            self._retired[name] = HandlerStatistics(name)
+        self._retired[name].merge(ref.statistics)
+
+    def _prune(self) -> None:
+        with self._lock:
+            for ref in self._handlers:
+                if ref.resolve() is None:
+                    self._retire(ref)
+            self._handlers = tuple(h for h in self._handlers if h.resolve() is not None)
+
+    def __iadd__(self, handler: Callable[..., None]) -> Self:
+        self.subscribe(handler)
         return self
 
-    def __isub__(self, handler: Callable[[Any | None], None]) -> Self:
-        if handler in self._handlers:
-            self._handlers.remove(handler)
+    def __isub__(self, handler: Callable[..., None]) -> Self:
+        self.unsubscribe(handler)
         return self
 
+    def __len__(self) -> int:
+        return len(self._handlers)
+
     def __call__(self, *args, **kwargs) -> None:
         self._notify(*args, **kwargs)
 
+    @property
+    def statistics(self) -> list[HandlerStatistics]:
+        """Timing of the current handlers and of the removed ones."""
+        merged: dict[str, HandlerStatistics] = {}
+        with self._lock:
+            for stats in list(self._retired.values()) + [
+                ref.statistics for ref in self._handlers
+            ]:
+                if stats.name not in merged:
+                    merged[stats.name] = HandlerStatistics(stats.name)
+                merged[stats.name].merge(stats)
+        return list(merged.values())
+
+    def reset_statistics(self) -> None:
+        with self._lock:
+            self._retired.clear()
+            for ref in self._handlers:
+                ref.statistics.reset()
+
     def _notify(self, *args, **kwargs) -> None:
-        for handler in self._handlers:
+        dead = False
+        for ref in self._handlers:
+            handler = ref.resolve()
+            if handler is None:
+                dead = True
+                continue
+            if self.executor is None:
+                self._dispatch(ref, handler, *args, **kwargs)
+            else:
+                self.executor.submit(
+                    self._dispatch, ref, handler, *args, **kwargs
+                ).add_done_callback(self._log_exception)
+        if dead:
+            self._prune()
+
+    @staticmethod
+    def _dispatch(
+        ref: _HandlerRef, handler: Callable[..., None], *args, **kwargs
+    ) -> None:
+        start = time.perf_counter()
+        try:
             handler(*args, **kwargs)
+        finally:
+            ref.statistics.record(time.perf_counter() - start)
+
+    @staticmethod
+    def _log_exception(future: Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Event handler failed", exc_info=future.exception())
 
 
 class Axis(ABC):
     def __init__(self, name: str, channel: int) -> None:
         self._name = name
         self._channel = channel
+        self._moved = False
+        self._target: int | None = None
+        self.settle_count = 0
 
     def __repr__(self) -> str:
         return "Name: {}, Channel: {}".format(self._name, self._channel)
@@ -136,27 +348,152 @@ class Axis(ABC):
     def status(self) -> AxisStatus:
         pass
 
+    @property
+    def moved(self) -> bool:
+        return self._moved
 
-class MovementQueue(collections.deque[dict[AxisType, float]]):
-    def __init__(self) -> None:
-        super().__init__()
+    @property
+    def target(self) -> int | None:
+        """Target of the last absolute move, None if unknown."""
+        return self._target
+
+    def reset_moved(self) -> None:
+        self._moved = False
+
+
+class MovementQueueFull(StageError):
+    pass
+
+
+class MovementQueue:
+    """
+    Bounded FIFO of stage frames backed by preallocated arrays. Each frame is
+    an int32 XYZ triple plus a bit mask (``1 << AxisType.value``) of the axes
+    to move, so pushing and popping frames doesn't allocate per frame.
+    """
+
+    AXES_XY = 0b011
+    AXES_ALL = 0b111
+
+    def __init__(self, capacity: int = 65536) -> None:
+        self._capacity = capacity
+        self._frames = np.zeros((capacity, 3), dtype=np.int32)
+        self._masks = np.zeros(capacity, dtype=np.uint8)
+        self._head = 0  # next frame to pop
+        self._size = 0
+        self._not_full = threading.Condition()
         self.on_queue_finished = EventHandler()
 
-    def put(self, item: Spot | dict[AxisType, float]) -> None:
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    @property
+    def free(self) -> int:
+        return self._capacity - self._size
+
+    def clear(self) -> None:
+        with self._not_full:
+            self._head = 0
+            self._size = 0
+            self._not_full.notify_all()
+
+    def _wait_for_space(self, block: bool, timeout: float | None) -> bool:
+        if self._size < self._capacity:
+            return True
+        if not block:
+            return False
+        return self._not_full.wait_for(
+            lambda: self._size < self._capacity, timeout=timeout
+        )
+
+    def put(
+        self,
+        item: Spot | dict[AxisType, float],
+        block: bool = False,
+        timeout: float | None = None,
+    ) -> None:
         if isinstance(item, Spot):
-            item = {AxisType.X: item.X, AxisType.Y: item.Y, AxisType.Z: item.Z}
-            super().appendleft(item)
+            values = (item.X, item.Y, item.Z)
         elif isinstance(item, dict):
-            super().appendleft(item)
+            values = (
+                item.get(AxisType.X),
+                item.get(AxisType.Y),
+                item.get(AxisType.Z),
+            )
         else:
             raise ValueError("Invalid frame passed to movement queue.")
 
+        with self._not_full:
+            if not self._wait_for_space(block, timeout):
+                raise MovementQueueFull("Movement queue is full.")
+            tail = (self._head + self._size) % self._capacity
+            mask = 0
+            for i, v in enumerate(values):
+                if v is not None:
+                    self._frames[tail, i] = round(v)
+                    mask |= 1 << i
+            self._masks[tail] = mask
+            self._size += 1
+
+    def extend(
+        self,
+        frames: np.ndarray,
+        mask: int | np.ndarray = AXES_ALL,
+        block: bool = False,
+        timeout: float | None = None,
+    ) -> int:
+        """
+        Enqueue an (N, 2) or (N, 3) array of positions moving the axes in
+        ``mask`` (either one mask for all frames or one per frame). Without
+        ``block`` only as many frames as there is free space for are enqueued;
+        returns the number of frames enqueued.
+        """
+        count = len(frames)
+        done = 0
+        with self._not_full:
+            while done < count:
+                if not self._wait_for_space(block, timeout):
+                    break
+                tail = (self._head + self._size) % self._capacity
+                n = min(count - done, self.free, self._capacity - tail)
+                chunk = frames[done : done + n]
+                self._frames[tail : tail + n, : chunk.shape[1]] = chunk
+                self._masks[tail : tail + n] = (
+                    mask if isinstance(mask, int) else mask[done : done + n]
+                )
+                self._size += n
+                done += n
+        return done
+
+    def pop(self) -> tuple[int, int, int, int]:
+        """Remove the oldest frame and return it as (x, y, z, mask)."""
+        with self._not_full:
+            if not self._size:
+                raise IndexError("pop from an empty movement queue")
+            i = self._head
+            x, y, z = self._frames[i].tolist()
+            mask = int(self._masks[i])
+            self._head = (i + 1) % self._capacity
+            self._size -= 1
+            self._not_full.notify()
+        return x, y, z, mask
+
 
 class Stage(ABC):
     def __init__(self) -> None:
-        self.movement_queue = MovementQueue()
+        self.movement_queue = MovementQueue(
+            Settings.get("stage.movement_queue_capacity")
+        )
         self.on_movement_completed = EventHandler()
         self.on_frame_completed = EventHandler()
+        self.settle_criterion: SettleCriterion | None = None
+        self.settle_statistics = SettleStatistics()
+        self.check_movement = threading.Event()
+        self._frame_triggered = False
         self._axes = {}
         self._connected = False
 
@@ -168,6 +505,27 @@ class Stage(ABC):
     def disconnect(self) -> None:
         pass
 
+    def set_event_executor(self, executor: Executor | None) -> None:
+        """
+        Dispatch movement/frame completion events on ``executor`` instead of
+        the thread detecting the completion. Use a single worker executor to
+        keep the notification order.
+        """
+        self.on_movement_completed.executor = executor
+        self.on_frame_completed.executor = executor
+
+    def reset_event_statistics(self) -> None:
+        self.on_movement_completed.reset_statistics()
+        self.on_frame_completed.reset_statistics()
+
+    def log_event_statistics(self) -> None:
+        for name, event in (
+            ("on_movement_completed", self.on_movement_completed),
+            ("on_frame_completed", self.on_frame_completed),
+        ):
+            for stats in event.statistics:
+                logger.info("[{}] {}".format(name, stats))
+
     @property
     def connected(self) -> bool:
         return self._connected
@@ -201,10 +559,88 @@ class Stage(ABC):
     def _num_channels(self) -> int:
         pass
 
-    @abstractmethod
     def trigger_frame(self) -> None:
-        pass
+        x, y, z, mask = self.movement_queue.pop()
+        if mask & (1 << AxisType.X.value):
+            self._axes[AxisType.X].move(x, False)
+        if mask & (1 << AxisType.Y.value):
+            self._axes[AxisType.Y].move(y, False)
+        if mask & (1 << AxisType.Z.value):
+            self._axes[AxisType.Z].move(z, False)
+        self.commit_move()
+        self._frame_triggered = True
 
-    @abstractmethod
     def commit_move(self) -> None:
-        pass
+        self.check_movement.set()
+
+    class PollThread(threading.Thread):
+        """
+        Detects the completion of the moves committed with ``check_movement``
+        and sends the movement and frame completion events.
+        """
+
+        def __init__(self, stage: "Stage") -> None:
+            super().__init__()
+            self._run = threading.Event()
+            self.stage = stage
+            self._settling: dict[Axis, float] = {}
+
+        def _is_done(self, axis: Axis) -> bool:
+            if axis.status == AxisStatus.STOPPED:
+                return True
+
+            criterion = self.stage.settle_criterion
+            if criterion is None or axis.target is None:
+                return False
+
+            if abs(axis.position - axis.target) <= criterion.tolerance:
+                axis.settle_count += 1
+            else:
+                axis.settle_count = 0
+
+            if axis.settle_count >= criterion.samples:
+                self._settling[axis] = time.monotonic()
+                return True
+            return False
+
+        def _track_settling(self) -> None:
+            """
+            Keep watching axes that completed early until the controller
+            reports them as stopped, to measure the time saved per spot.
+            """
+            for a, settled_at in list(self._settling.items()):
+                # a new move on the axis also ends the measurement (lower bound)
+                if a.moved or a.status == AxisStatus.STOPPED:
+                    self.stage.settle_statistics.record(time.monotonic() - settled_at)
+                    del self._settling[a]
+
+        def run(self) -> None:
+            statuses = {}
+            while not self._run.is_set():
+                self.stage.check_movement.wait()
+                if self._settling:
+                    self._track_settling()
+                for a in self.stage._axes.values():
+                    if a.moved:
+                        if self._is_done(a):
+                            a.reset_moved()
+                            statuses[a] = True
+                        else:
+                            statuses[a] = False
+                if statuses:
+                    if all(statuses.values()):
+                        logger.debug("Waited for: {}".format(statuses.keys()))
+                        self.stage.on_movement_completed()
+                        if self.stage._frame_triggered:
+                            self.stage.on_frame_completed()
+                            self.stage._frame_triggered = False
+                        statuses.clear()
+                        if not self._settling:
+                            self.stage.check_movement.clear()
+                elif not self._settling:
+                    self.stage.check_movement.clear()
+
+        def stop(self) -> None:
+            self._run.set()
+            self.stage.check_movement.set()
+            self.join()
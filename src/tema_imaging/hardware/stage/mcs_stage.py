@@ -15,7 +15,6 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-import threading
 from enum import IntEnum
 
 from cffi import FFI, error
@@ -30,7 +29,6 @@ from tema_imaging.hardware.stage import (
     Stage,
     StageError,
 )
-from tema_imaging.hardware.utils import StatusPoller
 
 
 class SAError(IntEnum):
@@ -156,9 +154,7 @@ class MCSStage(Stage):
         super().__init__()
         self.id = conn_id
         self.handle = None
-        self.status_poller_thread = MCSStage.PollThread(self)
-        self.check_movement = threading.Event()
-        self._frame_triggered = False
+        self.status_poller_thread = self.PollThread(self)
 
     def connect(self) -> None:
         if not self._connected:
@@ -206,50 +202,6 @@ class MCSStage(Stage):
         for ax in self.axes.values():
             ax.stop()
 
-    def trigger_frame(self) -> None:
-        frame = self.movement_queue.pop()
-        for axis, v in frame.items():
-            if v is not None:
-                self.axes[axis].move(v, False)
-        self.commit_move()
-        self._frame_triggered = True
-
-    class PollThread(StatusPoller):
-        def __init__(self, stage: "MCSStage") -> None:
-            super().__init__()
-            self.stage = stage
-
-        def run(self) -> None:
-            statuses = {}
-            while not self._run.is_set():
-                self.stage.check_movement.wait()
-                for a in self.stage._axes.values():
-                    if a.moved:
-                        if a.status == AxisStatus.STOPPED:
-                            a.reset_moved()
-                            statuses[a] = True
-                        else:
-                            statuses[a] = False
-                if statuses:
-                    if all(statuses.values()):
-                        logger.debug("Waited for: {}".format(statuses.keys()))
-                        self.stage.on_movement_completed()
-                        if self.stage._frame_triggered:
-                            self.stage.on_frame_completed()
-                            self.stage._frame_triggered = False
-                        statuses.clear()
-                        self.stage.check_movement.clear()
-                else:
-                    self.stage.check_movement.clear()
-
-        def stop(self) -> None:
-            self._run.set()
-            self.stage.check_movement.set()
-            self.join()
-
-    def commit_move(self) -> None:
-        self.check_movement.set()
-
 
 class MCSAxis(Axis):
     _channel_status_map = {
@@ -267,7 +219,6 @@ class MCSAxis(Axis):
     def __init__(self, name: str, channel: int, stage: "MCSStage") -> None:
         super().__init__(name, channel)
         self._movement_mode = None
-        self._moved = False
         self._stage = stage
 
     def move(self, value: int, auto_commit: bool = True) -> None:
@@ -284,6 +235,8 @@ class MCSAxis(Axis):
                         self._stage.handle, self._channel, position, 0
                     )
                 )
+                self._target = None
+                self.settle_count = 0
                 self._moved = True
                 if auto_commit:
                     self._stage.check_movement.set()
@@ -293,6 +246,8 @@ class MCSAxis(Axis):
                         self._stage.handle, self._channel, position, 0
                     )
                 )
+                self._target = position
+                self.settle_count = 0
                 self._moved = True
                 if auto_commit:
                     self._stage.check_movement.set()
@@ -318,6 +273,7 @@ class MCSAxis(Axis):
                     1,
                 )
             )
+            self._target = None
             self._moved = True
             self._stage.check_movement.set()
 
@@ -395,10 +351,3 @@ class MCSAxis(Axis):
             s = ffi.new("unsigned int *")
             check_return(lib.SA_GetStatus_S(self._stage.handle, self._channel, s))
             return MCSAxis._channel_status_map[SAChannelStatus(s[0])]
-
-    @property
-    def moved(self) -> bool:
-        return self._moved
-
-    def reset_moved(self) -> None:
-        self._moved = False
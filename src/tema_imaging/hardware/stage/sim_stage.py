@@ -0,0 +1,189 @@
+# This file is part of the TEMAimaging project.
+# Copyright (c) 2020, ETH Zurich
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import time
+
+from tema_imaging.hardware.stage import (
+    Axis,
+    AxisMovementMode,
+    AxisStatus,
+    AxisType,
+    Stage,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class SimStage(Stage):
+    """
+    Stage without hardware for offline testing and benchmarks. Axes move with a
+    constant speed followed by a settling phase, and every controller call
+    takes ``call_latency`` seconds like a round trip to the real controller.
+    Completion detection uses the poll thread of the Stage base class.
+    """
+
+    def __init__(
+        self,
+        conn_id: str = "sim",
+        speed: int = 10_000_000,
+        settle_time: float = 0.005,
+        call_latency: float = 0.0001,
+    ) -> None:
+        super().__init__()
+        self.id = conn_id
+        self.speed = speed
+        self.settle_time = settle_time
+        self.call_latency = call_latency
+        self.status_poller_thread = self.PollThread(self)
+
+    def connect(self) -> None:
+        if not self._connected:
+            for ax in AxisType:
+                self._axes[ax] = SimAxis(ax.name, ax.value, self)
+            self._connected = True
+            logger.info("Connected to simulated stage.")
+            self.status_poller_thread.start()
+
+    def disconnect(self) -> None:
+        if self._connected:
+            self.status_poller_thread.stop()
+            self._connected = False
+
+    @property
+    def _num_channels(self) -> int:
+        return len(AxisType)
+
+    def stop_all(self) -> None:
+        self.movement_queue.clear()
+        for ax in self.axes.values():
+            ax.stop()
+
+
+class SimAxis(Axis):
+    def __init__(self, name: str, channel: int, stage: SimStage) -> None:
+        super().__init__(name, channel)
+        self._stage = stage
+        self._movement_mode = AxisMovementMode.CL_ABSOLUTE
+        self._speed = 0
+        self._limit = (-(2**31), 2**31 - 1)
+        self._referenced = False
+
+        self._start_pos = 0
+        self._end_pos = 0
+        self._start_time = 0.0
+        self._travel_time = 0.0
+        self._stop_time = 0.0
+
+    def _call(self) -> None:
+        if self._stage.call_latency:
+            time.sleep(self._stage.call_latency)
+
+    def _position_at(self, now: float) -> int:
+        elapsed = now - self._start_time
+        if elapsed >= self._travel_time:
+            if now >= self._stop_time:
+                return self._end_pos
+            # residual error decaying during the settling phase
+            left = (self._stop_time - now) / self._stage.settle_time
+            return round(self._end_pos + 50 * left)
+        fraction = elapsed / self._travel_time
+        return round(self._start_pos + (self._end_pos - self._start_pos) * fraction)
+
+    @property
+    def stopped_at(self) -> float:
+        """time.monotonic() at which the last move ended."""
+        return self._stop_time
+
+    def move(self, value: int, auto_commit: bool = True) -> None:
+        self._call()
+        now = time.monotonic()
+        current = self._position_at(now)
+        if self._movement_mode == AxisMovementMode.CL_RELATIVE:
+            if value == 0:
+                return
+            end = current + int(value)
+            self._target = None
+        else:
+            end = int(value)
+            self._target = end
+        end = min(max(end, self._limit[0]), self._limit[1])
+
+        speed = self._speed or self._stage.speed
+        self._start_pos = current
+        self._end_pos = end
+        self._start_time = now
+        self._travel_time = abs(end - current) / speed
+        self._stop_time = now + self._travel_time + self._stage.settle_time
+        self.settle_count = 0
+        self._moved = True
+        if auto_commit:
+            self._stage.check_movement.set()
+
+    def stop(self) -> None:
+        self._call()
+        now = time.monotonic()
+        self._start_pos = self._end_pos = self._position_at(now)
+        self._travel_time = 0.0
+        self._stop_time = now
+        self._moved = False
+
+    def find_reference(self) -> None:
+        mode = self._movement_mode
+        self._movement_mode = AxisMovementMode.CL_ABSOLUTE
+        self.move(0)
+        self._movement_mode = mode
+        self._referenced = True
+
+    @property
+    def is_referenced(self) -> bool:
+        return self._referenced
+
+    @property
+    def position(self) -> int:
+        self._call()
+        return self._position_at(time.monotonic())
+
+    @property
+    def speed(self) -> int:
+        return self._speed
+
+    @speed.setter
+    def speed(self, value: float) -> None:
+        self._speed = int(value)
+
+    @property
+    def position_limit(self) -> tuple[int, int]:
+        return self._limit
+
+    @position_limit.setter
+    def position_limit(self, value: tuple[int, int]) -> None:
+        self._limit = value
+
+    @property
+    def movement_mode(self) -> AxisMovementMode:
+        return self._movement_mode
+
+    @movement_mode.setter
+    def movement_mode(self, value: AxisMovementMode) -> None:
+        self._movement_mode = value
+
+    @property
+    def status(self) -> AxisStatus:
+        self._call()
+        if time.monotonic() < self._stop_time:
+            return AxisStatus.MOVING
+        return AxisStatus.STOPPED
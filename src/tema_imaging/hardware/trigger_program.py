@@ -0,0 +1,64 @@
+# This file is part of the TEMAimaging project.
+# Copyright (c) 2020, ETH Zurich
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Spot programs of the Arduino trigger, kept apart from the serial protocol
+so that they can be built without the GUI.
+"""
+
+import numpy as np
+
+# flags of a spot program entry
+SPOT_CLEANING = 0x01
+SPOT_TOF_ONLY = 0x02
+
+PROGRAM_DTYPE = np.dtype([("shots", np.uint16), ("flags", np.uint8)])
+MAX_SPOT_SHOTS = np.iinfo(PROGRAM_DTYPE["shots"]).max
+
+
+def spot_program(
+    spots: int, shots: int, cleaning: bool = False, blank_spots: int = 0
+) -> np.ndarray:
+    """
+    Program of ``blank_spots`` TOF-only spots followed by ``spots`` spots
+    with ``shots`` shots each.
+    """
+    if not 0 <= shots <= MAX_SPOT_SHOTS:
+        raise ValueError(
+            "Spot programs support 0 to {} shots per spot, not {}".format(
+                MAX_SPOT_SHOTS, shots
+            )
+        )
+    program = np.zeros(blank_spots + spots, dtype=PROGRAM_DTYPE)
+    program["flags"][:blank_spots] = SPOT_TOF_ONLY
+    program["shots"][blank_spots:] = shots
+    if cleaning:
+        program["flags"][blank_spots:] = SPOT_CLEANING
+    return program
+
+
+def program_runs(program: np.ndarray) -> list[tuple[int, int, int]]:
+    """Run-length encode a spot program as (count, shots, flags) runs."""
+    if not len(program):
+        return []
+    shots = program["shots"]
+    flags = program["flags"]
+    # first entry of every run
+    starts = np.flatnonzero(
+        np.concatenate(([True], (shots[1:] != shots[:-1]) | (flags[1:] != flags[:-1])))
+    )
+    counts = np.diff(np.append(starts, len(program)))
+    return list(zip(counts.tolist(), shots[starts].tolist(), flags[starts].tolist()))
@@ -0,0 +1,181 @@
+# This file is part of the TEMAimaging project.
+# Copyright (c) 2020, ETH Zurich
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Model of the Arduino trigger firmware, to run the trigger without hardware.
+"""
+
+import logging
+
+from tema_imaging.hardware.arduino_trigger import (
+    PROTOCOL_SPOT_PROGRAM,
+    STEP_COMMAND,
+    ArduTrigger,
+    frame_message,
+)
+from tema_imaging.hardware.sim_device import LoopbackTransport, SimulatedDevice
+from tema_imaging.hardware.trigger_program import SPOT_CLEANING, SPOT_TOF_ONLY
+
+logger = logging.getLogger(__name__)
+
+
+class TriggerDevice(SimulatedDevice):
+    """
+    Trigger firmware state machine, shots are only counted. In real time
+    shots take 1 / frequency each.
+    """
+
+    def __init__(
+        self,
+        protocol_version: int = PROTOCOL_SPOT_PROGRAM,
+        realtime: bool = False,
+        baudrate: int | None = None,
+    ) -> None:
+        super().__init__(realtime, baudrate)
+        self.protocol_version = protocol_version
+
+        self.count = 1
+        self.freq = 1
+        self.first_only = False
+        self.cleaning = False
+        self.cleaning_delay = 0
+
+        # (count, shots, flags) runs as uploaded
+        self.program: list[tuple[int, int, int]] = []
+        self.program_size = 0
+        self.program_index = 0  # spots fired
+        self._run_index = 0
+        self._run_fired = 0
+
+        self.shots = 0
+        self.tof_triggers = 0
+        self.cleaning_shots = 0
+
+    def _receive(self, b: int) -> None:
+        # the step command is handled as soon as it arrives
+        if not self._buffer and b == STEP_COMMAND[0]:
+            self._step()
+        else:
+            super()._receive(b)
+
+    def step_trigger(self) -> None:
+        """Signal the external step input."""
+        self._send("S")
+
+    def _fire(self, count: int, tof: bool) -> None:
+        self.shots += count
+        if tof:
+            self.tof_triggers += 1 if self.first_only else count
+        self._run(count / max(self.freq, 1))
+
+    def _cleaning_shot(self) -> None:
+        self.cleaning_shots += 1
+        self._fire(1, False)
+        self._run(self.cleaning_delay / 1000)
+
+    def _handle_line(self, line: str) -> None:
+        if not line:
+            return
+        cmd, arg = line[0], line[1:]
+
+        if cmd == "F":
+            self.freq = int(arg)
+        elif cmd == "C":
+            self.count = int(arg)
+        elif cmd == "O":
+            self.first_only = arg == "1"
+        elif cmd == "G":
+            if self.cleaning:
+                self._cleaning_shot()
+            self._fire(self.count, True)
+            self._send("D")
+        elif cmd == "I":
+            self._fire(1, False)
+            self._send("I")
+        elif cmd == "T":
+            self.tof_triggers += 1
+            self._send("T")
+        elif cmd == "S":
+            self._busy_until = 0.0
+        elif self.protocol_version < 2:
+            logger.debug("Unknown command: {}".format(line))
+        elif cmd == "V":
+            self._send("V{}".format(self.protocol_version))
+        elif cmd in "KPQ":
+            self._handle_framed(line)
+        else:
+            logger.debug("Unknown command: {}".format(line))
+
+    def _handle_framed(self, line: str) -> None:
+        payload = line.rpartition("*")[0]
+        if not payload or frame_message(payload) != line:
+            self._send("N")
+            return
+
+        cmd, arg = payload[0], payload[1:]
+        if cmd == "K":
+            count, freq, first_only, cleaning, delay = map(int, arg.split(","))
+            self.count = count
+            self.freq = freq
+            self.first_only = bool(first_only)
+            self.cleaning = bool(cleaning)
+            self.cleaning_delay = delay
+        elif self.protocol_version < PROTOCOL_SPOT_PROGRAM:
+            self._send("N")
+            return
+        elif cmd == "P":
+            self.program = []
+            self.program_size = int(arg)
+            self.program_index = 0
+            self._run_index = 0
+            self._run_fired = 0
+        else:
+            for entry in arg.split(","):
+                count, shots, flags = map(int, entry.split(":"))
+                self.program.append((count, shots, flags))
+            if sum(run[0] for run in self.program) > self.program_size:
+                self._send("N")
+                return
+        self._send("K")
+
+    def _step(self) -> None:
+        if self._run_index >= len(self.program):
+            logger.warning("Step without program entry")
+            self._send("D")
+            return
+
+        count, shots, flags = self.program[self._run_index]
+        self.program_index += 1
+        self._run_fired += 1
+        if self._run_fired == count:
+            self._run_index += 1
+            self._run_fired = 0
+        if flags & SPOT_TOF_ONLY:
+            self.tof_triggers += 1
+        else:
+            if flags & SPOT_CLEANING:
+                self._cleaning_shot()
+            self._fire(shots, True)
+        self._send("D")
+
+
+def connect(device: TriggerDevice | None = None) -> tuple[ArduTrigger, TriggerDevice]:
+    """Create a trigger connected to a (new) simulated device."""
+    device = device or TriggerDevice()
+    trigger = ArduTrigger()
+    LoopbackTransport(device, trigger)
+    trigger.detect_protocol()
+    return trigger, device
@@ -0,0 +1,156 @@
+# This file is part of the TEMAimaging project.
+# Copyright (c) 2020, ETH Zurich
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+pySerial URL handlers for simulated devices, ``simtrigger://`` and
+``simlaser://``.
+"""
+
+import queue
+import time
+import urllib.parse
+
+import serial
+
+
+def register() -> None:
+    """Make the handlers of this package available to serial_for_url."""
+    if __name__ not in serial.protocol_handler_packages:
+        serial.protocol_handler_packages.append(__name__)
+
+
+class SimulatedSerial(serial.SerialBase):
+    """
+    Serial port connected to an in-process device model. The device gets
+    the written bytes through ``write`` and puts its output, or None when
+    closed, into its ``output`` queue. Subclasses create the device from the
+    URL query options in ``_create_device``.
+    """
+
+    scheme = ""
+
+    def __init__(self, *args, **kwargs) -> None:
+        self.device = None
+        self._buffer = bytearray()
+        super().__init__(*args, **kwargs)
+
+    def _create_device(self, options: dict[str, str]):
+        raise NotImplementedError
+
+    def open(self) -> None:
+        if self.is_open:
+            raise serial.SerialException("Port is already open.")
+        if self._port is None:
+            raise serial.SerialException(
+                "Port must be configured before it can be used."
+            )
+
+        parts = urllib.parse.urlsplit(self._port)
+        if parts.scheme != self.scheme:
+            raise serial.SerialException(
+                "expected a string in the form {}://[?option=value...]".format(
+                    self.scheme
+                )
+            )
+        options = {k: v[0] for k, v in urllib.parse.parse_qs(parts.query).items()}
+        try:
+            self.device = self._create_device(options)
+        except (KeyError, ValueError) as e:
+            raise serial.SerialException("invalid option: {}".format(e))
+        if options:
+            raise serial.SerialException(
+                "unknown options: {}".format(", ".join(options))
+            )
+        self._buffer.clear()
+        self.is_open = True
+
+    def close(self) -> None:
+        if self.is_open:
+            self.is_open = False
+            self.device.close()
+        super().close()
+
+    def _reconfigure_port(self) -> None:
+        pass
+
+    def _drain(self, timeout: float | None) -> bool:
+        """Move device output to the buffer, False when the device closed."""
+        try:
+            data = self.device.output.get(timeout=timeout)
+            while True:
+                if data is None:
+                    return False
+                self._buffer += data
+                data = self.device.output.get_nowait()
+        except queue.Empty:
+            return True
+
+    @property
+    def in_waiting(self) -> int:
+        if not self.is_open:
+            raise serial.PortNotOpenError()
+        self._drain(0)
+        return len(self._buffer)
+
+    def read(self, size: int = 1) -> bytes:
+        if not self.is_open:
+            raise serial.PortNotOpenError()
+        deadline = None if self._timeout is None else time.monotonic() + self._timeout
+        while len(self._buffer) < size and self.is_open:
+            timeout = None if deadline is None else deadline - time.monotonic()
+            if timeout is not None and timeout <= 0:
+                break
+            if not self._drain(timeout):
+                break
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def cancel_read(self) -> None:
+        self.device.output.put(None)
+
+    def write(self, data: bytes) -> int:
+        if not self.is_open:
+            raise serial.PortNotOpenError()
+        data = serial.to_bytes(data)
+        self.device.write(data)
+        return len(data)
+
+    def reset_input_buffer(self) -> None:
+        self._buffer.clear()
+
+    def reset_output_buffer(self) -> None:
+        pass
+
+    @property
+    def out_waiting(self) -> int:
+        return 0
+
+    @property
+    def cts(self) -> bool:
+        return True
+
+    @property
+    def dsr(self) -> bool:
+        return True
+
+    @property
+    def ri(self) -> bool:
+        return False
+
+    @property
+    def cd(self) -> bool:
+        return True
@@ -0,0 +1,44 @@
+# This file is part of the TEMAimaging project.
+# Copyright (c) 2020, ETH Zurich
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+``simlaser://[?realtime=<0|1>&latency=<s>&jitter=<s>&drop=<p>&status=<code>
+&interlock=<name>&seed=<n>]``: port connected to a simulated Compex laser.
+``realtime`` (default 1) makes commands and the serial line take as long as
+on the hardware, ``drop`` is the probability that a response is lost and
+``status`` the status code reported with the opmode.
+"""
+
+from tema_imaging.hardware.laser_compex import StatusCodes
+from tema_imaging.hardware.laser_sim import LaserDevice
+from tema_imaging.hardware.urlhandler import SimulatedSerial
+
+
+class Serial(SimulatedSerial):
+    scheme = "simlaser"
+
+    def _create_device(self, options: dict[str, str]) -> LaserDevice:
+        seed = options.pop("seed", None)
+        return LaserDevice(
+            options.pop("realtime", "1") == "1",
+            self._baudrate,
+            float(options.pop("latency", 0.01)),
+            float(options.pop("jitter", 0.0)),
+            float(options.pop("drop", 0.0)),
+            StatusCodes(int(options.pop("status", 0))),
+            options.pop("interlock", "NONE"),
+            None if seed is None else int(seed),
+        )
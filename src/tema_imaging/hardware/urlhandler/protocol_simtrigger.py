@@ -0,0 +1,36 @@
+# This file is part of the TEMAimaging project.
+# Copyright (c) 2020, ETH Zurich
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+``simtrigger://[?protocol=<version>&realtime=<0|1>]``: port connected to a
+simulated Arduino trigger. ``realtime`` (default 1) makes shots and the
+serial line take as long as on the hardware.
+"""
+
+from tema_imaging.hardware.arduino_trigger import PROTOCOL_SPOT_PROGRAM
+from tema_imaging.hardware.trigger_sim import TriggerDevice
+from tema_imaging.hardware.urlhandler import SimulatedSerial
+
+
+class Serial(SimulatedSerial):
+    scheme = "simtrigger"
+
+    def _create_device(self, options: dict[str, str]) -> TriggerDevice:
+        return TriggerDevice(
+            int(options.pop("protocol", PROTOCOL_SPOT_PROGRAM)),
+            options.pop("realtime", "1") == "1",
+            self._baudrate,
+        )
@@ -1,13 +1,64 @@
-from threading import Event, Thread
+import logging
+import time
+from threading import Event, Lock, Thread, Timer
 
 import wx
 from pubsub import pub
 
 from tema_imaging.core.settings import Settings
-from tema_imaging.hardware.laser_compex import CompexLaserProtocol
+from tema_imaging.core.telemetry import StagePosition, laser_telemetry, stage_positions
+from tema_imaging.hardware.laser_compex import (
+    CompexException,
+    CompexLaserProtocol,
+    OpMode,
+)
 from tema_imaging.hardware.shutter import Shutter
 from tema_imaging.hardware.stage import AxisType, Stage
 
+logger = logging.getLogger(__name__)
+
+
+class GuiNotifier:
+    """
+    Sends pubsub messages on the GUI thread, at most one per ``interval``
+    (seconds) and topic. Messages arriving faster are coalesced into the
+    latest one, which is sent when the interval is over.
+    """
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.enabled = True
+        self._lock = Lock()
+        self._last_sent: dict[str, float] = {}
+        self._pending: dict[str, dict] = {}
+
+    def send(self, topic: str, **kwargs) -> None:
+        if not self.enabled:
+            return
+
+        with self._lock:
+            if topic in self._pending:
+                self._pending[topic] = kwargs
+                return
+
+            now = time.monotonic()
+            wait = self._last_sent.get(topic, -self.interval) + self.interval - now
+            if wait > 0:
+                self._pending[topic] = kwargs
+                timer = Timer(wait, self._send_pending, (topic,))
+                timer.daemon = True
+                timer.start()
+                return
+            self._last_sent[topic] = now
+        wx.CallAfter(pub.sendMessage, topic, **kwargs)
+
+    def _send_pending(self, topic: str) -> None:
+        with self._lock:
+            kwargs = self._pending.pop(topic)
+            self._last_sent[topic] = time.monotonic()
+        if self.enabled:
+            wx.CallAfter(pub.sendMessage, topic, **kwargs)
+
 
 class StatusPoller(Thread):
     def __init__(self) -> None:
@@ -23,18 +74,92 @@ class StatusPoller(Thread):
 
 
 class LaserStatusPoller(StatusPoller):
+    """
+    Polls opmode, HV and energy, every ``gas`` interval also pressure and
+    tube temperature, in one batch with telemetry priority and records them
+    in the telemetry history. Polls fast around ON/OFF transitions, slower
+    while the laser is on and slowest while it is idle.
+    """
+
+    _transitional = (OpMode.OFF_WAIT, OpMode.SKIP, OpMode.ENERGY_CAL)
+
     def __init__(self, laser: CompexLaserProtocol) -> None:
         super().__init__()
         self._laser = laser
+        self._wake = Event()
+        self._fast_until = 0.0
+        self._opmode: OpMode | None = None
+        self._next_gas_poll = 0.0
+
+    def on_opmode_command(self) -> None:
+        self._speed_up()
+        self._wake.set()
+
+    def _speed_up(self) -> None:
+        self._fast_until = time.monotonic() + Settings.get(
+            "laser.poll_interval.fast_duration"
+        )
+
+    def _interval(self) -> float:
+        if time.monotonic() < self._fast_until or self._opmode in self._transitional:
+            return Settings.get("laser.poll_interval.fast")
+        if self._opmode == OpMode.ON:
+            return Settings.get("laser.poll_interval.on")
+        return Settings.get("laser.poll_interval.idle")
 
     def run(self) -> None:
         self._run.clear()
-        while not self._run.wait(0.7):
-            wx.CallAfter(
-                pub.sendMessage, "laser.status_changed", status=self._laser.opmode
+        self._laser.on_opmode_command += self.on_opmode_command
+        failures = 0
+        try:
+            while not self._run.is_set():
+                try:
+                    self._poll()
+                    failures = 0
+                except (CompexException, ValueError, IndexError) as e:
+                    # timeouts and malformed responses, keep polling
+                    failures += 1
+                    logger.warning("Laser telemetry poll failed: {}".format(e))
+                # back off while the polls fail
+                self._wake.wait(self._interval() * 2 ** min(failures, 3))
+                self._wake.clear()
+        finally:
+            self._laser.on_opmode_command -= self.on_opmode_command
+            for priority, wait in self._laser.queue_wait.items():
+                logger.info(
+                    "laser queue wait ({}): {}".format(priority.name.lower(), wait)
+                )
+            logger.info(
+                "laser round trip: {}, {} timeouts".format(
+                    self._laser.round_trip, self._laser.timeouts
+                )
+            )
+
+    def _poll(self) -> None:
+        gas = time.monotonic() >= self._next_gas_poll
+        sample = self._laser.poll_telemetry(gas)
+        if gas:
+            self._next_gas_poll = sample.monotonic + Settings.get(
+                "laser.poll_interval.gas"
             )
-            wx.CallAfter(pub.sendMessage, "laser.hv_changed", hv=self._laser.hv)
-            wx.CallAfter(pub.sendMessage, "laser.egy_changed", egy=self._laser.egy)
+        laser_telemetry.append(sample)
+
+        if sample.status[0] != self._opmode:
+            if self._opmode is not None:
+                self._speed_up()
+            self._opmode = sample.status[0]
+        wx.CallAfter(self._publish, sample.status, sample.hv, sample.egy)
+
+    @staticmethod
+    def _publish(status, hv: float, egy: float) -> None:
+        pub.sendMessage("laser.status_changed", status=status)
+        pub.sendMessage("laser.hv_changed", hv=hv)
+        pub.sendMessage("laser.egy_changed", egy=egy)
+
+    def stop(self) -> None:
+        self._run.set()
+        self._wake.set()
+        self.join()
 
 
 class ShutterStatusPoller(StatusPoller):
@@ -58,9 +183,18 @@ class StagePositionPoller(StatusPoller):
     def run(self) -> None:
         self._run.clear()
         while not self._run.wait(Settings.get("stage.position_poll_rate")):
+            start = time.monotonic_ns()
             pos = {
                 AxisType.X: self._stage.axes[AxisType.X].position,
                 AxisType.Y: self._stage.axes[AxisType.Y].position,
                 AxisType.Z: self._stage.axes[AxisType.Z].position,
             }
+            stage_positions.append(
+                StagePosition(
+                    (start + time.monotonic_ns()) // 2,
+                    pos[AxisType.X],
+                    pos[AxisType.Y],
+                    pos[AxisType.Z],
+                )
+            )
             wx.CallAfter(pub.sendMessage, "stage.position_changed", position=pos)
@@ -24,6 +24,9 @@ from tema_imaging.core.utils import get_project_root
 
 if TYPE_CHECKING:
     from tema_imaging.core.measurement import Measurement
+    from tema_imaging.core.utils import LastValue
+    from tema_imaging.hardware.arduino_trigger import ArduTrigger
+    from tema_imaging.hardware.laser_compex import LaserSample
 
 
 class Spot:
@@ -35,6 +38,8 @@ class Spot:
 
 class Scan(abc.ABC):
     _meas_log_dir = Path(get_project_root() / "logs")
+    # latest laser telemetry, logged with every spot if set
+    laser_samples: "LastValue[LaserSample] | None" = None
 
     def __init__(self):
         self._meas_log_path: Path | None = None
@@ -51,7 +56,8 @@ class Scan(abc.ABC):
             self._meas_log_dir
             / f"measurement_{datetime.datetime.now().isoformat()}.txt"
         )
-        self._meas_log_path.touch()
+        with self._meas_log_path.open("w") as f:
+            f.write("# time,x,y,z,egy,hv,laser_age\n")
 
     @abc.abstractmethod
     def _init_scan(self, measurement: "Measurement") -> None:
@@ -62,9 +68,27 @@ class Scan(abc.ABC):
             return
 
         if spot.Z is None:
-            spot_str = f"{spot.X},{spot.Y}"
+            spot_str = f"{spot.X},{spot.Y},"
         else:
             spot_str = f"{spot.X},{spot.Y},{spot.Z}"
 
+        # energy and HV of the last telemetry poll and its age in s
+        laser_str = ",,"
+        sample = None if self.laser_samples is None else self.laser_samples.get()
+        if sample is not None:
+            age = time.monotonic() - sample.monotonic
+            laser_str = f"{sample.egy},{sample.hv},{age:.3f}"
+
+        timestamp = time.time() - self._start_timestamp
+        with self._meas_log_path.open("a") as f:
+            f.write(f"{timestamp},{spot_str},{laser_str}\n")
+
+    def log_trigger_statistics(self, trigger: "ArduTrigger") -> None:
+        """Append the trigger latencies of the scan as comment lines."""
+        if self._meas_log_path is None:
+            return
+
         with self._meas_log_path.open("a") as f:
-            f.write(f"{time.time() - self._start_timestamp},{spot_str}\n")
+            f.write(f"# trigger D wake-up latency: {trigger.wakeup_latency}\n")
+            f.write(f"# trigger command to D latency: {trigger.done_latency}\n")
+            f.write(f"# trigger step latency: {trigger.step_latency}\n")
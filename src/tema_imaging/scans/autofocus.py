@@ -0,0 +1,144 @@
+# This file is part of the TEMAimaging project.
+# Copyright (c) 2020, ETH Zurich
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from threading import Event
+
+from tema_imaging.core.autofocus import Autofocus
+from tema_imaging.core.conn_mgr import conn_mgr
+from tema_imaging.core.focus_map import FocusMap
+from tema_imaging.core.measurement import Measurement
+from tema_imaging.core.scanner_registry import register_scan
+from tema_imaging.hardware.stage import AxisMovementMode, AxisType
+from tema_imaging.scans import Scan, Spot
+
+
+@register_scan
+class AutofocusStep(Scan):
+    """
+    Focuses with the camera at one position without shooting and adds the
+    position to the focus map, which the following steps apply.
+    """
+
+    parameter_map = {
+        "x_start": ("X (Start)", 0.0, 1000),
+        "y_start": ("Y (Start)", 0.0, 1000),
+        "z_start": ("Z (Start)", 0.0, 1000),
+        "focus_span": ("Focus span", 200.0, 1000),
+        "focus_tolerance": ("Focus tolerance", 2.0, 1000),
+    }
+
+    display_name = "Autofocus"
+
+    def __init__(
+        self,
+        spot_size,
+        shots_per_spot=1,
+        frequency=1,
+        cleaning=False,
+        cleaning_delay=0,
+        x_start=None,
+        y_start=None,
+        z_start=None,
+        focus_span=200000,
+        focus_tolerance=2000,
+    ):
+        self.spot_size = spot_size
+        self.x_start = x_start
+        self.y_start = y_start
+        self.z_start = z_start
+        self.focus_span = focus_span
+        self.focus_tolerance = focus_tolerance
+
+        self.coord_list = [Spot(x_start, y_start, z_start)]
+        self._focused = False
+        self._focus_map: FocusMap | None = None
+
+        self.movement_completed_event = Event()
+
+    @classmethod
+    def from_params(
+        cls, spot_size, shot_count, frequency, cleaning, cleaning_delay, params
+    ):
+        return cls(
+            spot_size,
+            shot_count,
+            frequency,
+            cleaning,
+            cleaning_delay,
+            params["x_start"].value,
+            params["y_start"].value,
+            params["z_start"].value,
+            params["focus_span"].value,
+            params["focus_tolerance"].value,
+        )
+
+    @property
+    def boundary_size(self) -> tuple[float, float]:
+        return self.spot_size, self.spot_size
+
+    def _init_scan(self, measurement: Measurement) -> None:
+        conn_mgr.stage.on_movement_completed += self.on_movement_completed
+        conn_mgr.stage.axes[AxisType.X].movement_mode = AxisMovementMode.CL_ABSOLUTE
+        conn_mgr.stage.axes[AxisType.Y].movement_mode = AxisMovementMode.CL_ABSOLUTE
+
+        # a fitted map predicts the focus better than the entered Z
+        if measurement.active_focus_map is not None:
+            self.coord_list[0].Z = round(
+                float(measurement.active_focus_map.evaluate(self.x_start, self.y_start))
+            )
+        if measurement.focus_map is None:
+            measurement.focus_map = FocusMap()
+        self._focus_map = measurement.focus_map
+
+    def next_move(self) -> bool:
+        if self._focused:
+            return False
+        self._focused = True
+
+        spot = self.coord_list[0]
+        x_axis = conn_mgr.stage.axes[AxisType.X]
+        y_axis = conn_mgr.stage.axes[AxisType.Y]
+        # no completion is reported without a move
+        if (x_axis.position, y_axis.position) != (spot.X, spot.Y):
+            x_axis.move(spot.X, False)
+            y_axis.move(spot.Y, False)
+            conn_mgr.stage.commit_move()
+            self.movement_completed_event.wait()
+            self.movement_completed_event.clear()
+        # the autofocus waits for its Z moves itself
+        conn_mgr.stage.on_movement_completed -= self.on_movement_completed
+
+        result = Autofocus(
+            conn_mgr.stage,
+            conn_mgr.camera_frames,
+            self.focus_span,
+            self.focus_tolerance,
+        ).run(spot.Z)
+
+        x = x_axis.position
+        y = y_axis.position
+        self._focus_map.add_point(x, y, result.z)
+        self.log_spot(Spot(x, y, result.z))
+        return False
+
+    def next_shot(self) -> None:
+        pass
+
+    def done(self) -> None:
+        conn_mgr.stage.on_movement_completed -= self.on_movement_completed
+
+    def on_movement_completed(self) -> None:
+        self.movement_completed_event.set()
@@ -125,9 +125,9 @@ class ContinuousLineScan(Scan):
 
         conn_mgr.stage.commit_move()
 
-        conn_mgr.trigger.set_count(self.spot_count * self.shots_per_spot)
-        conn_mgr.trigger.set_freq(self.frequency)
-        conn_mgr.trigger.set_first_only(False)
+        conn_mgr.trigger.configure(
+            self.spot_count * self.shots_per_spot, self.frequency, False
+        )
 
         if moved:
             self.movement_completed_event.wait()
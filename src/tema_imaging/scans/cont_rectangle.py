@@ -123,9 +123,7 @@ class ContinuousRectangleScan(Scan):
 
         conn_mgr.stage.commit_move()
 
-        conn_mgr.trigger.set_count(self.shot_count)
-        conn_mgr.trigger.set_freq(self.frequency)
-        conn_mgr.trigger.set_first_only(False)
+        conn_mgr.trigger.configure(self.shot_count, self.frequency, False)
 
         if moved:
             self.movement_completed_event.wait()
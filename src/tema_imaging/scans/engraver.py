@@ -18,12 +18,20 @@ import logging
 import time
 from threading import Event
 
+import numpy as np
 from PIL import Image, ImageOps
 
 from tema_imaging.core.conn_mgr import conn_mgr
+from tema_imaging.core.focus_map import FocusMap
 from tema_imaging.core.measurement import Measurement
 from tema_imaging.core.scanner_registry import register_scan
-from tema_imaging.hardware.stage import AxisType, AxisMovementMode
+from tema_imaging.hardware.trigger_program import spot_program
+from tema_imaging.hardware.stage import (
+    AxisMovementMode,
+    AxisType,
+    MovementQueue,
+    SettleCriterion,
+)
 from tema_imaging.scans import Scan, Spot
 
 logger = logging.getLogger(__name__)
@@ -39,6 +47,8 @@ class Engraver(Scan):
         "z_start": ("Z (Start)", 0.0, 1000),
         "image_path": ("Image path", "", None),
         "blank_spots": ("# of blank spots", 0, None),
+        "settle_tolerance": ("Settle tolerance", 0.0, 1000),
+        "settle_samples": ("Settle samples", 3, None),
     }
 
     display_name = "Engraver"
@@ -57,6 +67,8 @@ class Engraver(Scan):
         blank_spots=0,
         x_size=0,
         y_size=0,
+        settle_tolerance=0,
+        settle_samples=3,
     ):
         self.x_size = x_size
         self.y_size = y_size
@@ -73,6 +85,12 @@ class Engraver(Scan):
         self.blank_spots = blank_spots
         self.blank_delay = 0
 
+        self.settle_criterion = (
+            SettleCriterion(round(settle_tolerance), settle_samples)
+            if settle_tolerance
+            else None
+        )
+
         self.coord_list: list[Spot] = []
 
         flipped_image = ImageOps.flip(image)
@@ -94,15 +112,19 @@ class Engraver(Scan):
                 x_coord = round(x_start + (x_pixel * spot_size))
                 y_coord = round(y_start + (y_pixel * spot_size))
                 self.coord_list.append(Spot(x_coord, y_coord))
-                conn_mgr.stage.movement_queue.put(
-                    Spot(x_coord, y_coord)
-                )  # TODO: move this to init_scan since it modifies hardware state
                 black_pixel += 1
 
             i += 1
 
         logger.info("Image black pixel count: {}".format(black_pixel))
 
+        self.plan = np.array(
+            [(spot.X, spot.Y) for spot in self.coord_list], dtype=np.int32
+        ).reshape(-1, 2)
+        self._frames = self.plan
+        self._frame_masks: int | np.ndarray = MovementQueue.AXES_XY
+        self._queued = 0
+
         self.frame_event = Event()
         self.movement_completed_event = Event()
 
@@ -130,6 +152,8 @@ class Engraver(Scan):
             params["blank_spots"].value,
             params["x_size"].value,
             params["y_size"].value,
+            params["settle_tolerance"].value,
+            params["settle_samples"].value,
         )
 
     @property
@@ -155,14 +179,33 @@ class Engraver(Scan):
         conn_mgr.stage.axes[AxisType.Y].movement_mode = AxisMovementMode.CL_ABSOLUTE
         conn_mgr.stage.axes[AxisType.Z].movement_mode = AxisMovementMode.CL_ABSOLUTE
 
+        conn_mgr.stage.settle_criterion = self.settle_criterion
+        conn_mgr.stage.settle_statistics.reset()
+
+        if measurement.active_focus_map is not None:
+            self._apply_focus_map(measurement.active_focus_map)
+
         conn_mgr.stage.on_frame_completed += self.on_frame_completed
+        self._feed_movement_queue()
 
         if self.z_start:
             conn_mgr.stage.axes[AxisType.Z].move(self.z_start)
 
-        conn_mgr.trigger.set_count(self.shots_per_spot)
-        conn_mgr.trigger.set_freq(self.frequency)
-        conn_mgr.trigger.set_first_only(True)
+        conn_mgr.trigger.configure(
+            self.shots_per_spot,
+            self.frequency,
+            True,
+            self._cleaning,
+            self._cleaning_delay,
+        )
+        conn_mgr.trigger.upload_program(
+            spot_program(
+                len(self.coord_list),
+                self.shots_per_spot,
+                self._cleaning,
+                self.blank_spots,
+            )
+        )
 
         if self.z_start:
             self.movement_completed_event.wait()
@@ -176,10 +219,11 @@ class Engraver(Scan):
 
         if self.blank_spots:
             time.sleep(self.blank_delay / 1000)
-            conn_mgr.trigger.single_tof()
+            conn_mgr.trigger.blank_spot()
             self.blank_spots -= 1
             return True
 
+        self._feed_movement_queue()
         conn_mgr.stage.trigger_frame()
 
         self.frame_event.wait()
@@ -191,17 +235,41 @@ class Engraver(Scan):
             conn_mgr.stage.axes[AxisType.Z].position,
         )
         self.log_spot(curr_pos)
-        conn_mgr.trigger.go_and_wait(self._cleaning, self._cleaning_delay)
+        conn_mgr.trigger.spot_and_wait(self._cleaning, self._cleaning_delay)
 
         self._curr_step += 1
         return True
 
+    def _feed_movement_queue(self) -> None:
+        masks = self._frame_masks
+        self._queued += conn_mgr.stage.movement_queue.extend(
+            self._frames[self._queued :],
+            masks if isinstance(masks, int) else masks[self._queued :],
+        )
+
+    def _apply_focus_map(self, focus_map: FocusMap) -> None:
+        z, z_moves = focus_map.apply(self.plan)
+        self._frames = np.column_stack((self.plan, z))
+        self._frame_masks = np.where(
+            z_moves, MovementQueue.AXES_ALL, MovementQueue.AXES_XY
+        ).astype(np.uint8)
+        self.z_start = None  # the first frame moves Z
+
     def next_shot(self) -> None:
         pass
 
     def done(self) -> None:
         conn_mgr.stage.on_frame_completed -= self.on_frame_completed
 
+        if self.settle_criterion is not None:
+            logger.info(
+                "settle criterion ({}): {}".format(
+                    self.settle_criterion, conn_mgr.stage.settle_statistics
+                )
+            )
+        conn_mgr.stage.settle_criterion = None
+        conn_mgr.trigger.clear_program()
+
     def on_frame_completed(self) -> None:
         self.frame_event.set()
 
@@ -14,16 +14,23 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+import logging
 import math
 import time
 from threading import Event
 
+import numpy as np
+
 from tema_imaging.core.conn_mgr import conn_mgr
+from tema_imaging.core.focus_map import FocusMap
 from tema_imaging.core.measurement import Measurement
 from tema_imaging.core.scanner_registry import register_scan
-from tema_imaging.hardware.stage import AxisMovementMode, AxisType
+from tema_imaging.hardware.trigger_program import spot_program
+from tema_imaging.hardware.stage import AxisMovementMode, AxisType, SettleCriterion
 from tema_imaging.scans import Scan, Spot
 
+logger = logging.getLogger(__name__)
+
 
 @register_scan
 class LineScan(Scan):
@@ -35,6 +42,8 @@ class LineScan(Scan):
         "z_start": ("Z (Start)", 0.0, 1000),
         "z_end": ("Z (End)", 0.0, 1000),
         "blank_spots": ("# of blank spots", 0, None),
+        "settle_tolerance": ("Settle tolerance", 0.0, 1000),
+        "settle_samples": ("Settle samples", 3, None),
     }
 
     display_name = "Line Scan"
@@ -53,6 +62,8 @@ class LineScan(Scan):
         z_start=None,
         z_end=None,
         blank_spots=0,
+        settle_tolerance=0,
+        settle_samples=3,
     ):
         self.spot_size = spot_size
         self.spot_count = spot_count
@@ -70,6 +81,12 @@ class LineScan(Scan):
 
         self._curr_step = 0
 
+        self.settle_criterion = (
+            SettleCriterion(round(settle_tolerance), settle_samples)
+            if settle_tolerance
+            else None
+        )
+
         self.coord_list: list[Spot] = []
 
         if spot_count <= 1:
@@ -105,6 +122,8 @@ class LineScan(Scan):
             params["z_start"].value,
             params["z_end"].value,
             params["blank_spots"].value,
+            params["settle_tolerance"].value,
+            params["settle_samples"].value,
         )
 
     @property
@@ -126,21 +145,39 @@ class LineScan(Scan):
         conn_mgr.stage.on_movement_completed += self.on_movement_completed
         self.blank_delay = measurement.blank_delay
 
-        conn_mgr.trigger.set_count(self.shots_per_spot)
-        conn_mgr.trigger.set_freq(self.frequency)
-        conn_mgr.trigger.set_first_only(True)
+        conn_mgr.trigger.configure(
+            self.shots_per_spot,
+            self.frequency,
+            True,
+            self._cleaning,
+            self._cleaning_delay,
+        )
+        conn_mgr.trigger.upload_program(
+            spot_program(
+                len(self.coord_list),
+                self.shots_per_spot,
+                self._cleaning,
+                self.blank_spots,
+            )
+        )
 
         conn_mgr.stage.axes[AxisType.X].movement_mode = AxisMovementMode.CL_ABSOLUTE
         conn_mgr.stage.axes[AxisType.Y].movement_mode = AxisMovementMode.CL_ABSOLUTE
         conn_mgr.stage.axes[AxisType.Z].movement_mode = AxisMovementMode.CL_ABSOLUTE
 
+        if measurement.active_focus_map is not None:
+            self._apply_focus_map(measurement.active_focus_map)
+
+        conn_mgr.stage.settle_criterion = self.settle_criterion
+        conn_mgr.stage.settle_statistics.reset()
+
     def next_move(self) -> bool:
         if self._curr_step >= len(self.coord_list):
             return False
 
         if self.blank_spots:
             time.sleep(self.blank_delay / 1000)
-            conn_mgr.trigger.single_tof()
+            conn_mgr.trigger.blank_spot()
             self.blank_spots -= 1
             return True
 
@@ -181,16 +218,32 @@ class LineScan(Scan):
             conn_mgr.stage.axes[AxisType.Z].position,
         )
         self.log_spot(curr_pos)
-        conn_mgr.trigger.go_and_wait(self._cleaning, self._cleaning_delay)
+        conn_mgr.trigger.spot_and_wait(self._cleaning, self._cleaning_delay)
 
         self._curr_step += 1
         return True
 
+    def _apply_focus_map(self, focus_map: FocusMap) -> None:
+        xy = np.array([(spot.X, spot.Y) for spot in self.coord_list], dtype=np.int32)
+        # spots without a Z move keep the previous Z, so next_move skips them
+        z, _ = focus_map.apply(xy.reshape(-1, 2))
+        for spot, spot_z in zip(self.coord_list, z.tolist()):
+            spot.Z = spot_z
+
     def next_shot(self) -> None:
         pass
 
     def done(self) -> None:
         conn_mgr.stage.on_movement_completed -= self.on_movement_completed
 
+        if self.settle_criterion is not None:
+            logger.info(
+                "settle criterion ({}): {}".format(
+                    self.settle_criterion, conn_mgr.stage.settle_statistics
+                )
+            )
+        conn_mgr.stage.settle_criterion = None
+        conn_mgr.trigger.clear_program()
+
     def on_movement_completed(self) -> None:
         self.movement_completed_event.set()
@@ -0,0 +1,116 @@
+# This file is part of the TEMAimaging project.
+# Copyright (c) 2020, ETH Zurich
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import pickle
+
+import numpy as np
+import pytest
+
+from tema_imaging.core.focus_map import FocusMap, FocusMapMethod
+
+# stage coordinates around the middle of the travel range, in nm
+CORNERS = [(1e7, 2e7), (1.5e7, 2e7), (1e7, 2.5e7), (1.5e7, 2.5e7)]
+
+
+def _plane(x, y):
+    return 3e5 + 0.002 * (x - 1e7) - 0.001 * (y - 2e7)
+
+
+def _saddle(x, y):
+    return _plane(x, y) + 4e-9 * (x - 1.2e7) * (y - 2.2e7)
+
+
+def _focus_map(method, surface, points):
+    focus_map = FocusMap(method)
+    for x, y in points:
+        focus_map.add_point(x, y, surface(x, y))
+    return focus_map
+
+
+def _grid(n=7):
+    x, y = np.meshgrid(np.linspace(1e7, 1.5e7, n), np.linspace(2e7, 2.5e7, n))
+    return x.ravel(), y.ravel()
+
+
+@pytest.mark.parametrize(
+    "method", [FocusMapMethod.PLANE, FocusMapMethod.BILINEAR, FocusMapMethod.THIN_PLATE]
+)
+def test_fit_plane(method):
+    focus_map = _focus_map(method, _plane, CORNERS + [(1.2e7, 2.1e7)])
+    x, y = _grid()
+    np.testing.assert_allclose(focus_map.evaluate(x, y), _plane(x, y), atol=1e-3)
+
+
+def test_fit_bilinear():
+    focus_map = _focus_map(FocusMapMethod.BILINEAR, _saddle, CORNERS)
+    x, y = _grid()
+    np.testing.assert_allclose(focus_map.evaluate(x, y), _saddle(x, y), atol=1e-3)
+
+    # a plane only fits the saddle in the least squares sense
+    focus_map.set_method(FocusMapMethod.PLANE)
+    assert np.abs(focus_map.evaluate(x, y) - _saddle(x, y)).max() > 100
+
+
+def test_fit_thin_plate_interpolates():
+    points = CORNERS + [(1.25e7, 2.25e7), (1.1e7, 2.4e7)]
+    focus_map = _focus_map(FocusMapMethod.THIN_PLATE, _saddle, points)
+    x, y = np.array(points).T
+    np.testing.assert_allclose(focus_map.evaluate(x, y), _saddle(x, y), atol=1e-3)
+
+
+def test_ready():
+    focus_map = _focus_map(FocusMapMethod.BILINEAR, _plane, CORNERS[:3])
+    assert not focus_map.ready
+    with pytest.raises(ValueError):
+        focus_map.evaluate(np.zeros(1), np.zeros(1))
+
+    focus_map.add_point(*CORNERS[3], _plane(*CORNERS[3]))
+    assert focus_map.ready
+    focus_map.clear()
+    assert not focus_map.ready
+    assert len(focus_map) == 0
+
+
+def test_evaluate_shapes():
+    focus_map = _focus_map(FocusMapMethod.THIN_PLATE, _saddle, CORNERS)
+    assert focus_map.evaluate(np.float64(1e7), np.float64(2e7)).shape == ()
+    x, y = _grid(3)
+    assert focus_map.evaluate(x.reshape(3, 3), y.reshape(3, 3)).shape == (3, 3)
+
+
+def test_pickle():
+    focus_map = _focus_map(FocusMapMethod.THIN_PLATE, _saddle, CORNERS)
+    restored = pickle.loads(pickle.dumps(focus_map))
+    assert restored.method == FocusMapMethod.THIN_PLATE
+    x, y = _grid(3)
+    np.testing.assert_allclose(restored.evaluate(x, y), focus_map.evaluate(x, y))
+
+
+def test_apply_deadband():
+    # z rises by 400 nm per spot
+    focus_map = FocusMap(FocusMapMethod.PLANE, z_tolerance=1000)
+    for x, y in CORNERS:
+        focus_map.add_point(x, y, 0.04 * (x - 1e7))
+    xy = np.column_stack((1e7 + np.arange(8) * 1e4, np.full(8, 2e7)))
+
+    z, moves = focus_map.apply(xy)
+    assert z.dtype == np.int32
+    # moves once the deviation from the last Z moved to exceeds the tolerance
+    assert moves.tolist() == [True, False, False, True, False, False, True, False]
+    assert z.tolist() == [0, 0, 0, 1200, 1200, 1200, 2400, 2400]
+
+    z, moves = focus_map.apply(np.empty((0, 2)))
+    assert len(z) == len(moves) == 0
@@ -0,0 +1,125 @@
+# This file is part of the TEMAimaging project.
+# Copyright (c) 2020, ETH Zurich
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+import pytest
+
+from tema_imaging.core.frame_index import FrameIndex
+from tema_imaging.core.telemetry import StagePosition
+
+MS = 1_000_000  # ns
+
+
+@pytest.fixture
+def index():
+    # a line scan along X, one frame every 10 ms and 1 µm
+    index = FrameIndex(capacity=4)
+    for i in range(20):
+        index.append(i + 1, i * 10 * MS, StagePosition(i * 10 * MS, i * 1000, 500, 0))
+    return index
+
+
+def test_between(index):
+    assert len(index) == 20
+    assert index.between(15 * MS, 45 * MS).tolist() == [3, 4, 5]
+    assert index.between(40 * MS, 40 * MS).tolist() == [5]
+    assert index.between(500 * MS, 600 * MS).tolist() == []
+
+
+def test_in_region_by_x(index):
+    # fewer frames in the X range than in the time range
+    assert index.in_region(2500, 0, 4000, 1000).tolist() == [4, 5]
+    assert index.in_region(4000, 1000, 2500, 0).tolist() == [4, 5]
+    assert index.in_region(2500, 0, 4000, 1000, end_ns=30 * MS).tolist() == [4]
+    assert index.in_region(2500, 600, 4000, 1000).tolist() == []
+
+
+def test_in_region_by_time(index):
+    # fewer frames in the time range than in the X range
+    region = (0, 0, 19000, 1000)
+    assert index.in_region(*region, 100 * MS, 120 * MS).tolist() == [11, 12, 13]
+    assert index.in_region(0, 0, 10500, 1000, 100 * MS, 120 * MS).tolist() == [11]
+
+
+def test_in_region_after_append(index):
+    assert index.near(-1000, 500, 100).tolist() == []
+    index.append(21, 200 * MS, StagePosition(200 * MS, -1000, 500, 0))
+    assert index.near(-1000, 500, 100).tolist() == [21]
+
+
+def test_nan_positions():
+    index = FrameIndex()
+    index.append(1, 0, None)
+    index.append(2, 10 * MS, StagePosition(10 * MS, 0, 0, 0))
+    index.append(3, 20 * MS, None)
+
+    region = (-np.inf, -np.inf, np.inf, np.inf)
+    assert index.in_region(*region).tolist() == [2]
+    assert index.in_region(*region, 0, 20 * MS).tolist() == [2]
+    assert index.between(0, 20 * MS).tolist() == [1, 2, 3]
+
+    _, x, y, z = index.position(3)
+    assert np.isnan([x, y, z]).all()
+    assert index.position(2) == (10 * MS, 0, 0, 0)
+    assert index.position(4) is None
+
+
+def _recorder_module():
+    # the trigger events come from the wx-based trigger module
+    pytest.importorskip("wx")
+    from tema_imaging.core import recorder
+
+    return recorder
+
+
+def test_load_raw_recording(tmp_path):
+    recorder = _recorder_module()
+    frames = recorder.FrameRecorder(tmp_path, "raw")
+    for i in range(5):
+        position = None if i == 2 else StagePosition(0, i * 1000, 2000, 3000)
+        frames.submit(np.full((4, 6), i, np.uint8), (i + 1) * MS, position)
+    frames.stop()
+    assert frames.recorded == 5
+
+    data = np.fromfile(tmp_path / "frames.raw", np.uint8).reshape(5, 4, 6)
+    assert data[:, 0, 0].tolist() == [0, 1, 2, 3, 4]
+
+    index = FrameIndex.load(tmp_path)
+    assert len(index) == 5
+    assert index.between(2 * MS, 4 * MS).tolist() == [2, 3, 4]
+    assert index.near(3000, 2000, 1500).tolist() == [4, 5]
+    assert index.position(2) == frames.index.position(2) == (2 * MS, 1000, 2000, 3000)
+    assert np.isnan(index.position(3)[1:]).all()
+
+
+def test_pre_roll_around_shots(tmp_path):
+    recorder = _recorder_module()
+    from tema_imaging.hardware.arduino_trigger import TriggerEvent
+
+    # 50 ms before and after the shot, a frame every 10 ms
+    start = 1000 * MS
+    frames = recorder.FrameRecorder(tmp_path, "raw", around_shots=(0.05, 0.05))
+    for i in range(10):
+        frames.submit(np.zeros((2, 2), np.uint8), start + i * 10 * MS)
+    frames.on_shot(TriggerEvent("D", start + 100 * MS))
+    for i in range(11, 20):
+        frames.submit(np.zeros((2, 2), np.uint8), start + i * 10 * MS)
+    frames.stop()
+
+    numbers = frames.index.between(0, 2 * start)
+    times = [(frames.index.position(n)[0] - start) // MS for n in numbers]
+    assert times == [50, 60, 70, 80, 90, 110, 120, 130, 140, 150]
+    assert frames.dropped == 0
@@ -0,0 +1,118 @@
+# This file is part of the TEMAimaging project.
+# Copyright (c) 2020, ETH Zurich
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+import serial
+import serial.threaded
+
+from tema_imaging.hardware.laser_compex import (
+    CompexLaserProtocol,
+    CompexTimeout,
+    OpMode,
+)
+from tema_imaging.hardware.urlhandler import register
+
+TELEMETRY = ["OPMODE?", "HV?", "EGY?", "PRESSURE?", "RESERVOIR TEMP?"]
+EXPECTED = ["OFF:0", "22.0", "0.0", "3500", "35.0"]
+
+
+def _open_laser(url):
+    register()
+    port = serial.serial_for_url(url, timeout=1)
+    thread = serial.threaded.ReaderThread(port, CompexLaserProtocol)
+    thread.start()
+    _, laser = thread.connect()
+    laser.timeout = 0.1
+    laser.resync_time = 0.1
+    laser.pipeline_depth = 3
+    yield laser, port.device
+    thread.stop()
+    laser.stop()
+
+
+@pytest.fixture
+def laser():
+    yield from _open_laser("simlaser://?realtime=0")
+
+
+@pytest.fixture
+def realtime_laser():
+    yield from _open_laser("simlaser://?latency=0")
+
+
+def _drop_responses(device, *indices):
+    """Lose the responses to the commands with the given (0-based) numbers."""
+    respond = device._respond
+
+    def drop(response: str) -> None:
+        if device.commands - 1 in indices:
+            device.dropped += 1
+        else:
+            respond(response)
+
+    device._respond = drop
+
+
+def test_query_batch(laser):
+    laser, device = laser
+    assert laser.query_batch(TELEMETRY) == EXPECTED
+    assert device.commands == 5
+    assert laser.round_trip.summary() is not None
+    assert laser.timeouts == 0
+
+    sample = laser.poll_telemetry(gas=True)
+    assert sample.status == (OpMode.OFF, 0)
+    assert (sample.hv, sample.pressure, sample.tube_temp) == (22.0, 3500, 35.0)
+
+
+@pytest.mark.parametrize("lost", [0, 1, 4])
+def test_lost_response_resync(laser, lost):
+    laser, device = laser
+    _drop_responses(device, lost)
+
+    # the following responses match the wrong queries until one times out,
+    # then the batch is sent again
+    assert laser.query_batch(TELEMETRY) == EXPECTED
+    assert device.dropped == 1
+    assert laser.timeouts == 1
+
+
+def test_retries_exhausted(laser):
+    laser, device = laser
+    laser.retries = 2
+    _drop_responses(device, 0, 1, 2)
+
+    with pytest.raises(CompexTimeout):
+        laser.command_with_response("HV?")
+    assert laser.timeouts == 3
+    # the port stays usable
+    assert laser.hv == 22.0
+
+
+def test_late_response_discarded(realtime_laser):
+    laser, device = realtime_laser
+    laser.retries = 0
+    device.counts = 7
+
+    # answered after the timeout, while resynchronizing
+    device.latency = 0.15
+    with pytest.raises(CompexTimeout):
+        laser.command_with_response("COUNTS?")
+    device.latency = 0
+
+    assert laser.hv == 22.0
+    assert laser.counts == 7
+    assert device.commands == 3
@@ -0,0 +1,84 @@
+# This file is part of the TEMAimaging project.
+# Copyright (c) 2020, ETH Zurich
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+import pytest
+
+from tema_imaging.hardware.stage import AxisType, MovementQueue, MovementQueueFull
+from tema_imaging.scans import Spot
+
+
+def test_order_across_wrap_around():
+    queue = MovementQueue(capacity=4)
+    queue.put(Spot(1, 2, 3))
+    queue.put({AxisType.X: 4, AxisType.Y: 5, AxisType.Z: 6})
+    assert queue.pop() == (1, 2, 3, MovementQueue.AXES_ALL)
+
+    # the second chunk wraps to the start of the arrays
+    frames = np.array([[7, 8], [9, 10], [11, 12]])
+    assert queue.extend(frames, MovementQueue.AXES_XY) == 3
+    assert queue.pop() == (4, 5, 6, MovementQueue.AXES_ALL)
+    queue.put(Spot(13, 14, 15))
+
+    popped = [queue.pop() for _ in range(len(queue))]
+    assert [frame[:2] for frame in popped] == [(7, 8), (9, 10), (11, 12), (13, 14)]
+    assert popped[-1] == (13, 14, 15, MovementQueue.AXES_ALL)
+    with pytest.raises(IndexError):
+        queue.pop()
+
+
+def test_full_at_capacity():
+    queue = MovementQueue(capacity=3)
+    assert queue.extend(np.zeros((5, 3))) == 3
+    assert queue.free == 0
+    with pytest.raises(MovementQueueFull):
+        queue.put(Spot(0, 0, 0))
+    with pytest.raises(MovementQueueFull):
+        queue.put(Spot(0, 0, 0), block=True, timeout=0.01)
+    assert queue.extend(np.zeros((1, 3))) == 0
+
+    queue.pop()
+    queue.put(Spot(1, 1, 1))
+    assert len(queue) == 3
+
+
+def test_clear():
+    queue = MovementQueue(capacity=3)
+    queue.extend(np.arange(9).reshape(3, 3))
+    queue.pop()
+    queue.clear()
+    assert len(queue) == 0
+    assert queue.free == 3
+
+    queue.put(Spot(1, 2, 3))
+    assert queue.pop() == (1, 2, 3, MovementQueue.AXES_ALL)
+
+
+def test_mask_round_trip():
+    queue = MovementQueue(capacity=8)
+    queue.put(Spot(1, 2))
+    queue.put({AxisType.Z: 3.4})
+    queue.put({AxisType.X: 5, AxisType.Z: 6})
+    masks = np.array([0b001, 0b110], dtype=np.uint8)
+    queue.extend(np.array([[7, 8, 9], [10, 11, 12]]), masks)
+
+    assert [queue.pop()[3] for _ in range(len(queue))] == [
+        0b011,
+        0b100,
+        0b101,
+        0b001,
+        0b110,
+    ]
@@ -0,0 +1,112 @@
+# This file is part of the TEMAimaging project.
+# Copyright (c) 2020, ETH Zurich
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+import pytest
+
+from tema_imaging.core.telemetry import (
+    PositionHistory,
+    StagePosition,
+    TelemetryBuffer,
+    opmode_code,
+    opmode_from_code,
+)
+from tema_imaging.hardware.laser_compex import LaserSample, OpMode
+
+LEVELS = ((0.0, 5), (10.0, 4), (60.0, 3))
+
+
+def _sample(t: float) -> LaserSample:
+    # odd seconds are ON and lack the pressure reading
+    odd = int(t) % 2
+    return LaserSample(
+        wall_time=t,
+        monotonic=t,
+        status=(OpMode.ON if odd else OpMode.OFF, None),
+        hv=20.0,
+        egy=t,
+        pressure=None if odd else int(t),
+    )
+
+
+@pytest.fixture
+def buffer():
+    buffer = TelemetryBuffer(LEVELS)
+    for t in range(100, 160):
+        buffer.append(_sample(t))
+    return buffer
+
+
+def test_raw_rollover(buffer):
+    window = buffer.window(157)
+    assert window.resolution == 0
+    assert window.time.tolist() == [157, 158, 159]
+    assert window.egy.tolist() == [157, 158, 159]
+    assert np.isnan(window.pressure[0])
+    assert buffer.latest.get().wall_time == 159
+
+    # the raw level only holds the last 5 samples
+    assert buffer.window(155).time.tolist() == [155, 156, 157, 158, 159]
+    assert buffer.window(154).resolution == 10
+
+
+def test_aggregation(buffer):
+    # 100 has been rolled over, 150 is still being averaged
+    window = buffer.window(110)
+    assert window.resolution == 10
+    assert window.time.tolist() == [110, 120, 130, 140]
+    assert window.egy.tolist() == [114.5, 124.5, 134.5, 144.5]
+    assert window.hv.tolist() == [20] * 4
+    # readings missing in a sample are left out of the mean
+    assert window.pressure.tolist() == [114, 124, 134, 144]
+    # the bucket keeps the last opmode
+    assert window.opmode.tolist() == [opmode_code(OpMode.ON)] * 4
+
+    window = buffer.window(0)
+    assert window.resolution == 60
+    assert window.time.tolist() == [60]
+    assert window.egy.tolist() == [109.5]
+
+
+def test_window_max_points(buffer):
+    assert buffer.window(120, 140).time.tolist() == [120, 130, 140]
+    assert buffer.window(120, 140, max_points=3).resolution == 10
+    # too many points, the next coarser level is used
+    assert buffer.window(120, 140, max_points=2).resolution == 60
+
+
+def test_opmode_code():
+    for mode in OpMode:
+        assert opmode_from_code(opmode_code(mode)) == mode
+    assert opmode_from_code(opmode_code(None)) is None
+
+
+def test_nearest_position():
+    history = PositionHistory(capacity=3)
+    assert history.nearest(0) is None
+
+    for t in (100, 200, 300, 400):
+        history.append(StagePosition(t, t, -t, 0))
+
+    # 100 has been rolled over
+    assert history.nearest(0).monotonic_ns == 200
+    assert history.nearest(1000).monotonic_ns == 400
+    assert history.nearest(240).monotonic_ns == 200
+    assert history.nearest(260).monotonic_ns == 300
+    assert history.nearest(300) == StagePosition(300, 300, -300, 0)
+
+    history.clear()
+    assert history.nearest(300) is None
@@ -0,0 +1,162 @@
+# This file is part of the TEMAimaging project.
+# Copyright (c) 2020, ETH Zurich
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+import numpy as np
+import pytest
+import serial
+import serial.threaded
+
+from tema_imaging.hardware.trigger_program import (
+    PROGRAM_DTYPE,
+    SPOT_CLEANING,
+    SPOT_TOF_ONLY,
+    program_runs,
+    spot_program,
+)
+
+
+def test_spot_program_layout():
+    program = spot_program(4, 7, cleaning=True, blank_spots=2)
+    assert program.dtype == PROGRAM_DTYPE
+    assert program["shots"].tolist() == [0, 0, 7, 7, 7, 7]
+    assert program["flags"].tolist() == [SPOT_TOF_ONLY] * 2 + [SPOT_CLEANING] * 4
+
+
+def test_spot_program_without_cleaning():
+    program = spot_program(3, 1)
+    assert program["shots"].tolist() == [1, 1, 1]
+    assert not program["flags"].any()
+
+
+def test_spot_program_shot_range():
+    assert spot_program(1, 65535)["shots"][0] == 65535
+    with pytest.raises(ValueError):
+        spot_program(10, 65536)
+    with pytest.raises(ValueError):
+        spot_program(10, -1)
+
+
+def test_program_runs():
+    # a uniform scan is a single run after the blank spots
+    assert program_runs(spot_program(1000, 5, blank_spots=2)) == [
+        (2, 0, SPOT_TOF_ONLY),
+        (1000, 5, 0),
+    ]
+    assert program_runs(spot_program(0, 5)) == []
+
+    program = np.array(
+        [(1, 0), (1, 0), (2, 0), (2, SPOT_CLEANING), (2, SPOT_CLEANING), (1, 0)],
+        dtype=PROGRAM_DTYPE,
+    )
+    runs = program_runs(program)
+    assert runs == [(2, 1, 0), (1, 2, 0), (2, 2, SPOT_CLEANING), (1, 1, 0)]
+    # expands to the program again
+    assert [(s, f) for n, s, f in runs for _ in range(n)] == program.tolist()
+
+
+def _open_trigger(url):
+    # the trigger notifies the GUI through wx
+    pytest.importorskip("wx")
+    from tema_imaging.hardware.arduino_trigger import ArduTrigger
+    from tema_imaging.hardware.urlhandler import register
+
+    register()
+    port = serial.serial_for_url(url, timeout=1)
+    thread = serial.threaded.ReaderThread(port, ArduTrigger)
+    thread.start()
+    _, trigger = thread.connect()
+    trigger.detect_protocol()
+    yield trigger, port.device
+    thread.stop()
+    trigger.stop()
+
+
+@pytest.fixture
+def trigger():
+    yield from _open_trigger("simtrigger://?realtime=0")
+
+
+@pytest.fixture
+def realtime_trigger():
+    yield from _open_trigger("simtrigger://")
+
+
+def test_program_upload_and_steps(trigger):
+    from tema_imaging.hardware.arduino_trigger import (
+        PROTOCOL_SPOT_PROGRAM,
+        ArduTriggerException,
+    )
+
+    trigger, device = trigger
+    assert trigger.protocol_version == PROTOCOL_SPOT_PROGRAM
+
+    done = []
+    trigger.on_done += done.append
+    trigger.configure(5, 1000, True)
+    assert trigger.upload_program(spot_program(100, 5, blank_spots=2))
+    assert device.program == [(2, 0, SPOT_TOF_ONLY), (100, 5, 0)]
+    assert trigger.program_length == 102
+
+    for _ in range(102):
+        trigger.step_and_wait()
+    with pytest.raises(ArduTriggerException):
+        trigger.step()
+
+    assert [event.kind for event in done] == ["D"] * 102
+    assert device.shots == 500
+    assert device.tof_triggers == 102
+
+
+def test_step_trigger_event(trigger):
+    trigger, device = trigger
+    received = threading.Event()
+    steps = []
+
+    def on_step(event) -> None:
+        steps.append(event)
+        received.set()
+
+    trigger.on_step += on_step
+    device.step_trigger()
+    assert received.wait(1.0)
+    assert steps[0].kind == "S"
+
+
+def test_stop_continuous_run(realtime_trigger):
+    trigger, device = realtime_trigger
+    commands = []
+    handle_line = device._handle_line
+
+    def record(line: str) -> None:
+        commands.append(line)
+        handle_line(line)
+
+    device._handle_line = record
+    # every G keeps the device busy for 50 ms
+    trigger.configure(5, 100, True)
+    trigger.rep_count = 1000
+    trigger.start_trigger()
+    while commands.count("G") < 3:
+        time.sleep(0.01)
+    trigger.stop_trigger()
+    assert trigger.stop_done_event.wait(1.0)
+
+    # the run ends with the stop command, no go is sent after it
+    assert commands[-1] == "S"
+    assert commands.count("G") < 1000